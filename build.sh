@@ -5,4 +5,9 @@ pip install -r requirements.txt
 
 python manage.py collectstatic --no-input
 
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
+
+python manage.py createcachetable
+
+python manage.py poblar_consumo_diario --si-vacia
+python manage.py poblar_rendimiento --si-vacia
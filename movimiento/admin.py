@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import Movimiento, MovimientoItem, DetalleEntrada, DetalleSalida
+from .models import (
+    ConsumoDiario, Movimiento, MovimientoItem, DetalleEntrada, DetalleSalida, RendimientoEquipo, UltimaEntrega,
+)
 
 
 class MovimientoItemInline(admin.TabularInline):
@@ -78,3 +80,36 @@ class DetalleEntradaAdmin(admin.ModelAdmin):
 @admin.register(DetalleSalida)
 class DetalleSalidaAdmin(admin.ModelAdmin):
     list_display = ('movimiento', 'cliente', 'tecnico')
+
+
+@admin.register(ConsumoDiario)
+class ConsumoDiarioAdmin(admin.ModelAdmin):
+    """Resumen diario de movimientos aprobados (solo lectura, lo mantiene approve())."""
+    list_display = ('fecha', 'sucursal', 'producto', 'tipo', 'items', 'unidades', 'movimientos')
+    list_filter = ('sucursal', 'tipo')
+    search_fields = ('producto__codigo_interno', 'producto__descripcion')
+    list_select_related = ('producto', 'sucursal')
+    date_hierarchy = 'fecha'
+    readonly_fields = ('sucursal', 'producto', 'fecha', 'tipo', 'items', 'unidades', 'movimientos')
+
+
+@admin.register(RendimientoEquipo)
+class RendimientoEquipoAdmin(admin.ModelAdmin):
+    """Estadísticas de uso entre entregas (solo lectura, las mantiene verificar_vida_util_de())."""
+    list_display = ('producto', 'equipo_cliente', 'sucursal', 'ciclos', 'ultimo_snapshot', 'ultima_fecha')
+    list_filter = ('sucursal',)
+    search_fields = ('producto__codigo_interno', 'equipo_cliente__alias')
+    list_select_related = ('producto', 'equipo_cliente', 'sucursal')
+    readonly_fields = (
+        'sucursal', 'producto', 'equipo_cliente', 'ultimo_snapshot', 'ultima_cantidad', 'ultima_fecha',
+        'ciclos', 'suma', 'suma_cuadrados', 'suma_por_pieza', 'suma_cuadrados_por_pieza',
+    )
+
+
+@admin.register(UltimaEntrega)
+class UltimaEntregaAdmin(admin.ModelAdmin):
+    """Última entrega por producto y equipo (solo lectura, la mantiene verificar_vida_util_de())."""
+    list_display = ('producto', 'equipo_cliente', 'contador_uso_snapshot', 'creado')
+    search_fields = ('producto__codigo_interno', 'equipo_cliente__alias')
+    list_select_related = ('producto', 'equipo_cliente')
+    readonly_fields = ('producto', 'equipo_cliente', 'item', 'contador_uso_snapshot', 'creado')
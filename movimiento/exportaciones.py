@@ -0,0 +1,53 @@
+"""Exportación de movimientos: la usan MovimientoViewSet.exportar y los trabajos en segundo plano."""
+from django_filters.filterset import filterset_factory
+from django_filters.utils import translate_validation
+
+from utils.exports import Exportacion, Hoja
+
+from .models import Movimiento, MovimientoItem
+
+# Mismos filtros que MovimientoViewSet.filterset_fields.
+CAMPOS_FILTRO = ['items__producto', 'detalle_salida__cliente']
+
+
+def movimientos_filtrados(sucursal_id, params):
+    """Movimientos de la sucursal con los filtros del listado (fechas y filterset)."""
+    queryset = Movimiento.objects.filter(sucursal=sucursal_id)
+    if params.get('fechaInicio'):
+        queryset = queryset.filter(creado__date__gte=params['fechaInicio'])
+    if params.get('fechaFin'):
+        queryset = queryset.filter(creado__date__lte=params['fechaFin'])
+
+    filterset = filterset_factory(Movimiento, fields=CAMPOS_FILTRO)(data=params, queryset=queryset)
+    if not filterset.is_valid():
+        raise translate_validation(filterset.errors)
+    return filterset.qs
+
+
+def movimientos(sucursal_id, params, usuario):
+    # Proyección de una fila por item; los filtros se aplican a los movimientos.
+    filas = (
+        MovimientoItem.objects.filter(movimiento__in=movimientos_filtrados(sucursal_id, params).values('pk'))
+        .order_by('-movimiento__creado', '-movimiento_id', 'producto__codigo_interno', 'id')
+        .values_list(
+            'movimiento_id', 'movimiento__tipo', 'movimiento__creado', 'movimiento__aprobado',
+            'producto__codigo_interno', 'cantidad',
+        )
+    )
+    columnas = [
+        ('movimiento_id', 'ID'),
+        ('tipo', 'Tipo'),
+        ('creado', 'Fecha'),
+        ('aprobado', 'Aprobado'),
+        ('producto', 'Producto'),
+        ('cantidad', 'Cantidad'),
+    ]
+    tipos = dict(Movimiento.MOV_TYPES)
+
+    def formatear(fila):
+        movimiento_id, tipo, creado, aprobado, producto, cantidad = fila
+        return [
+            movimiento_id, tipos[tipo], creado.strftime('%d/%m/%Y %H:%M'), 'Sí' if aprobado else 'No',
+            producto, cantidad,
+        ]
+    return Exportacion('movimientos', [Hoja('Movimientos', columnas, filas, formatear)])
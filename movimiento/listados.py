@@ -0,0 +1,125 @@
+"""Listado de movimientos construido desde .values(); ver productos/listados.py."""
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from rest_framework import serializers
+
+from .models import MovimientoItem
+from organizacion.models import PerfilUsuario
+from productos.listados import anidado
+
+_fecha = serializers.DateTimeField()
+
+
+class MovimientoListado:
+    """Equivalente de MovimientoSerializer(many=True) para el listado."""
+    columnas = (
+        'id', 'creado_por_id', 'user_aprueba_id',
+        'detalle_entrada__id', 'detalle_entrada__recibido_por_id', 'detalle_entrada__numero_factura',
+        'detalle_salida__id', 'detalle_salida__cliente_id', 'detalle_salida__cliente__nombre',
+        'detalle_salida__tecnico', 'detalle_salida__subtipo',
+        'tipo', 'creado', 'aprobado', 'aprobado_fecha', 'comentarios', 'sucursal_id',
+    )
+    columnas_item = (
+        'id', 'movimiento_id', 'producto_id', 'producto__codigo_interno', 'producto__descripcion',
+        'lote__id', 'lote__codigo_lote', 'lote__fecha_entrada',
+        'equipo_cliente__id', 'equipo_cliente__alias', 'equipo_cliente__contador_uso',
+        'cantidad', 'contador_uso_snapshot', 'cambio_anticipado', 'motivo_cambio',
+        'asignacion',
+    )
+
+    def __init__(self, context):
+        self.context = context
+
+    def valores(self, queryset):
+        return queryset.prefetch_related(None).values(*self.columnas)
+
+    def _items(self, movimiento_ids):
+        items = defaultdict(list)
+        # Mismo orden que el Prefetch de MovimientoViewSet (Meta.ordering de MovimientoItem).
+        for f in MovimientoItem.objects.filter(movimiento_id__in=movimiento_ids).values(*self.columnas_item):
+            lote = anidado(f, 'lote', ('id', 'codigo_lote', 'fecha_entrada'))
+            if lote is not None:
+                lote['fecha_entrada'] = _fecha.to_representation(lote['fecha_entrada'])
+            items[f['movimiento_id']].append({
+                'id': f['id'],
+                'producto': {
+                    'id': f['producto_id'],
+                    'codigo_interno': f['producto__codigo_interno'],
+                    'descripcion': f['producto__descripcion'],
+                },
+                'lote': lote,
+                'equipo_cliente': anidado(f, 'equipo_cliente', ('id', 'alias', 'contador_uso')),
+                'cantidad': f['cantidad'],
+                'contador_uso_snapshot': f['contador_uso_snapshot'],
+                'cambio_anticipado': f['cambio_anticipado'],
+                'motivo_cambio': f['motivo_cambio'],
+                'asignacion': f['asignacion'],
+                'movimiento': f['movimiento_id'],
+            })
+        return items
+
+    def _usuarios(self, usuario_ids):
+        """{id: dict de UserSerializer} para los usuarios referenciados, en una consulta."""
+        avatar = PerfilUsuario._meta.get_field('avatar')
+        request = self.context.get('request')
+        usuarios = {}
+        for f in User.objects.filter(pk__in=usuario_ids).values(
+            'id', 'username', 'email', 'first_name', 'last_name',
+            'profile__id', 'profile__rol', 'profile__avatar', 'profile__telefono',
+        ):
+            usuario = {'id': f['id'], 'username': f['username'], 'email': f['email']}
+            # Como UserSerializer: sin perfil se omite la llave.
+            if f['profile__id'] is not None:
+                url = avatar.storage.url(f['profile__avatar']) if f['profile__avatar'] else None
+                if url and request is not None:
+                    url = request.build_absolute_uri(url)
+                usuario['profile'] = {'rol': f['profile__rol'], 'avatar': url, 'telefono': f['profile__telefono']}
+            nombre = f"{f['first_name']} {f['last_name']}".strip()
+            usuario['full_name'] = nombre or f['username']
+            usuarios[f['id']] = usuario
+        return usuarios
+
+    def construir(self, filas):
+        filas = list(filas)
+        items = self._items([f['id'] for f in filas])
+        usuarios = self._usuarios({
+            pk for f in filas
+            for pk in (f['creado_por_id'], f['user_aprueba_id'], f['detalle_entrada__recibido_por_id'])
+            if pk is not None
+        })
+
+        resultado = []
+        for f in filas:
+            detalle_entrada = None
+            if f['detalle_entrada__id'] is not None:
+                detalle_entrada = {
+                    'id': f['detalle_entrada__id'],
+                    'recibido_por': usuarios.get(f['detalle_entrada__recibido_por_id']),
+                    'numero_factura': f['detalle_entrada__numero_factura'],
+                    'movimiento': f['id'],
+                }
+            detalle_salida = None
+            if f['detalle_salida__id'] is not None:
+                detalle_salida = {
+                    'id': f['detalle_salida__id'],
+                    'cliente': {'id': f['detalle_salida__cliente_id'], 'nombre': f['detalle_salida__cliente__nombre']},
+                    'tecnico': f['detalle_salida__tecnico'],
+                    'subtipo': f['detalle_salida__subtipo'],
+                    'movimiento': f['id'],
+                }
+            resultado.append({
+                'id': f['id'],
+                'creado_por': usuarios.get(f['creado_por_id']),
+                'user_aprueba': usuarios.get(f['user_aprueba_id']),
+                'items': items.get(f['id'], []),
+                'detalle_entrada': detalle_entrada,
+                'detalle_salida': detalle_salida,
+                'tipo': f['tipo'],
+                'creado': _fecha.to_representation(f['creado']),
+                'aprobado': f['aprobado'],
+                'aprobado_fecha': _fecha.to_representation(f['aprobado_fecha']) if f['aprobado_fecha'] else None,
+                'comentarios': f['comentarios'],
+                'sucursal': f['sucursal_id'],
+            })
+        return resultado
@@ -0,0 +1,252 @@
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count
+
+from movimiento.models import DetalleSalida, Movimiento, MovimientoItem
+from organizacion.models import Cliente, PerfilUsuario, Sucursal
+from productos.models import Categoría, Lote, Producto, RangoUnidades, StockSucursal, Unidad
+
+# SQLSTATE de PostgreSQL que se cuentan aparte del resto de errores.
+DEADLOCK = '40P01'
+SERIALIZACION = '40001'
+
+NIVELES_AISLAMIENTO = {
+    'read-committed': 'READ COMMITTED',
+    'repeatable-read': 'REPEATABLE READ',
+    'serializable': 'SERIALIZABLE',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Aprueba en paralelo salidas pendientes contra los mismos lotes y reporta throughput, '
+        'latencia p50/p99, deadlocks, fallas de serialización y unidades asignadas dos veces. '
+        'Con varios hilos requiere PostgreSQL; en SQLite solo corre con --hilos 1 (verifica las '
+        'asignaciones sin concurrencia). Los datos de prueba se confirman para que los vean todos los '
+        'hilos y se borran al final (salvo --conservar).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sucursales', type=int, default=2)
+        parser.add_argument('--lotes', type=int, default=3, help='Lotes por sucursal (uno por producto).')
+        parser.add_argument('--unidades', type=int, default=50, help='Unidades por lote.')
+        parser.add_argument('--movimientos', type=int, default=200)
+        parser.add_argument('--partidas', type=int, default=2, help='Items por movimiento.')
+        parser.add_argument('--cantidad', type=int, default=1, help='Unidades por item.')
+        parser.add_argument('--hilos', type=int, default=8)
+        parser.add_argument('--modo', choices=['individual', 'rango'], default='individual')
+        parser.add_argument('--aislamiento', choices=list(NIVELES_AISLAMIENTO), default='read-committed')
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--conservar', action='store_true', help='No borra los datos de prueba.')
+        parser.add_argument('--json', action='store_true', help='Escribe el reporte como JSON.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql' and options['hilos'] > 1:
+            raise CommandError(
+                'La prueba de concurrencia requiere PostgreSQL (SQLite serializa las escrituras); '
+                'usa --hilos 1 para verificar solo las asignaciones.'
+            )
+
+        prefijo = f'estres-{uuid.uuid4().hex[:8]}'
+        sucursales, usuario, movimientos = self._sembrar(prefijo, options)
+        try:
+            reporte = self._aprobar_en_paralelo(movimientos, usuario, options)
+            reporte.update(self._verificar(sucursales, options['modo']))
+        finally:
+            if not options['conservar']:
+                self._limpiar(sucursales, usuario, prefijo)
+
+        if options['json']:
+            self.stdout.write(json.dumps(reporte))
+            return
+        self.stdout.write(
+            f'{reporte["movimientos"]} aprobaciones con {options["hilos"]} hilos en {reporte["segundos"]:.2f}s '
+            f'({reporte["por_segundo"]:.1f}/s), aislamiento {options["aislamiento"]}, lotes {options["modo"]}'
+        )
+        self.stdout.write(f'  latencia p50 {reporte["p50_ms"]:.1f} ms, p99 {reporte["p99_ms"]:.1f} ms')
+        for resultado in ('aprobado', 'sin_existencias', 'deadlock', 'serializacion', 'error'):
+            self.stdout.write(f'  {resultado}: {reporte["resultados"].get(resultado, 0)}')
+        for error in reporte['errores']:
+            self.stdout.write(f'    {error}')
+        estilo = self.style.SUCCESS if not (reporte['duplicadas'] or reporte['lotes_descuadrados']) else self.style.ERROR
+        self.stdout.write(estilo(
+            f'Unidades asignadas dos veces: {reporte["duplicadas"]}. '
+            f'Lotes con contador descuadrado: {reporte["lotes_descuadrados"]}.'
+        ))
+
+    def _aprobar_en_paralelo(self, movimientos, usuario, options):
+        """Reparte las aprobaciones entre los hilos; cada uno usa su propia conexión."""
+        pendientes = queue.Queue()
+        for pk in movimientos:
+            pendientes.put(pk)
+        medidas = []  # (resultado, segundos, detalle); list.append es seguro entre hilos
+        salida = threading.Barrier(options['hilos'])
+        aislamiento = NIVELES_AISLAMIENTO[options['aislamiento']]
+
+        def trabajar():
+            try:
+                salida.wait()
+                while True:
+                    try:
+                        pk = pendientes.get_nowait()
+                    except queue.Empty:
+                        return
+                    inicio = time.perf_counter()
+                    resultado, detalle = self._aprobar(pk, usuario, aislamiento)
+                    medidas.append((resultado, time.perf_counter() - inicio, detalle))
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajar) for _ in range(options['hilos'])]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        segundos = time.perf_counter() - inicio
+
+        latencias = sorted(s for _, s, _ in medidas)
+        return {
+            'movimientos': len(medidas),
+            'segundos': segundos,
+            'por_segundo': len(medidas) / segundos if segundos else 0.0,
+            'p50_ms': _percentil(latencias, 50) * 1000,
+            'p99_ms': _percentil(latencias, 99) * 1000,
+            'resultados': dict(Counter(r for r, _, _ in medidas)),
+            'errores': sorted({d for r, _, d in medidas if r == 'error'}),
+        }
+
+    @staticmethod
+    def _aprobar(pk, usuario, aislamiento):
+        try:
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'SET TRANSACTION ISOLATION LEVEL {aislamiento}')
+                Movimiento.objects.get(pk=pk).approve(usuario)
+        except ValueError:
+            # Otros hilos ya se llevaron las unidades: rechazo esperado.
+            return 'sin_existencias', None
+        except DatabaseError as e:
+            sqlstate = getattr(e.__cause__, 'sqlstate', None)
+            if sqlstate == DEADLOCK:
+                return 'deadlock', None
+            if sqlstate == SERIALIZACION:
+                return 'serializacion', None
+            return 'error', f'{type(e).__name__}: {e}'.strip()
+        except Exception as e:
+            return 'error', f'{type(e).__name__}: {e}'.strip()
+        return 'aprobado', None
+
+    def _verificar(self, sucursales, modo):
+        """Cuenta unidades o series entregadas a más de un item y lotes cuyo contador no cuadra."""
+        asignaciones = MovimientoItem.objects.filter(
+            movimiento__sucursal__in=sucursales, movimiento__aprobado=True,
+        ).values_list('lote_id', 'asignacion')
+        lotes = Lote.objects.filter(sucursal__in=sucursales)
+
+        vistas = Counter()
+        for lote_id, asignacion in asignaciones:
+            if modo == 'individual':
+                vistas.update(asignacion['unidades'])
+            else:
+                for inicio, fin in asignacion['series']:
+                    vistas.update((lote_id, serie) for serie in range(inicio, fin + 1))
+        duplicadas = sum(n - 1 for n in vistas.values() if n > 1)
+
+        # El contador debe coincidir con lo que de verdad queda disponible.
+        if modo == 'individual':
+            retiradas = Counter(dict(
+                Unidad.objects.filter(lote__in=lotes).exclude(status='disponible')
+                .values('lote_id').annotate(n=Count('id')).values_list('lote_id', 'n')
+            ))
+        else:
+            retiradas = Counter()
+            for lote_id, inicio, fin in RangoUnidades.objects.filter(lote__in=lotes).values_list(
+                'lote_id', 'inicio', 'fin'
+            ):
+                retiradas[lote_id] += fin - inicio + 1
+        descuadrados = sum(
+            1 for lote_id, inicial, restante in lotes.values_list('id', 'cantidad_inicial', 'cantidad_restante')
+            if restante != inicial - retiradas[lote_id]
+        )
+        return {'duplicadas': duplicadas, 'lotes_descuadrados': descuadrados}
+
+    def _sembrar(self, prefijo, options):
+        rng = random.Random(options['semilla'])
+        with transaction.atomic():
+            sucursales = Sucursal.objects.bulk_create([
+                Sucursal(nombre=f'{prefijo}-{i}') for i in range(options['sucursales'])
+            ])
+            usuario = User.objects.create_user(username=prefijo, first_name='Estrés')
+            perfil = PerfilUsuario.objects.create(usuario=usuario, rol='admin')
+            perfil.sucursales.set(sucursales)
+
+            categoria = Categoría.objects.create(nombre=prefijo)
+            productos = Producto.objects.bulk_create([
+                Producto(
+                    codigo_interno=f'{prefijo}-{j}', descripcion=f'Producto estrés {j}', categoria=categoria,
+                    sku=f'{prefijo}-{j}', min_stock=0,
+                )
+                for j in range(options['lotes'])
+            ])
+            lotes = Lote.objects.bulk_create([
+                Lote(
+                    producto=producto, codigo_lote=f'{prefijo}-{sucursal.pk}-{producto.pk}', sucursal=sucursal,
+                    cantidad_inicial=options['unidades'], cantidad_restante=options['unidades'],
+                    modo_unidades=options['modo'],
+                )
+                for sucursal in sucursales for producto in productos
+            ])
+            if options['modo'] == 'individual':
+                Unidad.objects.crear_disponibles(lotes)
+            StockSucursal.recalcular((lote.producto_id, lote.sucursal_id) for lote in lotes)
+
+            clientes = {
+                sucursal.pk: Cliente.objects.create(nombre=f'{prefijo}-{sucursal.pk}', sucursal=sucursal)
+                for sucursal in sucursales
+            }
+            movimientos = Movimiento.objects.bulk_create([
+                Movimiento(tipo='salida', creado_por=usuario, sucursal=sucursales[i % len(sucursales)])
+                for i in range(options['movimientos'])
+            ], batch_size=1000)
+            DetalleSalida.objects.bulk_create([
+                DetalleSalida(movimiento=m, cliente=clientes[m.sucursal_id], subtipo='venta') for m in movimientos
+            ], batch_size=1000)
+            lotes_de = {sucursal.pk: [lote for lote in lotes if lote.sucursal_id == sucursal.pk] for sucursal in sucursales}
+            items = []
+            for m in movimientos:
+                for lote in rng.choices(lotes_de[m.sucursal_id], k=options['partidas']):
+                    items.append(MovimientoItem(
+                        movimiento=m, producto_id=lote.producto_id, lote=lote, cantidad=options['cantidad'],
+                    ))
+            MovimientoItem.objects.bulk_create(items, batch_size=1000)
+
+        orden = [m.pk for m in movimientos]
+        rng.shuffle(orden)
+        return sucursales, usuario, orden
+
+    @staticmethod
+    def _limpiar(sucursales, usuario, prefijo):
+        with transaction.atomic():
+            Movimiento.objects.filter(sucursal__in=sucursales).delete()
+            Lote.objects.filter(sucursal__in=sucursales).delete()
+            Sucursal.objects.filter(pk__in=[s.pk for s in sucursales]).delete()
+            Producto.objects.filter(codigo_interno__startswith=f'{prefijo}-').delete()
+            Categoría.objects.filter(nombre=prefijo).delete()
+            usuario.delete()
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, len(ordenados) * p // 100)]
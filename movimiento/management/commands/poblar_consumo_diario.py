@@ -0,0 +1,75 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+from movimiento.models import ConsumoDiario, MovimientoItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye la tabla ConsumoDiario a partir de los movimientos aprobados. '
+        'Sin opciones reemplaza todo el historial.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sucursal', type=int, help='Limita la reconstrucción a una sucursal.')
+        parser.add_argument('--desde', help='Solo reconstruye desde esta fecha (AAAA-MM-DD).')
+        parser.add_argument(
+            '--si-vacia', action='store_true',
+            help='No hace nada si la tabla ya tiene filas (para el despliegue).',
+        )
+
+    def handle(self, *args, **options):
+        if options['si_vacia'] and ConsumoDiario.objects.exists():
+            self.stdout.write('ConsumoDiario ya tiene filas; no se reconstruye.')
+            return
+
+        items = MovimientoItem.objects.filter(movimiento__aprobado=True)
+        existentes = ConsumoDiario.objects.all()
+        if options['sucursal']:
+            items = items.filter(movimiento__sucursal=options['sucursal'])
+            existentes = existentes.filter(sucursal=options['sucursal'])
+        if options['desde']:
+            try:
+                desde = date.fromisoformat(options['desde'])
+            except ValueError:
+                raise CommandError('--desde debe tener el formato AAAA-MM-DD.')
+            items = items.filter(movimiento__creado__date__gte=desde)
+            existentes = existentes.filter(fecha__gte=desde)
+
+        # Fecha local (TIME_ZONE), igual que ConsumoDiario.registrar().
+        agregados = (
+            items.values(
+                'producto_id',
+                sucursal=F('movimiento__sucursal'),
+                fecha=TruncDate('movimiento__creado'),
+                tipo=F('movimiento__tipo'),
+            )
+            .annotate(
+                items=Count('id'),
+                unidades=Sum('cantidad'),
+                movimientos=Count('movimiento', distinct=True),
+            )
+            .order_by()
+        )
+
+        total = 0
+        with transaction.atomic():
+            existentes.delete()
+            lote = []
+            for r in agregados.iterator(chunk_size=2000):
+                lote.append(ConsumoDiario(
+                    sucursal_id=r['sucursal'], producto_id=r['producto_id'], fecha=r['fecha'], tipo=r['tipo'],
+                    items=r['items'], unidades=r['unidades'], movimientos=r['movimientos'],
+                ))
+                if len(lote) == 1000:
+                    ConsumoDiario.objects.bulk_create(lote)
+                    total += len(lote)
+                    lote = []
+            ConsumoDiario.objects.bulk_create(lote)
+            total += len(lote)
+
+        self.stdout.write(self.style.SUCCESS(f'{total} filas de consumo diario generadas.'))
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from movimiento.models import CicloRendimiento, MovimientoItem, RendimientoEquipo
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye RendimientoEquipo y CicloRendimiento a partir de las salidas aprobadas '
+        'con contador. Sin opciones reemplaza todo el historial.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sucursal', type=int, help='Limita la reconstrucción a una sucursal.')
+        parser.add_argument(
+            '--si-vacia', action='store_true',
+            help='No hace nada si la tabla ya tiene filas (para el despliegue).',
+        )
+
+    def handle(self, *args, **options):
+        if options['si_vacia'] and RendimientoEquipo.objects.exists():
+            self.stdout.write('RendimientoEquipo ya tiene filas; no se reconstruye.')
+            return
+
+        items = MovimientoItem.objects.all()
+        pares = RendimientoEquipo.objects.all()
+        ciclos = CicloRendimiento.objects.all()
+        if options['sucursal']:
+            items = items.filter(movimiento__sucursal=options['sucursal'])
+            pares = pares.filter(sucursal=options['sucursal'])
+            ciclos = ciclos.filter(sucursal=options['sucursal'])
+
+        # Mismo recorrido que usa la aprobación al rehacer un par: orden de creación.
+        entregas = RendimientoEquipo.entregas(items).iterator(chunk_size=2000)
+
+        # Las entregas llegan agrupadas por par: se guarda cada par al terminarlo.
+        total_pares = total_ciclos = 0
+        with transaction.atomic():
+            ciclos.delete()
+            pares.delete()
+            nuevos_pares, nuevos_ciclos = [], []
+            for rendimiento, ciclo in RendimientoEquipo.rehacer(entregas):
+                if not nuevos_pares or nuevos_pares[-1] is not rendimiento:
+                    nuevos_pares.append(rendimiento)
+                if ciclo is not None:
+                    nuevos_ciclos.append(ciclo)
+
+                if len(nuevos_ciclos) >= 1000:
+                    CicloRendimiento.objects.bulk_create(nuevos_ciclos)
+                    total_ciclos += len(nuevos_ciclos)
+                    nuevos_ciclos = []
+                if len(nuevos_pares) > 1000:
+                    # El último par puede seguir recibiendo entregas.
+                    RendimientoEquipo.objects.bulk_create(nuevos_pares[:-1])
+                    total_pares += len(nuevos_pares) - 1
+                    nuevos_pares = nuevos_pares[-1:]
+
+            CicloRendimiento.objects.bulk_create(nuevos_ciclos)
+            RendimientoEquipo.objects.bulk_create(nuevos_pares)
+            total_ciclos += len(nuevos_ciclos)
+            total_pares += len(nuevos_pares)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total_pares} pares y {total_ciclos} ciclos de rendimiento generados.'
+        ))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movimiento', '0016_detallesalida_subtipo'),
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0024_lote_modo_unidades'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['sucursal', 'aprobado', 'tipo', 'creado'], name='movimiento_sucursal_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoitem',
+            index=models.Index(fields=['producto', 'equipo_cliente'], name='item_producto_equipo_idx'),
+        ),
+    ]
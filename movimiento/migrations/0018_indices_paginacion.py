@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movimiento', '0017_indices_consultas'),
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['sucursal', '-creado', '-id'], name='movimiento_sucursal_pagina_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movimiento', '0018_indices_paginacion'),
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0027_catalogo_actualizado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('tipo', models.CharField(choices=[('entrada', 'Entrada de inventario'), ('salida', 'Salida de inventario')], max_length=10)),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('movimientos', models.PositiveIntegerField(default=0)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumo_diario', to='productos.producto')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumo_diario', to='organizacion.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Consumo diario',
+                'verbose_name_plural': 'Consumo diario',
+                'indexes': [models.Index(fields=['sucursal', 'fecha'], name='consumo_sucursal_fecha_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sucursal', 'producto', 'fecha', 'tipo'), name='consumo_diario_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movimiento', '0019_consumo_diario'),
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0027_catalogo_actualizado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CicloRendimiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_anterior', models.DateField()),
+                ('fecha', models.DateField()),
+                ('delta', models.PositiveIntegerField()),
+                ('cantidad_anterior', models.PositiveIntegerField()),
+                ('equipo_cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ciclos_rendimiento', to='organizacion.equipocliente')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ciclos_rendimiento', to='productos.producto')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ciclos_rendimiento', to='organizacion.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Ciclo de rendimiento',
+                'verbose_name_plural': 'Ciclos de rendimiento',
+                'indexes': [models.Index(fields=['sucursal', 'fecha'], name='ciclo_sucursal_fecha_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RendimientoEquipo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultimo_snapshot', models.PositiveIntegerField()),
+                ('ultima_cantidad', models.PositiveIntegerField()),
+                ('ultima_fecha', models.DateField()),
+                ('ciclos', models.PositiveIntegerField(default=0)),
+                ('suma', models.BigIntegerField(default=0)),
+                ('suma_cuadrados', models.BigIntegerField(default=0)),
+                ('suma_por_pieza', models.FloatField(default=0)),
+                ('suma_cuadrados_por_pieza', models.FloatField(default=0)),
+                ('equipo_cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rendimientos', to='organizacion.equipocliente')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rendimientos', to='productos.producto')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rendimientos', to='organizacion.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Rendimiento por equipo',
+                'verbose_name_plural': 'Rendimiento por equipo',
+                'constraints': [models.UniqueConstraint(fields=('sucursal', 'producto', 'equipo_cliente'), name='rendimiento_equipo_unico')],
+            },
+        ),
+    ]
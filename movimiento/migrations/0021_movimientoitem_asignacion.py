@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movimiento', '0020_rendimiento_equipo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimientoitem',
+            name='asignacion',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_ultimas_entregas(apps, schema_editor):
+    # Misma entrega que buscaba verificar_vida_util(): la de movimiento más reciente con snapshot.
+    MovimientoItem = apps.get_model('movimiento', 'MovimientoItem')
+    UltimaEntrega = apps.get_model('movimiento', 'UltimaEntrega')
+    filas = (
+        MovimientoItem.objects.filter(
+            equipo_cliente__isnull=False,
+            contador_uso_snapshot__isnull=False,
+            movimiento__detalle_salida__cliente=F('equipo_cliente__cliente'),
+        )
+        .order_by('producto_id', 'equipo_cliente_id', '-movimiento__creado', '-id')
+        .values_list('id', 'producto_id', 'equipo_cliente_id', 'contador_uso_snapshot', 'movimiento__creado')
+    )
+    nuevas, anterior = [], None
+    for item_id, producto_id, equipo_cliente_id, snapshot, creado in filas.iterator(chunk_size=2000):
+        if (producto_id, equipo_cliente_id) == anterior:
+            continue
+        anterior = (producto_id, equipo_cliente_id)
+        nuevas.append(UltimaEntrega(
+            producto_id=producto_id, equipo_cliente_id=equipo_cliente_id, item_id=item_id,
+            contador_uso_snapshot=snapshot, creado=creado,
+        ))
+    UltimaEntrega.objects.bulk_create(nuevas, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movimiento', '0021_movimientoitem_asignacion'),
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0027_catalogo_actualizado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UltimaEntrega',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contador_uso_snapshot', models.PositiveIntegerField()),
+                ('creado', models.DateTimeField()),
+                ('equipo_cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ultimas_entregas', to='organizacion.equipocliente')),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='movimiento.movimientoitem')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ultimas_entregas', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Última entrega',
+                'verbose_name_plural': 'Últimas entregas',
+                'constraints': [models.UniqueConstraint(fields=('producto', 'equipo_cliente'), name='ultima_entrega_unica')],
+            },
+        ),
+        migrations.RunPython(fill_ultimas_entregas, reverse_code=migrations.RunPython.noop),
+    ]
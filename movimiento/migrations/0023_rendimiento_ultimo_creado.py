@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:34
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def fill_ultimo_creado(apps, schema_editor):
+    # Creación de la entrega más reciente de cada par, para detectar aprobaciones fuera de orden.
+    MovimientoItem = apps.get_model('movimiento', 'MovimientoItem')
+    RendimientoEquipo = apps.get_model('movimiento', 'RendimientoEquipo')
+    ultima = (
+        MovimientoItem.objects.filter(
+            movimiento__tipo='salida',
+            movimiento__aprobado=True,
+            movimiento__sucursal=OuterRef('sucursal'),
+            producto=OuterRef('producto'),
+            equipo_cliente=OuterRef('equipo_cliente'),
+            contador_uso_snapshot__isnull=False,
+        )
+        .values('producto')
+        .annotate(creado=Max('movimiento__creado'))
+        .values('creado')
+    )
+    RendimientoEquipo.objects.update(ultimo_creado=Subquery(ultima))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movimiento', '0022_ultima_entrega'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rendimientoequipo',
+            name='ultimo_creado',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_ultimo_creado, reverse_code=migrations.RunPython.noop),
+    ]
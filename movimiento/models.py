@@ -1,13 +1,18 @@
 import uuid
+from collections import Counter
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models import Count, Sum
 from django.utils import timezone
 
 from organizacion.models import Cliente, EquipoCliente
-from productos.models import Producto, Lote, Unidad
+from productos.models import Producto, Lote, StockSucursal, Unidad
 from utils.validators import validar_factura_entrada
 
+from .signals import movimiento_aprobado
+
 
 class Movimiento(models.Model):
     MOV_TYPES = [
@@ -33,43 +38,64 @@ class Movimiento(models.Model):
         ordering = ['-creado']
         verbose_name = 'Movimiento'
         verbose_name_plural = 'Movimientos'
+        indexes = [
+            # Filtro común de reportes y alertas: sucursal + aprobado + tipo + rango de fechas.
+            models.Index(fields=['sucursal', 'aprobado', 'tipo', 'creado'], name='movimiento_sucursal_estado_idx'),
+            # Paginación keyset del listado por sucursal.
+            models.Index(fields=['sucursal', '-creado', '-id'], name='movimiento_sucursal_pagina_idx'),
+        ]
 
     def __str__(self):
         return f'Movimiento {self.id} ({self.tipo})'
 
-    @transaction.atomic
-    def approve(self, user):
-        if self.items.exclude(producto__status='activo').exists():
-            raise ValueError('No se pueden aprobar movimientos con productos inactivos.')
-
+    @staticmethod
+    def verificar_permiso_aprobar(user, sucursal_id):
+        """Lanza PermissionError si `user` no puede aprobar movimientos de la sucursal."""
         if user.profile.rol != 'admin':
             raise PermissionError('Solo administradores pueden aprobar movimientos.')
-        if not user.profile.sucursales.filter(id=self.sucursal_id).exists():
+        if not user.profile.sucursales.filter(id=sucursal_id).exists():
             raise PermissionError('No tienes permisos para aprobar movimientos de esta sucursal.')
+
+    @transaction.atomic
+    def approve(self, user, permisos_verificados=False):
+        """Aprueba el movimiento y crea o retira su inventario.
+
+        Los lotes y unidades de todos los items se procesan en conjunto
+        (MovimientoItem.crear_lotes / asignar_lotes / verificar_vida_util_de):
+        el número de consultas no depende de cuántos items tenga.
+        Con permisos_verificados=True el llamador ya hizo verificar_permiso_aprobar
+        para la sucursal del movimiento (aprobación en lote).
+        """
+        items = list(self.items.select_related('producto', 'lote', 'equipo_cliente'))
+        if any(item.producto.status != 'activo' for item in items):
+            raise ValueError('No se pueden aprobar movimientos con productos inactivos.')
+
+        if not permisos_verificados:
+            Movimiento.verificar_permiso_aprobar(user, self.sucursal_id)
         if self.aprobado:
             raise ValueError('Movimiento ya aprobado.')
 
         if hasattr(self, 'detalle_entrada'):
-            validar_factura_entrada(self.detalle_entrada.numero_factura, self.items.all())
+            validar_factura_entrada(self.detalle_entrada.numero_factura, items)
 
         self.aprobado = True
         self.aprobado_fecha = timezone.now()
         self.user_aprueba = user
         self.save()
 
-        # Procesar cada item según el tipo de movimiento
+        # Procesar los items según el tipo de movimiento
         if hasattr(self, 'detalle_entrada'):
-            for item in self.items.all():
-                item.crear_lote()
+            MovimientoItem.crear_lotes(items)
         elif hasattr(self, 'detalle_salida'):
-            es_renta = self.detalle_salida.subtipo == 'renta'
-            for item in self.items.all():
-                if es_renta:
-                    item.verificar_vida_util()
-                item.asignar_unidades()
+            if self.detalle_salida.subtipo == 'renta':
+                MovimientoItem.verificar_vida_util_de(items)
+            MovimientoItem.asignar_lotes(items)
         else:
             raise RuntimeError('Movimiento sin detalle asociado.')
 
+        ConsumoDiario.registrar(self)
+        movimiento_aprobado.send(sender=Movimiento, instance=self)
+
 
 class DetalleEntrada(models.Model):
     movimiento = models.OneToOneField(
@@ -124,6 +150,9 @@ class MovimientoItem(models.Model):
     contador_uso_snapshot = models.PositiveIntegerField(null=True, blank=True)
     cambio_anticipado = models.BooleanField(default=False)
     motivo_cambio = models.TextField(blank=True, null=True)
+    # Lo que retiró la aprobación de una salida: {'unidades': [ids]} de un lote
+    # individual o {'series': [[inicio, fin], ...]} de uno compacto.
+    asignacion = models.JSONField(null=True, blank=True)
 
     def save(self, *args, **kwargs):
         # Si se indica lote, validar que el producto del lote coincida con el producto del item
@@ -136,64 +165,480 @@ class MovimientoItem(models.Model):
 
     # Entrada
     def crear_lote(self):
-        codigo = f'{timezone.now().strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}'
-
-        lote = Lote.objects.create(
-            producto=self.producto,
-            codigo_lote=codigo,
-            cantidad_inicial=self.cantidad,
-            sucursal=self.movimiento.sucursal,
-        )
-
-        unidades = [Unidad(lote=lote) for _ in range(self.cantidad)]
-        Unidad.objects.bulk_create(unidades)
+        return MovimientoItem.crear_lotes([self])[0]
+
+    @classmethod
+    def crear_lotes(cls, items):
+        """Crea un lote por item de entrada: un INSERT de lotes, uno de unidades y un UPDATE de items.
+
+        Con LOTES_UNIDADES_COMPACTAS las unidades se derivan de las series
+        1..cantidad y no se crean filas. Devuelve los lotes en el orden de items.
+        """
+        if not items:
+            return []
+        compactos = settings.LOTES_UNIDADES_COMPACTAS
+        marca = timezone.now().strftime('%Y%m%d%H%M%S')
+        lotes = Lote.objects.bulk_create([
+            Lote(
+                producto_id=item.producto_id,
+                codigo_lote=f'{marca}-{uuid.uuid4().hex[:8]}',
+                cantidad_inicial=item.cantidad,
+                cantidad_restante=item.cantidad,
+                modo_unidades='rango' if compactos else 'individual',
+                sucursal_id=item.movimiento.sucursal_id,
+            )
+            for item in items
+        ])
+        if not compactos:
+            Unidad.objects.crear_disponibles(lotes)
 
-        self.lote = lote
-        self.save(update_fields=['lote'])
-        return lote
+        for item, lote in zip(items, lotes):
+            item.lote = lote
+        cls.objects.bulk_update(items, ['lote'])
+        StockSucursal.recalcular((lote.producto_id, lote.sucursal_id) for lote in lotes)
+        return lotes
 
     # Salida
     def verificar_vida_util(self):
-        if not self.equipo_cliente:
-            raise ValueError(f'Item {self.producto.codigo_interno} no tiene equipo_cliente asignado.')
-
-        producto = self.producto
-        eq_cli = self.equipo_cliente
-
-        ultima = MovimientoItem.objects.filter(
-            producto=producto,
-            movimiento__detalle_salida__cliente=eq_cli.cliente,
-            equipo_cliente=eq_cli,
-            contador_uso_snapshot__isnull=False
-        ).exclude(pk=self.pk).order_by('-movimiento__creado').first()
-
-        if ultima:
-            uso_desde_ultima = eq_cli.contador_uso - ultima.contador_uso_snapshot
-            if uso_desde_ultima < producto.vida_util and not self.cambio_anticipado:
-                raise ValueError(
-                    f'{producto.codigo_interno} requiere {producto.vida_util} unidades de uso '
-                    f'entre entregas. Solo se han consumido {uso_desde_ultima} desde la última entrega.'
+        MovimientoItem.verificar_vida_util_de([self])
+
+    @classmethod
+    @transaction.atomic
+    def verificar_vida_util_de(cls, items):
+        """Verifica la vida útil de los items de una renta y guarda su contador_uso_snapshot.
+
+        La entrega previa de cada (producto, equipo_cliente) sale de UltimaEntrega:
+        una lectura para todos los items, un bulk_update de los snapshots y un
+        upsert de los punteros, sin importar cuántos items haya. Un item repetido
+        dentro del movimiento se compara contra el anterior, como si fueran dos entregas.
+        """
+        for item in items:
+            if not item.equipo_cliente_id:
+                raise ValueError(f'Item {item.producto.codigo_interno} no tiene equipo_cliente asignado.')
+        if not items:
+            return
+
+        pares = {(item.producto_id, item.equipo_cliente_id) for item in items}
+        ultimas = {
+            (u.producto_id, u.equipo_cliente_id): u
+            for u in UltimaEntrega.objects.select_for_update().filter(
+                producto_id__in={p for p, _ in pares}, equipo_cliente_id__in={e for _, e in pares},
+            ).order_by('pk')
+            if (u.producto_id, u.equipo_cliente_id) in pares
+        }
+
+        nuevas = {}
+        for item in items:
+            producto = item.producto
+            eq_cli = item.equipo_cliente
+            par = (item.producto_id, item.equipo_cliente_id)
+
+            ultima = ultimas.get(par)
+            if ultima:
+                uso_desde_ultima = eq_cli.contador_uso - ultima.contador_uso_snapshot
+                if uso_desde_ultima < producto.vida_util and not item.cambio_anticipado:
+                    raise ValueError(
+                        f'{producto.codigo_interno} requiere {producto.vida_util} unidades de uso '
+                        f'entre entregas. Solo se han consumido {uso_desde_ultima} desde la última entrega.'
+                    )
+
+            item.contador_uso_snapshot = eq_cli.contador_uso
+            # La última entrega es la de movimiento más reciente, no la última aprobada.
+            if ultima is None or item.movimiento.creado >= ultima.creado:
+                ultimas[par] = nuevas[par] = UltimaEntrega(
+                    producto_id=item.producto_id, equipo_cliente_id=item.equipo_cliente_id, item=item,
+                    contador_uso_snapshot=item.contador_uso_snapshot, creado=item.movimiento.creado,
                 )
 
-        self.contador_uso_snapshot = eq_cli.contador_uso
-        self.save(update_fields=['contador_uso_snapshot'])
+        cls.objects.bulk_update(items, ['contador_uso_snapshot'])
+        UltimaEntrega.objects.bulk_create(
+            [nuevas[par] for par in sorted(nuevas)],
+            update_conflicts=True, unique_fields=['producto', 'equipo_cliente'],
+            update_fields=['item', 'contador_uso_snapshot', 'creado'],
+        )
+        RendimientoEquipo.registrar_items(items)
 
     def asignar_unidades(self):
-        if not self.lote:
-            raise ValueError('Lote debe estar especificado para asignar unidades.')
+        return MovimientoItem.asignar_lotes([self])[0]
 
-        disponibles = self.lote.unidades.filter(status='disponible').select_for_update().order_by('id')[:self.cantidad]
-
-        if disponibles.count() < self.cantidad:
-            raise ValueError(
-                f'No hay suficientes unidades de {self.producto.codigo_interno} en el lote {self.lote.codigo_lote}'
+    @classmethod
+    @transaction.atomic
+    def asignar_lotes(cls, items):
+        """Retira las unidades de los items de salida de sus lotes, con un número fijo de consultas.
+
+        Lotes individuales: Unidad.objects.retirar_disponibles toma las unidades
+        de todos los items en una sentencia (SKIP LOCKED en PostgreSQL). Lotes
+        compactos: se bloquean y se retiran series (Lote.retirar_series_de).
+        Lo asignado a cada item queda en `asignacion` y se devuelve en orden:
+        ids de Unidad o tramos de series.
+        """
+        for item in items:
+            if not item.lote_id:
+                raise ValueError('Lote debe estar especificado para asignar unidades.')
+
+        def faltan(item, lote):
+            return ValueError(
+                f'No hay suficientes unidades de {item.producto.codigo_interno} en el lote {lote.codigo_lote}'
             )
 
-        ids = disponibles.values_list('pk', flat=True)
-        self.lote.unidades.filter(pk__in=ids).update(status='retirada', actualizado=timezone.now())
-        return disponibles
+        compactos = [item for item in items if item.lote.modo_unidades == 'rango']
+        individuales = [item for item in items if item.lote.modo_unidades != 'rango']
+
+        if individuales:
+            pedidas = Counter()
+            for item in individuales:
+                pedidas[item.lote_id] += item.cantidad
+            retiradas = Unidad.objects.retirar_disponibles(pedidas)
+            for item in individuales:
+                disponibles = retiradas[item.lote_id]
+                if len(disponibles) < item.cantidad:
+                    raise faltan(item, item.lote)
+                item.asignacion = {'unidades': disponibles[:item.cantidad]}
+                retiradas[item.lote_id] = disponibles[item.cantidad:]
+            # Al final: el UPDATE del contador bloquea el lote hasta confirmar.
+            Lote.descontar(pedidas)
+
+        if compactos:
+            # En orden de id: dos aprobaciones bloquean sus lotes en el mismo orden.
+            bloqueados = {
+                lote.pk: lote
+                for lote in Lote.objects.select_for_update().filter(pk__in={i.lote_id for i in compactos}).order_by('pk')
+            }
+            pedidas = Counter()
+            for item in compactos:
+                lote = bloqueados[item.lote_id]
+                pedidas[lote.pk] += item.cantidad
+                if lote.cantidad_restante < pedidas[lote.pk]:
+                    raise faltan(item, lote)
+            # retirar_series_de toma en cuenta los pedidos previos del mismo lote.
+            tramos = Lote.retirar_series_de([(bloqueados[item.lote_id], item.cantidad) for item in compactos])
+            for item, tomados in zip(compactos, tramos):
+                item.asignacion = {'series': [list(tramo) for tramo in tomados]}
+
+        cls.objects.bulk_update(items, ['asignacion'])
+        return [
+            item.asignacion['unidades'] if 'unidades' in item.asignacion else item.asignacion['series']
+            for item in items
+        ]
 
     class Meta:
         ordering = ['-movimiento__creado', 'producto__codigo_interno']
         verbose_name = 'Item de movimiento'
         verbose_name_plural = 'Items de movimientos'
+        indexes = [
+            # Historial de entregas por (producto, equipo_cliente): vida útil y rendimiento.
+            models.Index(fields=['producto', 'equipo_cliente'], name='item_producto_equipo_idx'),
+        ]
+
+
+class UltimaEntrega(models.Model):
+    """Última entrega con contador por (producto, equipo_cliente).
+
+    Puntero que lee MovimientoItem.verificar_vida_util_de() en lugar de buscar
+    la salida previa en el historial de items. Se actualiza al aprobar rentas y
+    la migración que lo crea lo llena desde el historial.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='ultimas_entregas')
+    equipo_cliente = models.ForeignKey(EquipoCliente, on_delete=models.CASCADE, related_name='ultimas_entregas')
+    # Si se borra el item, el snapshot conserva el punto de comparación.
+    item = models.ForeignKey(MovimientoItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    contador_uso_snapshot = models.PositiveIntegerField()
+    # Movimiento.creado de la entrega.
+    creado = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Última entrega'
+        verbose_name_plural = 'Últimas entregas'
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'equipo_cliente'], name='ultima_entrega_unica'),
+        ]
+
+    def __str__(self):
+        return f'{self.producto_id} en {self.equipo_cliente_id}: {self.contador_uso_snapshot}'
+
+
+class ConsumoDiario(models.Model):
+    """Resumen diario de movimientos aprobados por (sucursal, producto, fecha, tipo).
+
+    Tabla de hechos para reportes y alertas de consumo: se suma en
+    Movimiento.approve() y se reconstruye con `manage.py poblar_consumo_diario`.
+    La fecha es la local (TIME_ZONE) de Movimiento.creado.
+    """
+    sucursal = models.ForeignKey('organizacion.Sucursal', on_delete=models.CASCADE, related_name='consumo_diario')
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='consumo_diario')
+    fecha = models.DateField()
+    tipo = models.CharField(max_length=10, choices=Movimiento.MOV_TYPES)
+
+    items = models.PositiveIntegerField(default=0)
+    unidades = models.PositiveIntegerField(default=0)
+    movimientos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Consumo diario'
+        verbose_name_plural = 'Consumo diario'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sucursal', 'producto', 'fecha', 'tipo'], name='consumo_diario_unico'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['sucursal', 'fecha'], name='consumo_sucursal_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.producto_id} {self.tipo} {self.fecha} en sucursal {self.sucursal_id}: {self.unidades}'
+
+    @classmethod
+    def registrar(cls, movimiento):
+        """Suma las partidas de un movimiento recién aprobado a sus filas del día."""
+        fecha = timezone.localdate(movimiento.creado)
+        filas = [
+            (movimiento.sucursal_id, r['producto_id'], fecha, movimiento.tipo, r['items'], r['unidades'], 1)
+            for r in movimiento.items.values('producto_id')
+            .annotate(items=Count('id'), unidades=Sum('cantidad'))
+            .order_by('producto_id')
+        ]
+        cls.sumar(filas)
+
+    @classmethod
+    def sumar(cls, filas):
+        """Upsert que incrementa los contadores de cada (sucursal, producto, fecha, tipo).
+
+        bulk_create(update_conflicts=True) reemplaza los valores; aquí se suman
+        (ON CONFLICT DO UPDATE SET x = x + excluded.x, válido en PostgreSQL y
+        SQLite) para que dos aprobaciones concurrentes del mismo día no se pisen.
+        Las filas van ordenadas por llave para bloquearlas siempre en el mismo orden.
+        """
+        if not filas:
+            return
+        q = connection.ops.quote_name
+        tabla = q(cls._meta.db_table)
+        llave = ', '.join(q(c) for c in ('sucursal_id', 'producto_id', 'fecha', 'tipo'))
+        contadores = ('items', 'unidades', 'movimientos')
+        sql = (
+            f'INSERT INTO {tabla} ({llave}, {", ".join(q(c) for c in contadores)}) '
+            f'VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(filas))} '
+            f'ON CONFLICT ({llave}) DO UPDATE SET '
+            + ', '.join(f'{q(c)} = {tabla}.{q(c)} + EXCLUDED.{q(c)}' for c in contadores)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [valor for fila in sorted(filas, key=lambda f: f[:4]) for valor in fila])
+
+
+class RendimientoEquipo(models.Model):
+    """Estadísticas acumuladas de uso entre entregas por (sucursal, producto, equipo_cliente).
+
+    Guarda la última entrega y los agregados de los deltas de contador (uso
+    consumido entre dos entregas consecutivas) para que el reporte de
+    rendimiento sea una suma por producto. Cada delta también queda en
+    CicloRendimiento para los reportes acotados por fecha.
+
+    Las entregas cuentan en orden de creación del movimiento, como UltimaEntrega
+    y el reporte original. MovimientoItem.verificar_vida_util_de() las suma al
+    aprobar; si se aprueba una entrega creada antes que la última del par, el
+    par se rehace desde su historial. `manage.py poblar_rendimiento` rehace
+    todos los pares con el mismo recorrido (rehacer()).
+    """
+    sucursal = models.ForeignKey('organizacion.Sucursal', on_delete=models.CASCADE, related_name='rendimientos')
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='rendimientos')
+    equipo_cliente = models.ForeignKey(EquipoCliente, on_delete=models.CASCADE, related_name='rendimientos')
+
+    ultimo_snapshot = models.PositiveIntegerField()
+    ultima_cantidad = models.PositiveIntegerField()
+    ultima_fecha = models.DateField()
+    # Creación del movimiento de la última entrega; null en pares previos a este campo.
+    ultimo_creado = models.DateTimeField(null=True, blank=True)
+
+    ciclos = models.PositiveIntegerField(default=0)
+    suma = models.BigIntegerField(default=0)
+    suma_cuadrados = models.BigIntegerField(default=0)
+    # Mismos agregados con cada delta dividido entre las piezas de la entrega previa.
+    suma_por_pieza = models.FloatField(default=0)
+    suma_cuadrados_por_pieza = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = 'Rendimiento por equipo'
+        verbose_name_plural = 'Rendimiento por equipo'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sucursal', 'producto', 'equipo_cliente'], name='rendimiento_equipo_unico'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.producto_id} en {self.equipo_cliente_id}: {self.ciclos} ciclos'
+
+    @property
+    def llave(self):
+        return self.sucursal_id, self.producto_id, self.equipo_cliente_id
+
+    @staticmethod
+    def entregas(items):
+        """Las entregas de `items` que cuentan, agrupadas por par y en orden de creación, como tuplas
+        (sucursal, producto, equipo_cliente, snapshot, cantidad, creado) para rehacer()."""
+        return items.filter(
+            movimiento__tipo='salida',
+            movimiento__aprobado=True,
+            equipo_cliente__isnull=False,
+            contador_uso_snapshot__isnull=False,
+        ).order_by(
+            'movimiento__sucursal', 'producto_id', 'equipo_cliente_id', 'movimiento__creado', 'id',
+        ).values_list(
+            'movimiento__sucursal', 'producto_id', 'equipo_cliente_id',
+            'contador_uso_snapshot', 'cantidad', 'movimiento__creado',
+        )
+
+    @classmethod
+    def rehacer(cls, entregas):
+        """Recorre entregas() y genera (par, ciclo) por entrega, sin guardar nada.
+
+        La primera entrega de cada par crea un par nuevo y no tiene ciclo; las
+        siguientes lo avanzan (el ciclo es None si el contador se reinició).
+        """
+        actual = None
+        for sucursal_id, producto_id, equipo_cliente_id, snapshot, cantidad, creado in entregas:
+            if actual is None or actual.llave != (sucursal_id, producto_id, equipo_cliente_id):
+                actual = cls(
+                    sucursal_id=sucursal_id, producto_id=producto_id, equipo_cliente_id=equipo_cliente_id,
+                    ultimo_snapshot=snapshot, ultima_cantidad=cantidad, ultima_fecha=timezone.localdate(creado),
+                    ultimo_creado=creado,
+                )
+                yield actual, None
+            else:
+                yield actual, actual.avanzar(snapshot, cantidad, creado)
+
+    @classmethod
+    def registrar(cls, item):
+        """Suma la entrega `item` (con contador_uso_snapshot ya guardado) a su par."""
+        ciclos = cls.registrar_items([item])
+        return ciclos[0] if ciclos else None
+
+    @classmethod
+    @transaction.atomic
+    def registrar_items(cls, items):
+        """registrar() para varias entregas, en orden de creación, con un número fijo de consultas.
+
+        Bloquea los pares existentes, los avanza en memoria y guarda pares y
+        ciclos con bulk_create / bulk_update. Una entrega creada antes que la
+        última del par (aprobada fuera de orden) hace que el par se rehaga
+        desde su historial. Devuelve los ciclos creados.
+        """
+        llaves = {(i.movimiento.sucursal_id, i.producto_id, i.equipo_cliente_id) for i in items}
+        if not llaves:
+            return []
+        pares = {
+            r.llave: r
+            for r in cls.objects.select_for_update().filter(
+                sucursal_id__in={s for s, _, _ in llaves},
+                producto_id__in={p for _, p, _ in llaves},
+                equipo_cliente_id__in={e for _, _, e in llaves},
+            ).order_by('pk')
+            if r.llave in llaves
+        }
+
+        ciclos, fuera_de_orden = [], set()
+        for item in sorted(items, key=lambda i: (i.movimiento.creado, i.pk)):
+            llave = (item.movimiento.sucursal_id, item.producto_id, item.equipo_cliente_id)
+            creado = item.movimiento.creado
+            if llave in fuera_de_orden:
+                continue
+            rendimiento = pares.get(llave)
+            if rendimiento is None:
+                pares[llave] = cls(
+                    sucursal_id=llave[0], producto_id=llave[1], equipo_cliente_id=llave[2],
+                    ultimo_snapshot=item.contador_uso_snapshot, ultima_cantidad=item.cantidad,
+                    ultima_fecha=timezone.localdate(creado), ultimo_creado=creado,
+                )
+            elif rendimiento.ultimo_creado is not None and creado < rendimiento.ultimo_creado:
+                fuera_de_orden.add(llave)
+            else:
+                ciclos.append((llave, rendimiento.avanzar(item.contador_uso_snapshot, item.cantidad, creado)))
+        ciclos = [ciclo for llave, ciclo in ciclos if ciclo is not None and llave not in fuera_de_orden]
+
+        if fuera_de_orden:
+            ciclos += cls._rehacer_pares(fuera_de_orden, pares)
+
+        cls.objects.bulk_create([r for r in pares.values() if r.pk is None])
+        cls.objects.bulk_update(
+            [r for r in pares.values() if r.pk is not None],
+            ['ultimo_snapshot', 'ultima_cantidad', 'ultima_fecha', 'ultimo_creado', 'ciclos', 'suma',
+             'suma_cuadrados', 'suma_por_pieza', 'suma_cuadrados_por_pieza'],
+        )
+        CicloRendimiento.objects.bulk_create(ciclos)
+        return ciclos
+
+    @classmethod
+    def _rehacer_pares(cls, llaves, pares):
+        """Rehace en `pares` los pares de `llaves` desde su historial (los items ya aprobados,
+        incluidos los de esta aprobación) y borra sus ciclos; devuelve los ciclos nuevos."""
+        filtro_items, filtro_ciclos = models.Q(), models.Q()
+        for sucursal_id, producto_id, equipo_cliente_id in sorted(llaves):
+            filtro_items |= models.Q(
+                movimiento__sucursal=sucursal_id, producto=producto_id, equipo_cliente=equipo_cliente_id,
+            )
+            filtro_ciclos |= models.Q(sucursal=sucursal_id, producto=producto_id, equipo_cliente=equipo_cliente_id)
+        CicloRendimiento.objects.filter(filtro_ciclos).delete()
+
+        ciclos = []
+        for rendimiento, ciclo in cls.rehacer(cls.entregas(MovimientoItem.objects.filter(filtro_items))):
+            # Conserva la fila existente del par (la primera vez, la bloqueada arriba).
+            rendimiento.pk = pares[rendimiento.llave].pk
+            pares[rendimiento.llave] = rendimiento
+            if ciclo is not None:
+                ciclos.append(ciclo)
+        return ciclos
+
+    def avanzar(self, snapshot, cantidad, creado):
+        """Pasa a la entrega siguiente (creada en `creado`); devuelve su CicloRendimiento sin guardar.
+
+        Un delta negativo (contador reiniciado) no cuenta como ciclo, pero la
+        entrega sí pasa a ser la última.
+        """
+        fecha = timezone.localdate(creado)
+        delta = snapshot - self.ultimo_snapshot
+        ciclo = None
+        if delta >= 0:
+            por_pieza = delta / (self.ultima_cantidad or 1)
+            self.ciclos += 1
+            self.suma += delta
+            self.suma_cuadrados += delta * delta
+            self.suma_por_pieza += por_pieza
+            self.suma_cuadrados_por_pieza += por_pieza * por_pieza
+            ciclo = CicloRendimiento(
+                sucursal_id=self.sucursal_id, producto_id=self.producto_id,
+                equipo_cliente_id=self.equipo_cliente_id,
+                fecha_anterior=self.ultima_fecha, fecha=fecha,
+                delta=delta, cantidad_anterior=self.ultima_cantidad or 1,
+            )
+        self.ultimo_snapshot = snapshot
+        self.ultima_cantidad = cantidad
+        self.ultima_fecha = fecha
+        self.ultimo_creado = creado
+        return ciclo
+
+
+class CicloRendimiento(models.Model):
+    """Un delta de contador entre dos entregas consecutivas del mismo par.
+
+    Las fechas son las locales de ambas entregas: un reporte entre dos fechas
+    toma los ciclos con las dos entregas dentro del rango.
+    """
+    sucursal = models.ForeignKey('organizacion.Sucursal', on_delete=models.CASCADE, related_name='ciclos_rendimiento')
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='ciclos_rendimiento')
+    equipo_cliente = models.ForeignKey(
+        EquipoCliente, on_delete=models.CASCADE, related_name='ciclos_rendimiento'
+    )
+    fecha_anterior = models.DateField()
+    fecha = models.DateField()
+    delta = models.PositiveIntegerField()
+    cantidad_anterior = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = 'Ciclo de rendimiento'
+        verbose_name_plural = 'Ciclos de rendimiento'
+        indexes = [
+            models.Index(fields=['sucursal', 'fecha'], name='ciclo_sucursal_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.producto_id} en {self.equipo_cliente_id}: {self.delta} ({self.fecha})'
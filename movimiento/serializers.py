@@ -40,7 +40,7 @@ class MovimientoItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = MovimientoItem
         fields = '__all__'
-        read_only_fields = ['id', 'movimiento']
+        read_only_fields = ['id', 'movimiento', 'asignacion']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -54,6 +54,11 @@ class MovimientoItemSerializer(serializers.ModelSerializer):
                 sucursal=request.branch_id
             ).select_related('producto')
 
+    def validate_cantidad(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('La cantidad debe ser mayor que cero.')
+        return value
+
     def validate(self, data):
         if data.get('cambio_anticipado') and not (data.get('motivo_cambio') or '').strip():
             raise serializers.ValidationError(
@@ -140,7 +145,7 @@ class MovimientoSerializer(WritableNestedModelSerializer):
 
             # Chequeo de disponibilidad de unidades para cada item
             for item in data['items']:
-                count = item['lote'].unidades.filter(status='disponible').count()
+                count = item['lote'].cantidad_restante
                 if count < item['cantidad']:
                     raise serializers.ValidationError(
                         f'No hay suficientes unidades disponibles ({count}) en el lote {item["lote"].codigo_lote} para la salida.'
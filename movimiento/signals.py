@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Se envía al final de Movimiento.approve(), con los lotes y unidades ya procesados.
+# Argumentos: sender=Movimiento, instance.
+movimiento_aprobado = Signal()
@@ -1,8 +1,13 @@
+import json
+from io import StringIO
+from unittest import skipUnless
 from unittest.mock import patch
 import datetime
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.serializers import ValidationError
@@ -10,9 +15,14 @@ from rest_framework.test import APITestCase, APIRequestFactory
 from rest_framework import status
 
 from organizacion.models import Cliente, EquipoCliente, PerfilUsuario, Sucursal
-from productos.models import Categoría, Equipo, Lote, Marca, Producto, Proveedor, Unidad
-from .models import DetalleEntrada, DetalleSalida, Movimiento, MovimientoItem
+from productos.models import Categoría, Equipo, Lote, Marca, Producto, Proveedor, StockSucursal, Unidad
+from system.models import RegistroActividad
+from .models import (
+    CicloRendimiento, ConsumoDiario, DetalleEntrada, DetalleSalida, Movimiento, MovimientoItem, RendimientoEquipo,
+    UltimaEntrega,
+)
 from .serializers import MovimientoSerializer
+from .views import MovimientoViewSet
 
 
 def _create_admin():
@@ -42,6 +52,14 @@ def _create_producto(codigo='P001', vida_util=5):
     )
 
 
+def _entrega_previa(item):
+    """Registra `item` (con snapshot) como la última entrega de su par, como al aprobarlo."""
+    return UltimaEntrega.objects.create(
+        producto=item.producto, equipo_cliente=item.equipo_cliente, item=item,
+        contador_uso_snapshot=item.contador_uso_snapshot, creado=item.movimiento.creado,
+    )
+
+
 # ── Model Tests ──────────────────────────────────────────────────────
 
 
@@ -81,19 +99,19 @@ class MovimientoModelTest(TestCase):
             self.movimiento.approve(self.admin)
 
     @patch('movimiento.models.validar_factura_entrada')
-    @patch('movimiento.models.MovimientoItem.crear_lote')
-    def test_approve_entrada_calls_crear_lote(self, mock_crear_lote, mock_val):
+    @patch('movimiento.models.MovimientoItem.crear_lotes')
+    def test_approve_entrada_calls_crear_lotes(self, mock_crear_lotes, mock_val):
         mock_val.return_value = True
         DetalleEntrada.objects.create(
             movimiento=self.movimiento,
             numero_factura='F001',
             recibido_por=self.admin,
         )
-        MovimientoItem.objects.create(
+        item = MovimientoItem.objects.create(
             movimiento=self.movimiento, producto=self.producto, cantidad=5
         )
         self.movimiento.approve(self.admin)
-        mock_crear_lote.assert_called_once()
+        mock_crear_lotes.assert_called_once_with([item])
 
     def test_approve_salida_calls_asignar_unidades(self):
         producto = _create_producto(codigo='P002')
@@ -181,10 +199,10 @@ class MovimientoModelTest(TestCase):
             aprobado=True, sucursal_id=1,
         )
         DetalleSalida.objects.create(movimiento=prev_mov, cliente=cliente, subtipo='renta')
-        MovimientoItem.objects.create(
+        _entrega_previa(MovimientoItem.objects.create(
             movimiento=prev_mov, producto=producto, cantidad=1,
             lote=lote, equipo_cliente=equipo_cliente, contador_uso_snapshot=50,
-        )
+        ))
 
         movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal_id=1)
         DetalleSalida.objects.create(movimiento=movimiento, cliente=cliente, subtipo='venta')
@@ -224,6 +242,182 @@ class MovimientoModelTest(TestCase):
             movimiento.approve(self.admin)
 
 
+class AprobacionEnConjuntoTest(TestCase):
+    """approve() procesa todos los items juntos: las consultas no dependen de cuántos sean."""
+    def setUp(self):
+        self.admin = _create_admin()
+        self.sucursal = Sucursal.objects.create(nombre='Suc Conjunto')
+        self.admin.profile.sucursales.add(self.sucursal)
+        self.productos = [_create_producto(codigo=f'P-CJ{i}') for i in range(20)]
+        self.cliente = Cliente.objects.create(nombre='Cliente Conjunto', sucursal=self.sucursal)
+
+    def _consultas(self, movimiento):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        movimiento = Movimiento.objects.get(pk=movimiento.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            movimiento.approve(self.admin)
+        return len(ctx.captured_queries)
+
+    @patch('movimiento.models.validar_factura_entrada')
+    def _entrada(self, n, _val):
+        movimiento = Movimiento.objects.create(tipo='entrada', creado_por=self.admin, sucursal=self.sucursal)
+        DetalleEntrada.objects.create(movimiento=movimiento, numero_factura=f'F-CJ{n}', recibido_por=self.admin)
+        for producto in self.productos[:n]:
+            MovimientoItem.objects.create(movimiento=movimiento, producto=producto, cantidad=5)
+        return movimiento, self._consultas(movimiento)
+
+    def _salida(self, lotes):
+        movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal=self.sucursal)
+        DetalleSalida.objects.create(movimiento=movimiento, cliente=self.cliente, subtipo='venta')
+        for lote in lotes:
+            MovimientoItem.objects.create(movimiento=movimiento, producto=lote.producto, cantidad=2, lote=lote)
+        return self._consultas(movimiento)
+
+    def _comparar(self):
+        _, con_dos = self._entrada(2)
+        entrada, con_veinte = self._entrada(20)
+        self.assertEqual(con_dos, con_veinte)
+
+        lotes = [item.lote for item in entrada.items.select_related('lote__producto').order_by('pk')]
+        self.assertEqual(self._salida(lotes[:2]), self._salida(lotes[2:]))
+
+        restantes = Lote.objects.filter(pk__in=[lote.pk for lote in lotes]).values_list('cantidad_restante', flat=True)
+        self.assertEqual(list(restantes), [3] * 20)
+        stock = StockSucursal.objects.get(sucursal=self.sucursal, producto=self.productos[19])
+        self.assertEqual(stock.cantidad_disponible, 3)
+
+    @override_settings(LOTES_UNIDADES_COMPACTAS=True)
+    def test_entrada_y_salida_compactas(self):
+        self._comparar()
+        self.assertFalse(Unidad.objects.exists())
+
+    @override_settings(LOTES_UNIDADES_COMPACTAS=False)
+    def test_entrada_y_salida_individuales(self):
+        self._comparar()
+        self.assertEqual(Unidad.objects.count(), 22 * 5)
+        self.assertEqual(Unidad.objects.filter(status='retirada').count(), 20 * 2)
+
+    def _renta(self, lotes, equipo_cliente):
+        movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal=self.sucursal)
+        DetalleSalida.objects.create(movimiento=movimiento, cliente=self.cliente, subtipo='renta')
+        for lote in lotes:
+            MovimientoItem.objects.create(
+                movimiento=movimiento, producto=lote.producto, cantidad=2, lote=lote, equipo_cliente=equipo_cliente,
+            )
+        return self._consultas(movimiento)
+
+    def test_renta_verifica_vida_util_en_conjunto(self):
+        entrada, _ = self._entrada(20)
+        lotes = [item.lote for item in entrada.items.select_related('lote__producto').order_by('pk')]
+        equipo_cliente = EquipoCliente.objects.create(
+            equipo=Equipo.objects.create(nombre='EQ-CJ', marca=Marca.objects.create(nombre='M-CJ')),
+            cliente=self.cliente, alias='EQ-CJ', contador_uso=100,
+        )
+
+        self.assertEqual(self._renta(lotes[:2], equipo_cliente), self._renta(lotes[2:], equipo_cliente))
+        self.assertEqual(
+            set(UltimaEntrega.objects.values_list('equipo_cliente_id', 'contador_uso_snapshot')),
+            {(equipo_cliente.pk, 100)},
+        )
+        self.assertEqual(UltimaEntrega.objects.count(), 20)
+
+        # vida_util=5: 3 de uso no alcanzan; 5 sí, y el puntero avanza.
+        EquipoCliente.objects.filter(pk=equipo_cliente.pk).update(contador_uso=103)
+        with self.assertRaises(ValueError):
+            self._renta(lotes[:1], equipo_cliente)
+        EquipoCliente.objects.filter(pk=equipo_cliente.pk).update(contador_uso=105)
+        self._renta(lotes[:3], equipo_cliente)
+
+        ultima = UltimaEntrega.objects.get(producto=self.productos[0], equipo_cliente=equipo_cliente)
+        self.assertEqual(ultima.contador_uso_snapshot, 105)
+        rendimiento = RendimientoEquipo.objects.get(producto=self.productos[0], equipo_cliente=equipo_cliente)
+        self.assertEqual((rendimiento.ciclos, rendimiento.suma), (1, 5))
+
+    @override_settings(LOTES_UNIDADES_COMPACTAS=False)
+    def test_items_del_mismo_lote_no_repiten_unidades(self):
+        lote = Lote.objects.create(
+            producto=self.productos[0], codigo_lote='L-CJ', cantidad_inicial=5, sucursal=self.sucursal,
+        )
+        Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(5)])
+        movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal=self.sucursal)
+        items = [
+            MovimientoItem.objects.create(movimiento=movimiento, producto=lote.producto, cantidad=n, lote=lote)
+            for n in (2, 3)
+        ]
+        primeras, siguientes = MovimientoItem.asignar_lotes(
+            list(MovimientoItem.objects.filter(pk__in=[i.pk for i in items]).select_related('lote').order_by('pk'))
+        )
+        self.assertEqual(len(primeras), 2)
+        self.assertEqual(len(siguientes), 3)
+        self.assertFalse(set(primeras) & set(siguientes))
+        lote.refresh_from_db()
+        self.assertEqual(lote.cantidad_restante, 0)
+        items[1].refresh_from_db()
+        self.assertEqual(items[1].asignacion, {'unidades': siguientes})
+
+        item = MovimientoItem.objects.create(movimiento=movimiento, producto=lote.producto, cantidad=1, lote=lote)
+        with self.assertRaises(ValueError):
+            item.asignar_unidades()
+
+    @override_settings(LOTES_UNIDADES_COMPACTAS=False)
+    def test_item_sin_unidades_devuelve_lista_vacia(self):
+        lote = Lote.objects.create(
+            producto=self.productos[0], codigo_lote='L-VACIO', cantidad_inicial=2, sucursal=self.sucursal,
+        )
+        Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(2)])
+        movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal=self.sucursal)
+        items = [
+            MovimientoItem.objects.create(movimiento=movimiento, producto=lote.producto, cantidad=n, lote=lote)
+            for n in (0, 2)
+        ]
+
+        vacias, unidades = MovimientoItem.asignar_lotes(items)
+        self.assertEqual(vacias, [])
+        self.assertEqual(len(unidades), 2)
+        self.assertEqual(items[0].asignacion, {'unidades': []})
+
+    @override_settings(LOTES_UNIDADES_COMPACTAS=False)
+    def test_retirar_disponibles_toma_las_primeras_en_una_sentencia(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        lotes = [
+            Lote.objects.create(producto=producto, codigo_lote=f'L-RD{i}', cantidad_inicial=4, sucursal=self.sucursal)
+            for i, producto in enumerate(self.productos[:2])
+        ]
+        for lote in lotes:
+            Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(4)])
+        ids = [list(lote.unidades.order_by('pk').values_list('pk', flat=True)) for lote in lotes]
+        Unidad.objects.filter(pk=ids[0][0]).update(status='retirada')
+
+        with CaptureQueriesContext(connection) as ctx:
+            retiradas = Unidad.objects.retirar_disponibles({lotes[0].pk: 2, lotes[1].pk: 9})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(retiradas[lotes[0].pk], ids[0][1:3])
+        self.assertEqual(retiradas[lotes[1].pk], ids[1])
+        self.assertEqual(Unidad.objects.filter(status='disponible').count(), 1)
+
+    @override_settings(LOTES_UNIDADES_COMPACTAS=False)
+    def test_unidades_insuficientes_no_retiran_nada(self):
+        lotes = [
+            Lote.objects.create(producto=producto, codigo_lote=f'L-NS{i}', cantidad_inicial=2, sucursal=self.sucursal)
+            for i, producto in enumerate(self.productos[:2])
+        ]
+        for lote in lotes:
+            Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(2)])
+        movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal=self.sucursal)
+        items = [
+            MovimientoItem.objects.create(movimiento=movimiento, producto=lote.producto, cantidad=n, lote=lote)
+            for lote, n in zip(lotes, (2, 3))
+        ]
+        with self.assertRaises(ValueError):
+            MovimientoItem.asignar_lotes(items)
+        self.assertFalse(Unidad.objects.filter(status='retirada').exists())
+        self.assertFalse(MovimientoItem.objects.filter(asignacion__isnull=False).exists())
+
+
 class MovimientoItemModelTest(TestCase):
     def setUp(self):
         self.admin = _create_admin()
@@ -236,6 +430,7 @@ class MovimientoItemModelTest(TestCase):
         )
         self.assertIn('P001', str(item))
 
+    @override_settings(LOTES_UNIDADES_COMPACTAS=False)
     def test_crear_lote_creates_unidades(self):
         item = MovimientoItem.objects.create(
             movimiento=self.movimiento, producto=self.producto, cantidad=7
@@ -243,6 +438,45 @@ class MovimientoItemModelTest(TestCase):
         lote = item.crear_lote()
         self.assertEqual(lote.cantidad_inicial, 7)
         self.assertEqual(Unidad.objects.filter(lote=lote).count(), 7)
+        lote.refresh_from_db()
+        self.assertEqual(lote.cantidad_restante, 7)
+
+    @override_settings(LOTES_UNIDADES_COMPACTAS=True)
+    def test_crear_lote_compacto_sin_filas_unidad(self):
+        item = MovimientoItem.objects.create(
+            movimiento=self.movimiento, producto=self.producto, cantidad=5000
+        )
+        lote = item.crear_lote()
+        lote.refresh_from_db()
+        self.assertEqual(lote.modo_unidades, 'rango')
+        self.assertEqual(lote.cantidad_restante, 5000)
+        self.assertFalse(Unidad.objects.filter(lote=lote).exists())
+
+    @override_settings(LOTES_UNIDADES_COMPACTAS=True)
+    def test_asignar_unidades_lote_compacto_extiende_tramo(self):
+        entrada = MovimientoItem.objects.create(
+            movimiento=self.movimiento, producto=self.producto, cantidad=10
+        )
+        lote = entrada.crear_lote()
+
+        movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal_id=1)
+        for cantidad in (3, 4):
+            item = MovimientoItem.objects.create(
+                movimiento=movimiento, producto=self.producto, cantidad=cantidad, lote=lote
+            )
+            item.asignar_unidades()
+
+        lote.refresh_from_db()
+        self.assertEqual(lote.cantidad_restante, 3)
+        self.assertEqual(list(lote.rangos.values_list('inicio', 'fin', 'status')), [(1, 7, 'retirada')])
+        item.refresh_from_db()
+        self.assertEqual(item.asignacion, {'series': [[4, 7]]})
+
+        item = MovimientoItem.objects.create(
+            movimiento=movimiento, producto=self.producto, cantidad=4, lote=lote
+        )
+        with self.assertRaises(ValueError):
+            item.asignar_unidades()
 
     def test_save_validates_lote_producto_match(self):
         otro_producto = _create_producto(codigo='P-OTHER')
@@ -272,6 +506,8 @@ class MovimientoItemModelTest(TestCase):
         self.assertEqual(
             Unidad.objects.filter(lote=lote, status='retirada').count(), 4
         )
+        lote.refresh_from_db()
+        self.assertEqual(lote.cantidad_restante, 6)
 
     def test_asignar_unidades_raises_if_not_enough(self):
         lote = Lote.objects.create(
@@ -337,6 +573,7 @@ class MovimientoItemModelTest(TestCase):
             equipo_cliente=eq_cli,
             contador_uso_snapshot=50,
         )
+        _entrega_previa(prev_item)
 
         movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal_id=1)
         DetalleSalida.objects.create(movimiento=movimiento, cliente=cliente)
@@ -353,6 +590,35 @@ class MovimientoItemModelTest(TestCase):
         self.assertIsNone(result)  # completes without error
         self.assertEqual(item.contador_uso_snapshot, 100)
 
+    def test_verificar_vida_util_actualiza_rendimiento(self):
+        cliente = Cliente.objects.create(nombre='Cliente VU R', sucursal_id=1)
+        equipo = Equipo.objects.create(nombre='EQ-VU-R', marca=Marca.objects.create(nombre='MVUR'))
+        eq_cli = EquipoCliente.objects.create(equipo=equipo, cliente=cliente, alias='EQ-VU-R', contador_uso=50)
+        lote = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-VU-R', cantidad_inicial=5, sucursal_id=1
+        )
+
+        for contador in (50, 100, 130):
+            eq_cli.contador_uso = contador
+            eq_cli.save()
+            movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal_id=1)
+            DetalleSalida.objects.create(movimiento=movimiento, cliente=cliente)
+            item = MovimientoItem.objects.create(
+                movimiento=movimiento, producto=self.producto, cantidad=2, lote=lote, equipo_cliente=eq_cli,
+            )
+            item.verificar_vida_util()
+
+        rendimiento = RendimientoEquipo.objects.get(producto=self.producto, equipo_cliente=eq_cli)
+        self.assertEqual(rendimiento.ultimo_snapshot, 130)
+        self.assertEqual(rendimiento.ciclos, 2)
+        self.assertEqual(rendimiento.suma, 80)
+        self.assertEqual(rendimiento.suma_cuadrados, 50 * 50 + 30 * 30)
+        self.assertEqual(rendimiento.suma_por_pieza, 40)
+        self.assertEqual(
+            sorted(CicloRendimiento.objects.filter(equipo_cliente=eq_cli).values_list('delta', flat=True)),
+            [30, 50],
+        )
+
     def test_verificar_vida_util_raises_if_insufficient_usage(self):
         sucursal = Sucursal.objects.create(nombre='Suc VU2')
         cliente = Cliente.objects.create(nombre='Cliente VU2', sucursal=sucursal)
@@ -381,6 +647,7 @@ class MovimientoItemModelTest(TestCase):
             equipo_cliente=eq_cli,
             contador_uso_snapshot=50,
         )
+        _entrega_previa(prev_item)
 
         movimiento = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal_id=1)
         DetalleSalida.objects.create(movimiento=movimiento, cliente=cliente)
@@ -537,6 +804,16 @@ class MovimientoSerializerTest(APITestCase):
         serializer = MovimientoSerializer(data=data, context={'request': self.request})
         self.assertTrue(serializer.is_valid(), serializer.errors)
 
+    def test_validate_rechaza_cantidad_cero(self):
+        data = {
+            'tipo': 'entrada',
+            'items': [{'producto_id': self.producto.pk, 'cantidad': 0}],
+            'detalle_entrada': {'numero_factura': 'F-CERO', 'recibido_por_id': self.admin.pk},
+        }
+        serializer = MovimientoSerializer(data=data, context={'request': self.request})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('cantidad', serializer.errors['items'][0])
+
     def test_validate_entrada_success(self):
         lote = Lote.objects.create(
             producto=self.producto, codigo_lote='L-SER2', cantidad_inicial=10, sucursal_id=1
@@ -687,6 +964,59 @@ class MovimientoViewSetTest(APITestCase):
         movimiento.refresh_from_db()
         self.assertFalse(movimiento.aprobado)
 
+    def _entrada_pendiente(self, factura):
+        movimiento = Movimiento.objects.create(tipo='entrada', creado_por=self.admin, sucursal=self.sucursal)
+        DetalleEntrada.objects.create(movimiento=movimiento, numero_factura=factura, recibido_por=self.admin)
+        MovimientoItem.objects.create(movimiento=movimiento, producto=self.producto, cantidad=5)
+        return movimiento
+
+    @patch('movimiento.models.validar_factura_entrada')
+    def test_aprobar_lote_resultados_por_id(self, _mock_val):
+        primero = self._entrada_pendiente('F-L1')
+        ya_aprobado = self._entrada_pendiente('F-L2')
+        Movimiento.objects.filter(pk=ya_aprobado.pk).update(aprobado=True)
+        tercero = self._entrada_pendiente('F-L3')
+        ajeno = Movimiento.objects.create(
+            tipo='entrada', creado_por=self.admin, sucursal=Sucursal.objects.create(nombre='Suc Ajena'),
+        )
+
+        url = reverse('movimientos-aprobar-lote')
+        response = self._post(url, {'ids': [primero.pk, ya_aprobado.pk, ajeno.pk, tercero.pk]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        resultados = response.data['resultados']
+        self.assertEqual([r['id'] for r in resultados], [primero.pk, ya_aprobado.pk, ajeno.pk, tercero.pk])
+        self.assertEqual(
+            [(r['status'], r.get('codigo')) for r in resultados],
+            [('aprobado', None), ('error', 400), ('error', 404), ('aprobado', None)],
+        )
+
+        # El rechazo del segundo no revierte a los demás.
+        self.assertEqual(
+            set(Movimiento.objects.filter(aprobado=True).values_list('pk', flat=True)),
+            {primero.pk, ya_aprobado.pk, tercero.pk},
+        )
+        self.assertEqual(Lote.objects.filter(movimientoitem__movimiento__in=[primero, tercero]).count(), 2)
+        registros = RegistroActividad.objects.filter(accion='approve').order_by('id')
+        self.assertEqual(
+            [r.descripcion for r in registros], [f'Aprobó el {primero}', f'Aprobó el {tercero}'],
+        )
+
+    def test_aprobar_lote_revisa_permisos_una_vez(self):
+        oper = _create_operativo()
+        oper.profile.sucursales.add(self.sucursal)
+        self.client.force_login(oper)
+        movimiento = self._entrada_pendiente('F-L4')
+
+        response = self._post(reverse('movimientos-aprobar-lote'), {'ids': [movimiento.pk]})
+        self.assertEqual(response.status_code, 403)
+        movimiento.refresh_from_db()
+        self.assertFalse(movimiento.aprobado)
+
+    def test_aprobar_lote_valida_ids(self):
+        url = reverse('movimientos-aprobar-lote')
+        for data in ({}, {'ids': []}, {'ids': ['1']}, {'ids': list(range(1, 300))}):
+            self.assertEqual(self._post(url, data).status_code, 400)
+
     def test_list_returns_movimientos(self):
         Movimiento.objects.create(tipo='entrada', creado_por=self.admin, sucursal=self.sucursal)
         Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal=self.sucursal)
@@ -742,7 +1072,7 @@ class MovimientoViewSetTest(APITestCase):
             'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         )
 
-        ws = load_workbook(io.BytesIO(response.content)).active
+        ws = load_workbook(io.BytesIO(response.getvalue())).active
         self.assertEqual(
             [c.value for c in ws[1]],
             ['ID', 'Tipo', 'Fecha', 'Aprobado', 'Producto', 'Cantidad'],
@@ -751,3 +1081,268 @@ class MovimientoViewSetTest(APITestCase):
         self.assertEqual(fila[0], movimiento.pk)
         self.assertEqual(fila[4], self.producto.codigo_interno)
         self.assertEqual(fila[5], 7)
+
+
+    def test_exportar_csv_y_ndjson(self):
+        movimiento = Movimiento.objects.create(tipo='entrada', creado_por=self.admin, sucursal=self.sucursal)
+        MovimientoItem.objects.create(movimiento=movimiento, producto=self.producto, cantidad=7)
+        url = reverse('movimientos-exportar')
+
+        response = self._get(f'{url}?formato=csv')
+        lineas = response.getvalue().decode().splitlines()
+        self.assertEqual(lineas[0], 'movimiento_id,tipo,creado,aprobado,producto,cantidad')
+        self.assertEqual(
+            lineas[1],
+            f'{movimiento.pk},entrada,{movimiento.creado.isoformat()},False,{self.producto.codigo_interno},7',
+        )
+
+        response = self._get(f'{url}?formato=ndjson')
+        fila = json.loads(response.getvalue().decode().splitlines()[0])
+        self.assertEqual(fila['movimiento_id'], movimiento.pk)
+        self.assertEqual(fila['tipo'], 'entrada')
+        self.assertIs(fila['aprobado'], False)
+        self.assertEqual(fila['cantidad'], 7)
+
+    def test_etiquetas_pdf_cacheado(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from utils import pdf_barcodes
+
+        cache.clear()
+        movimiento = Movimiento.objects.create(
+            tipo='entrada', creado_por=self.admin, aprobado=True, sucursal=self.sucursal,
+        )
+        for i in range(3):
+            lote = Lote.objects.create(
+                producto=_create_producto(f'P-ETQ{i}'), codigo_lote=f'L-ETQ{i}', cantidad_inicial=2,
+                sucursal=self.sucursal,
+            )
+            MovimientoItem.objects.create(movimiento=movimiento, producto=lote.producto, lote=lote, cantidad=2)
+        url = reverse('movimientos-etiquetas', kwargs={'pk': movimiento.pk})
+
+        with patch('utils.pdf_barcodes.render_etiquetas', wraps=pdf_barcodes.render_etiquetas) as render:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self._get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertTrue(response.content.startswith(b'%PDF'))
+            self.assertEqual(len(render.call_args.args[0]), 3)
+            # Los productos vienen en la misma consulta que los lotes.
+            self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT "productos_producto"')])
+
+            self.assertEqual(self._get(url).content, response.content)
+            self.assertEqual(render.call_count, 1)
+
+            Lote.objects.filter(codigo_lote='L-ETQ0').update(cantidad_inicial=5)
+            self._get(url)
+            self.assertEqual(render.call_count, 2)  # otro contenido, otra llave
+
+
+    def test_etiquetas_por_unidad_en_streaming(self):
+        import pypdfium2
+
+        movimiento = Movimiento.objects.create(
+            tipo='entrada', creado_por=self.admin, aprobado=True, sucursal=self.sucursal,
+        )
+        compacto = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-UNI-R', cantidad_inicial=30, modo_unidades='rango',
+            sucursal=self.sucursal,
+        )
+        individual = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-UNI-I', cantidad_inicial=2, sucursal=self.sucursal,
+        )
+        unidades = Unidad.objects.bulk_create([Unidad(lote=individual) for _ in range(2)])
+        for lote in (compacto, individual):
+            MovimientoItem.objects.create(movimiento=movimiento, producto=self.producto, lote=lote, cantidad=1)
+        url = reverse('movimientos-etiquetas', kwargs={'pk': movimiento.pk})
+
+        response = self._get(f'{url}?por=unidad')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        pdf = pypdfium2.PdfDocument(response.getvalue())
+        self.assertEqual(len(pdf), 2)  # 32 etiquetas, 24 por hoja
+        self.assertIn(compacto.codigo_unidad(1), pdf[0].get_textpage().get_text_range())
+        ultima = pdf[1].get_textpage().get_text_range()
+        self.assertIn(compacto.codigo_unidad(30), ultima)
+        self.assertIn(str(unidades[1].codigo_unidad), ultima)
+
+        self.assertEqual(self._get(f'{url}?por=pieza').status_code, status.HTTP_400_BAD_REQUEST)
+
+class MovimientoListadoRapidoTest(APITestCase):
+    """El listado desde .values() debe dar el mismo JSON que MovimientoSerializer."""
+    def setUp(self):
+        self.admin = _create_admin()
+        self.admin.first_name = 'Ana'
+        self.admin.save()
+        self.sucursal = Sucursal.objects.create(nombre='Suc Rapido')
+        self.admin.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.admin)
+        self.producto = _create_producto()
+        self.lote = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-RAP', cantidad_inicial=5,
+            cantidad_restante=5, modo_unidades='rango', sucursal=self.sucursal,
+        )
+
+        entrada = Movimiento.objects.create(tipo='entrada', creado_por=self.admin, sucursal=self.sucursal)
+        DetalleEntrada.objects.create(movimiento=entrada, numero_factura='F-RAP', recibido_por=_create_operativo())
+        MovimientoItem.objects.create(movimiento=entrada, producto=self.producto, cantidad=5, lote=self.lote)
+
+        cliente = Cliente.objects.create(nombre='Cli Rapido', sucursal=self.sucursal)
+        equipo = Equipo.objects.create(nombre='EQ-RAP', marca=Marca.objects.create(nombre='M-RAP'))
+        equipo_cliente = EquipoCliente.objects.create(equipo=equipo, cliente=cliente, alias='Rapido', contador_uso=10)
+        salida = Movimiento.objects.create(
+            tipo='salida', creado_por=self.admin, sucursal=self.sucursal,
+            aprobado=True, aprobado_fecha=timezone.now(), user_aprueba=self.admin, comentarios='ok',
+        )
+        DetalleSalida.objects.create(movimiento=salida, cliente=cliente, subtipo='renta', tecnico='Tec')
+        MovimientoItem.objects.create(
+            movimiento=salida, producto=self.producto, cantidad=1, lote=self.lote,
+            equipo_cliente=equipo_cliente, contador_uso_snapshot=7,
+        )
+        MovimientoItem.objects.create(movimiento=salida, producto=_create_producto('P000'), cantidad=2)
+
+    def _comparar(self, params=None):
+        url = reverse('movimientos-list')
+        headers = {'HTTP_X_BRANCH_ID': self.sucursal.id, 'HTTP_ACCEPT': 'application/json'}
+        rapido = self.client.get(url, params, **headers)
+        with patch.object(MovimientoViewSet, 'listado_rapido', None):
+            lento = self.client.get(url, params, **headers)
+        self.assertEqual(rapido.status_code, status.HTTP_200_OK)
+        self.assertEqual(rapido.content, lento.content)
+        return rapido.json()
+
+    def test_mismo_json(self):
+        data = self._comparar()
+        self.assertEqual(len(data), 2)
+        self.assertEqual([i['producto']['codigo_interno'] for i in data[0]['items']], ['P000', 'P001'])
+
+    def test_mismo_json_filtrado_y_paginado(self):
+        self._comparar({'items__producto': self.producto.pk, 'limite': 1})
+
+
+class ConsumoDiarioTest(TestCase):
+    def setUp(self):
+        self.admin = _create_admin()
+        self.sucursal = Sucursal.objects.create(nombre='Suc Consumo')
+        self.admin.profile.sucursales.add(self.sucursal)
+        self.producto = _create_producto()
+        self.otro = _create_producto('P002')
+
+    def _movimiento(self, tipo, partidas, creado=None, aprobado=True):
+        movimiento = Movimiento.objects.create(
+            tipo=tipo, creado_por=self.admin, sucursal=self.sucursal,
+            aprobado=aprobado, creado=creado or timezone.now(),
+        )
+        for producto, cantidad in partidas:
+            MovimientoItem.objects.create(movimiento=movimiento, producto=producto, cantidad=cantidad)
+        return movimiento
+
+    def _filas(self):
+        return set(ConsumoDiario.objects.values_list(
+            'sucursal_id', 'producto_id', 'fecha', 'tipo', 'items', 'unidades', 'movimientos',
+        ))
+
+    @patch('movimiento.models.validar_factura_entrada')
+    def test_approve_suma_al_dia(self, _mock_val):
+        for factura, partidas in (('F-1', [(self.producto, 3), (self.producto, 2)]), ('F-2', [(self.producto, 4)])):
+            movimiento = self._movimiento('entrada', partidas, aprobado=False)
+            DetalleEntrada.objects.create(movimiento=movimiento, numero_factura=factura, recibido_por=self.admin)
+            movimiento.approve(self.admin)
+
+        hoy = timezone.localdate()
+        self.assertEqual(self._filas(), {(self.sucursal.id, self.producto.id, hoy, 'entrada', 3, 9, 2)})
+
+    def test_poblar_reconstruye_historial(self):
+        hace_40_dias = timezone.now() - datetime.timedelta(days=40)
+        self._movimiento('salida', [(self.producto, 2), (self.otro, 1)], creado=hace_40_dias)
+        self._movimiento('salida', [(self.producto, 5)], creado=hace_40_dias)
+        self._movimiento('entrada', [(self.producto, 7)])
+        self._movimiento('salida', [(self.producto, 9)], aprobado=False)
+        # Una fila previa incorrecta se reemplaza.
+        ConsumoDiario.objects.create(
+            sucursal=self.sucursal, producto=self.producto, fecha=timezone.localdate(), tipo='entrada', items=99,
+        )
+
+        call_command('poblar_consumo_diario', stdout=StringIO())
+
+        dia = timezone.localdate(hace_40_dias)
+        self.assertEqual(self._filas(), {
+            (self.sucursal.id, self.producto.id, dia, 'salida', 2, 7, 2),
+            (self.sucursal.id, self.otro.id, dia, 'salida', 1, 1, 1),
+            (self.sucursal.id, self.producto.id, timezone.localdate(), 'entrada', 1, 7, 1),
+        })
+
+        # --desde solo toca los días recientes; --si-vacia no hace nada con filas.
+        ConsumoDiario.objects.filter(fecha=dia).update(items=0)
+        call_command('poblar_consumo_diario', desde=str(timezone.localdate()), stdout=StringIO())
+        call_command('poblar_consumo_diario', si_vacia=True, stdout=StringIO())
+        self.assertEqual(ConsumoDiario.objects.filter(fecha=dia, items=0).count(), 2)
+
+
+class AprobacionSecuencialTest(TransactionTestCase):
+    """medir_aprobaciones con un hilo: corre en cualquier base y verifica las asignaciones."""
+    serialized_rollback = True
+
+    def _medir(self, **opciones):
+        salida = StringIO()
+        call_command('medir_aprobaciones', json=True, hilos=1, stdout=salida, **opciones)
+        return json.loads(salida.getvalue())
+
+    def test_lotes_individuales(self):
+        sucursales = Sucursal.objects.count()
+        # 30 piezas pedidas contra 20 disponibles.
+        reporte = self._medir(sucursales=1, lotes=2, unidades=10, movimientos=15, partidas=2)
+
+        self.assertEqual(reporte['movimientos'], 15)
+        self.assertEqual(reporte['errores'], [])
+        self.assertGreater(reporte['resultados'].get('aprobado', 0), 0)
+        self.assertGreater(reporte['resultados'].get('sin_existencias', 0), 0)
+        self.assertEqual(reporte['duplicadas'], 0)
+        self.assertEqual(reporte['lotes_descuadrados'], 0)
+        self.assertEqual(Sucursal.objects.count(), sucursales)
+
+    def test_lotes_compactos(self):
+        reporte = self._medir(modo='rango', sucursales=1, lotes=2, unidades=10, movimientos=15)
+
+        self.assertEqual(reporte['errores'], [])
+        self.assertGreater(reporte['resultados'].get('sin_existencias', 0), 0)
+        self.assertEqual(reporte['duplicadas'], 0)
+        self.assertEqual(reporte['lotes_descuadrados'], 0)
+
+    @skipUnless(connection.vendor == 'sqlite', 'Solo SQLite rechaza varios hilos.')
+    def test_sqlite_rechaza_varios_hilos(self):
+        with self.assertRaises(CommandError):
+            call_command('medir_aprobaciones', hilos=2, stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'La concurrencia se prueba contra PostgreSQL.')
+class AprobacionConcurrenteTest(TransactionTestCase):
+    """medir_aprobaciones: aprobaciones simultáneas sobre los mismos lotes sin repetir unidades."""
+    serialized_rollback = True
+
+    def _medir(self, **opciones):
+        salida = StringIO()
+        call_command('medir_aprobaciones', json=True, stdout=salida, **opciones)
+        return json.loads(salida.getvalue())
+
+    def test_lotes_individuales(self):
+        sucursales = Sucursal.objects.count()
+        # 60 piezas pedidas contra 40 disponibles: parte de las aprobaciones se queda sin existencias.
+        reporte = self._medir(sucursales=1, lotes=2, unidades=20, movimientos=30, partidas=2, hilos=6)
+
+        self.assertEqual(reporte['movimientos'], 30)
+        self.assertEqual(reporte['errores'], [])
+        self.assertGreater(reporte['resultados'].get('aprobado', 0), 0)
+        self.assertGreater(reporte['resultados'].get('sin_existencias', 0), 0)
+        self.assertEqual(reporte['duplicadas'], 0)
+        self.assertEqual(reporte['lotes_descuadrados'], 0)
+        # Los datos de prueba se borran al terminar.
+        self.assertEqual(Sucursal.objects.count(), sucursales)
+
+    def test_lotes_compactos(self):
+        reporte = self._medir(modo='rango', sucursales=1, lotes=2, unidades=20, movimientos=30, hilos=6)
+
+        self.assertEqual(reporte['errores'], [])
+        self.assertEqual(reporte['duplicadas'], 0)
+        self.assertEqual(reporte['lotes_descuadrados'], 0)
@@ -1,5 +1,6 @@
 from datetime import date
 
+from django.db import transaction
 from django.db.models import Prefetch
 from django.http import HttpResponse
 from django_filters import rest_framework as filters
@@ -7,16 +8,20 @@ from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from . import exportaciones
+from .listados import MovimientoListado
 from .models import Movimiento, MovimientoItem
 from .serializers import MovimientoSerializer
 from productos.models import Lote
 from system.models import RegistroActividad
-from utils.exports import xlsx_response
-from utils.mixins import ActivityLogMixin
-from utils.pdf_barcodes import generate_lot_labels_pdf
+from utils.exports import exportar
+from utils.mixins import ActivityLogMixin, ListadoRapidoMixin
+from utils.pagination import PaginacionKeyset
+from utils.pdf_barcodes import etiquetas_de_lotes, etiquetas_de_unidades, generar_pdf_cacheado, pdf_en_streaming
+from utils.streaming import RespuestaStreaming
 
 
-class MovimientoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
+class MovimientoViewSet(ListadoRapidoMixin, ActivityLogMixin, viewsets.ModelViewSet):
     queryset = Movimiento.objects.all().select_related(
         'creado_por__profile', 'user_aprueba__profile',
         'detalle_entrada__recibido_por__profile',
@@ -29,8 +34,11 @@ class MovimientoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
     ).distinct()
     
     serializer_class = MovimientoSerializer
+    listado_rapido = MovimientoListado
     filter_backends = [filters.DjangoFilterBackend]
-    filterset_fields = ['items__producto', 'detalle_salida__cliente']
+    filterset_fields = exportaciones.CAMPOS_FILTRO
+    pagination_class = PaginacionKeyset
+    orden_paginacion = ('-creado', '-id')
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -53,25 +61,32 @@ class MovimientoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
         ]
         return f"{self.verbs[action]} el {instance}", segmentos
 
+    # Máximo de ids por llamada a aprobar-lote.
+    MAX_APROBAR_LOTE = 200
+
+    def _registro_aprobacion(self, movimiento, con_cambio_anticipado):
+        """RegistroActividad (sin guardar) de una aprobación."""
+        segmentos = [
+            {"texto": "Aprobó el "},
+            {"texto": str(movimiento), "tipo": "movimiento", "id": movimiento.pk},
+        ]
+        if con_cambio_anticipado:
+            segmentos.append({"texto": ' con cambios anticipados', "tipo": "alerta"})
+        # bulk_create no pasa por RegistroActividad.save(): la descripción se arma aquí.
+        return RegistroActividad(
+            usuario=self.request.user, accion='approve',
+            descripcion=''.join(s['texto'] for s in segmentos),
+            segmentos=segmentos,
+            sucursal_id=self.request.branch_id,
+        )
+
     @action(detail=True, methods=['post'])
     def aprobar(self, request, pk=None):
         try:
             movimiento = self.get_object()
             movimiento.approve(request.user)
-            descripcion = f'Aprobó el {movimiento}'
-            segmentos = [
-                {"texto": "Aprobó el "},
-                {"texto": str(movimiento), "tipo": "movimiento", "id": movimiento.pk},
-            ]
-            if movimiento.items.filter(cambio_anticipado=True).exists():
-                segmentos.append({"texto": ' con cambios anticipados', "tipo": "alerta"})
-                
-            RegistroActividad.objects.create(
-                usuario=request.user, accion='approve',
-                descripcion=descripcion,
-                segmentos=segmentos,
-                sucursal_id=request.branch_id,
-            )
+            con_cambio_anticipado = movimiento.items.filter(cambio_anticipado=True).exists()
+            self._registro_aprobacion(movimiento, con_cambio_anticipado).save()
             return Response({'status': 'aprobado'})
         except PermissionError as e:
             return Response({'detail': str(e)}, status=status.HTTP_403_FORBIDDEN)
@@ -79,23 +94,68 @@ class MovimientoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'detail': str(e)}, status=500)
-    
+
+    @action(detail=False, methods=['post'], url_path='aprobar-lote')
+    def aprobar_lote(self, request):
+        """Aprueba varios movimientos: {"ids": [...]} -> un resultado por id, en el mismo orden.
+
+        Los permisos se revisan una vez para la sucursal. Cada aprobación corre en
+        su propio savepoint, así un movimiento rechazado no revierte a los demás, y
+        los registros de actividad se insertan juntos al final.
+        """
+        ids = request.data.get('ids')
+        if (
+            not isinstance(ids, list) or not ids
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+        ):
+            return Response({'detail': 'Se requiere "ids": una lista de ids de movimientos.'}, status=400)
+        if len(ids) > self.MAX_APROBAR_LOTE:
+            return Response(
+                {'detail': f'Se pueden aprobar hasta {self.MAX_APROBAR_LOTE} movimientos por llamada.'}, status=400,
+            )
+        try:
+            Movimiento.verificar_permiso_aprobar(request.user, request.branch_id)
+        except PermissionError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_403_FORBIDDEN)
+
+        ids = list(dict.fromkeys(ids))
+        resultados = {}
+        aprobados = []
+        with transaction.atomic():
+            # Bloqueados en orden de id: dos lotes simultáneos no aprueban el mismo movimiento.
+            movimientos = {
+                m.pk: m for m in Movimiento.objects.select_for_update(of=('self',))
+                .filter(sucursal=request.branch_id, pk__in=ids)
+                .select_related('detalle_entrada', 'detalle_salida').order_by('pk')
+            }
+            for pk in ids:
+                movimiento = movimientos.get(pk)
+                if movimiento is None:
+                    resultados[pk] = {'status': 'error', 'detail': 'No encontrado.', 'codigo': 404}
+                    continue
+                try:
+                    movimiento.approve(request.user, permisos_verificados=True)  # atomic: savepoint propio
+                except ValueError as e:
+                    resultados[pk] = {'status': 'error', 'detail': str(e), 'codigo': 400}
+                except Exception as e:
+                    resultados[pk] = {'status': 'error', 'detail': str(e), 'codigo': 500}
+                else:
+                    resultados[pk] = {'status': 'aprobado'}
+                    aprobados.append(movimiento)
+
+            con_cambio_anticipado = set(
+                MovimientoItem.objects.filter(movimiento__in=aprobados, cambio_anticipado=True)
+                .values_list('movimiento_id', flat=True)
+            ) if aprobados else set()
+            RegistroActividad.objects.bulk_create([
+                self._registro_aprobacion(m, m.pk in con_cambio_anticipado) for m in aprobados
+            ])
+
+        return Response({'resultados': [{'id': pk, **resultados[pk]} for pk in ids]})
+
     @action(detail=False, methods=['get'])
     def exportar(self, request):
-        movimientos = self.filter_queryset(self.get_queryset())
-        headers = ['ID', 'Tipo', 'Fecha', 'Aprobado', 'Producto', 'Cantidad']
-        rows = []
-        for mov in movimientos:
-            for item in mov.items.all():
-                rows.append([
-                    mov.id,
-                    mov.get_tipo_display(),
-                    mov.creado.strftime('%d/%m/%Y %H:%M'),
-                    'Sí' if mov.aprobado else 'No',
-                    item.producto.codigo_interno,
-                    item.cantidad,
-                ])
-        return xlsx_response(headers, rows, 'movimientos.xlsx', sheet_title='Movimientos')
+        return exportar(request, exportaciones.movimientos(request.branch_id, request.query_params, request.user))
 
     @action(detail=False, methods=['get'])
     def get_oldest(self, request):
@@ -107,17 +167,29 @@ class MovimientoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def etiquetas(self, request, pk=None):
+        """PDF de etiquetas: una por lote, o una por unidad con ?por=unidad (en streaming)."""
+        por = request.query_params.get('por', 'lote')
+        if por not in ('lote', 'unidad'):
+            return Response({'detail': 'El parámetro "por" debe ser lote o unidad.'}, status=400)
         movimiento = self.get_object()
-        
+
         if movimiento.tipo != 'entrada':
             return Response({'detail': 'Solo movimientos de entrada tienen etiquetas.'}, status=400)
         if not movimiento.aprobado:
             return Response({'detail': 'El movimiento debe estar aprobado.'}, status=400)
 
-        lotes = Lote.objects.filter(movimientoitem__movimiento=movimiento)
-        if not lotes.exists():
+        lotes = list(
+            Lote.objects.filter(movimientoitem__movimiento=movimiento).select_related('producto').order_by('id')
+        )
+        if not lotes:
             return Response({'detail': 'No se encontraron lotes para este movimiento.'}, status=404)
 
-        pdf_bytes = generate_lot_labels_pdf(lotes)
+        if por == 'unidad':
+            return RespuestaStreaming(
+                pdf_en_streaming(etiquetas_de_unidades(lotes)), content_type='application/pdf',
+                headers={'Content-Disposition': f'attachment; filename="etiquetas-unidades-movimiento-{pk}.pdf"'},
+            )
+
+        pdf_bytes = generar_pdf_cacheado(f'etiquetas:{movimiento.pk}', etiquetas_de_lotes(lotes))
         return HttpResponse(pdf_bytes, content_type='application/pdf',
                             headers={'Content-Disposition': f'attachment; filename="etiquetas-movimiento-{pk}.pdf"'})
@@ -0,0 +1,24 @@
+from django.core.management.color import no_style
+from django.db import migrations
+
+
+def reiniciar_secuencia(apps, schema_editor):
+    # Los backfills de sucursal crean la sucursal 1 con pk explícito; en
+    # PostgreSQL la secuencia no avanza y el siguiente INSERT choca con ella.
+    Sucursal = apps.get_model('organizacion', 'Sucursal')
+    for sql in schema_editor.connection.ops.sequence_reset_sql(no_style(), [Sucursal]):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('movimiento', '0014_fill_and_fix_movimiento_sucursal'),
+        ('productos', '0021_fill_and_fix_lote_sucursal'),
+        ('system', '0005_fill_and_fix_alerta_sucursal'),
+    ]
+
+    operations = [
+        migrations.RunPython(reiniciar_secuencia, reverse_code=migrations.RunPython.noop),
+    ]
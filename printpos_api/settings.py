@@ -154,6 +154,26 @@ DATABASES = {
 }
 
 
+# Cache
+# Compartida por todos los workers de gunicorn (catálogos, sucursales): Redis si
+# hay REDIS_URL; si no, una tabla en la base (python manage.py createcachetable).
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_printpos',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -197,6 +217,31 @@ if not DEBUG:
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 
+# Inventario
+# Opcional: con LOTES_UNIDADES_COMPACTAS=True los lotes nuevos guardan sus
+# unidades como rango de series (sin una fila Unidad por pieza). Sus unidades
+# no tienen id (se identifican por codigo_unidad); los lotes existentes siguen
+# en modo individual. Ver productos/unidades.py.
+
+LOTES_UNIDADES_COMPACTAS = os.getenv('LOTES_UNIDADES_COMPACTAS', 'False').lower() == 'true'
+
+
+# Exportaciones en segundo plano
+# Los archivos que genera `manage.py procesar_exportaciones` se guardan en disco
+# local y se borran EXPORTACIONES_HORAS después de terminar. El worker y la web
+# deben ver la misma carpeta.
+
+EXPORTACIONES_ROOT = Path(os.getenv('EXPORTACIONES_ROOT', BASE_DIR / 'exportaciones'))
+EXPORTACIONES_HORAS = int(os.getenv('EXPORTACIONES_HORAS', '24'))
+
+
+# Etiquetas
+# Procesos que usa cada worker web para dibujar lotes grandes de etiquetas en
+# paralelo (nunca más que los CPU). Con 1 se dibujan en serie.
+
+ETIQUETAS_PROCESOS = int(os.getenv('ETIQUETAS_PROCESOS', '2'))
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
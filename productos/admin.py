@@ -1,7 +1,6 @@
 from django.contrib import admin
-from django.db.models import Count, Q
 
-from .models import Marca, Categoría, Proveedor, Producto, Equipo, Lote, Unidad
+from .models import Marca, Categoría, Proveedor, Producto, Equipo, Lote, RangoUnidades, Unidad, StockSucursal
 
 
 class EquipoInline(admin.TabularInline):
@@ -9,6 +8,13 @@ class EquipoInline(admin.TabularInline):
     extra = 1
 
 
+class RangoUnidadesInline(admin.TabularInline):
+    model = RangoUnidades
+    extra = 0
+    can_delete = False
+    readonly_fields = ('inicio', 'fin', 'status', 'actualizado')
+
+
 @admin.register(Marca)
 class MarcaAdmin(admin.ModelAdmin):
     """Administración de marcas."""
@@ -102,20 +108,15 @@ class LoteAdmin(admin.ModelAdmin):
         'producto',
         'cantidad_inicial',
         'cantidad_restante',
+        'modo_unidades',
         'fecha_entrada',
     )
     search_fields = ('codigo_lote', 'producto__codigo_interno')
     list_filter = ('producto__categoria', 'producto__equipos__marca')
     autocomplete_fields = ('producto',)
-    readonly_fields = ('creado', 'actualizado')
+    readonly_fields = ('cantidad_restante', 'modo_unidades', 'creado', 'actualizado')
     ordering = ('-fecha_entrada',)
-
-    def cantidad_restante(self, obj: Lote):
-        return obj.cantidad_restante
-    
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        return qs.annotate(cantidad_restante=Count('unidades', filter=Q(unidades__status='disponible')))
+    inlines = [RangoUnidadesInline]
 
 
 @admin.register(Unidad)
@@ -134,3 +135,13 @@ class UnidadAdmin(admin.ModelAdmin):
 
     def producto(self, obj):
         return obj.lote.producto
+
+
+@admin.register(StockSucursal)
+class StockSucursalAdmin(admin.ModelAdmin):
+    """Resumen de existencias por sucursal (solo lectura, se recalcula solo)."""
+    list_display = ('producto', 'sucursal', 'cantidad_disponible', 'lotes_abiertos', 'lote_mas_antiguo')
+    list_filter = ('sucursal',)
+    search_fields = ('producto__codigo_interno', 'producto__descripcion')
+    list_select_related = ('producto', 'sucursal')
+    readonly_fields = ('producto', 'sucursal', 'cantidad_disponible', 'lotes_abiertos', 'lote_mas_antiguo', 'actualizado')
@@ -0,0 +1,125 @@
+"""Caché versionada de los catálogos (Categoría, Marca, Equipo, Proveedor).
+
+Cada catálogo tiene una versión en la caché compartida (settings.CACHES, la
+misma para todos los workers de gunicorn) y sus filas se guardan bajo una
+llave que incluye esa versión. Al guardar o borrar una fila (ver signals.py)
+se genera una versión nueva: nadie vuelve a leer las filas anteriores y no hay
+que borrar nada. Cada proceso además recuerda la última versión que cargó, así
+que una lectura normal cuesta una consulta a la caché por las versiones.
+
+Las versiones son (fecha, token aleatorio) y sirven también como validadores
+de GET condicional. Los cambios con queryset.update() o bulk_create() no
+disparan señales: hay que llamar a invalidar() a mano.
+"""
+from django.core.cache import cache
+
+from .models import Categoría, Equipo, Marca, Proveedor
+from utils import versiones as _versiones
+
+CATALOGOS = {
+    'categoria': Categoría,
+    'marca': Marca,
+    'equipo': Equipo,
+    'proveedor': Proveedor,
+}
+# Los datos de un equipo incluyen su marca.
+DEPENDIENTES = {'marca': ('equipo',)}
+TIEMPO_DATOS = 60 * 60 * 24
+
+_locales = {}  # nombre -> (versión, catálogo) de este proceso
+
+
+def nombre_de(modelo):
+    return next((nombre for nombre, m in CATALOGOS.items() if m is modelo), None)
+
+
+def _llave_version(nombre):
+    return f'catalogo:{nombre}:version'
+
+
+def _llave_datos(nombre, version):
+    return f'catalogo:{nombre}:{version[1]}'
+
+
+def versiones(*nombres):
+    """{nombre: (fecha, token)} en una sola lectura de la caché."""
+    leidas = _versiones.leer(*(_llave_version(n) for n in nombres))
+    return {n: leidas[_llave_version(n)] for n in nombres}
+
+
+def validadores(*nombres):
+    """Versiones en el formato de utils.mixins.validador(), sin consultar las tablas."""
+    version = versiones(*nombres)
+    return [version[n] for n in nombres]
+
+
+def _afectados(nombre):
+    return [_llave_version(n) for n in (nombre, *DEPENDIENTES.get(nombre, ()))]
+
+
+def invalidar(nombre):
+    _versiones.cambiar(*_afectados(nombre))
+
+
+def invalidar_al_confirmar(nombre):
+    _versiones.cambiar_al_confirmar(*_afectados(nombre))
+
+
+def _cargar(nombre):
+    from .serializers import CategoriaSerializer, EquipoSerializer, MarcaSerializer, ProveedorSerializer
+
+    serializadores = {
+        'categoria': CategoriaSerializer,
+        'marca': MarcaSerializer,
+        'equipo': EquipoSerializer,
+        'proveedor': ProveedorSerializer,
+    }
+    queryset = CATALOGOS[nombre].objects.order_by('nombre', 'pk')
+    if nombre == 'equipo':
+        queryset = queryset.select_related('marca')
+    objetos = {objeto.pk: objeto for objeto in queryset}
+    datos = serializadores[nombre](list(objetos.values()), many=True).data
+    return {
+        'objetos': objetos,
+        'datos': {fila['id']: dict(fila) for fila in datos},
+    }
+
+
+def obtener(*nombres):
+    """{nombre: {'objetos': {pk: instancia}, 'datos': {pk: dict serializado}}}.
+
+    Ambos dicts van en el orden del catálogo (nombre). Las instancias son
+    compartidas: no deben modificarse.
+    """
+    version = versiones(*nombres)
+    resultado = {}
+    faltantes = {}
+    for nombre in nombres:
+        local = _locales.get(nombre)
+        if local is not None and local[0] == version[nombre]:
+            resultado[nombre] = local[1]
+        else:
+            faltantes[_llave_datos(nombre, version[nombre])] = nombre
+
+    if faltantes:
+        encontrados = cache.get_many(faltantes)
+        nuevos = {}
+        for llave, nombre in faltantes.items():
+            catalogo = encontrados.get(llave)
+            if catalogo is None:
+                # Se lee después de la versión: nunca queda más viejo que ella.
+                catalogo = nuevos[llave] = _cargar(nombre)
+            resultado[nombre] = catalogo
+            _locales[nombre] = (version[nombre], catalogo)
+        if nuevos:
+            cache.set_many(nuevos, TIEMPO_DATOS)
+    return resultado
+
+
+def obtener_con(nombre, ids):
+    """Como obtener(nombre), recargando una vez si falta alguno de `ids`."""
+    catalogo = obtener(nombre)[nombre]
+    if not set(ids) <= catalogo['objetos'].keys():
+        invalidar(nombre)
+        catalogo = obtener(nombre)[nombre]
+    return catalogo
@@ -0,0 +1,150 @@
+"""Dashboard por sucursal, cacheado y recalculado bajo demanda.
+
+El payload se guarda por sucursal junto con las versiones con las que se
+calculó (utils/versiones.py). Cambian:
+
+- la versión de la sucursal, al aprobar un movimiento o cambiar sus clientes;
+- la versión global, al cambiar productos, categorías o proveedores.
+
+Lo que no pasa por esas señales (p. ej. editar un lote a mano) se refleja
+cuando el payload cumple FRESCO segundos.
+
+Cuando el payload falta o ya no es vigente, una sola petición lo recalcula
+(candado en la caché) y las demás reciben el anterior (stale-while-revalidate);
+si no hay anterior (caché fría) esperan a que el nuevo se guarde. Así una
+ráfaga de inicios de sesión cuesta un solo cálculo, también en el primer
+acceso del día. El candado vence a los VENTANA segundos por si quien
+recalculaba no terminó.
+"""
+from time import monotonic, sleep
+
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Categoría, Proveedor, StockSucursal
+from .queries import productos_queryset
+from movimiento.models import ConsumoDiario, Movimiento
+from organizacion.models import Cliente
+from utils import versiones
+
+# Edad máxima aun sin cambios: cubre lo que no pasa por señales.
+FRESCO = 60 * 5
+VENTANA = 30
+# Cada cuánto revisa la caché una petición que espera el primer cálculo.
+ESPERA = 0.05
+LLAVE_GLOBAL = 'dashboard:version'
+
+
+def _llave_sucursal(sucursal_id):
+    return f'dashboard:{sucursal_id}:version'
+
+
+def invalidar(sucursal_id=None):
+    """Sin sucursal invalida el dashboard de todas."""
+    versiones.cambiar_al_confirmar(_llave_sucursal(sucursal_id) if sucursal_id is not None else LLAVE_GLOBAL)
+
+
+def calcular(sucursal_id):
+    productos = productos_queryset(sucursal_id=sucursal_id)
+    categorias = Categoría.objects.all()
+
+    hace_30_dias = timezone.localdate() - timezone.timedelta(days=30)
+
+    return {
+        'stats': {
+            'productos': productos.count(),
+            'lotes': (
+                StockSucursal.objects.filter(sucursal=sucursal_id)
+                .exclude(producto__status='inactivo')
+                .aggregate(total=Coalesce(Sum('lotes_abiertos'), 0))['total']
+            ),
+            'categorias': categorias.count(),
+            'proveedores': Proveedor.objects.filter(activo=True).count(),
+            'clientes': Cliente.objects.filter(activo=True, sucursal=sucursal_id).count(),
+        },
+        'categoriasChart': list(
+            categorias.values('nombre').annotate(
+                cantidad=Count('producto', filter=Q(producto__status='activo'))
+            )
+            .filter(cantidad__gt=0)
+        ),
+        'movimientosChart': list(
+            Movimiento.objects.filter(
+                creado__date__gte=hace_30_dias, aprobado=True, sucursal=sucursal_id
+            )
+            .values(fecha_creado=F('creado__date'))
+            .annotate(
+                entradas=Count('id', filter=Q(tipo='entrada')),
+                salidas=Count('id', filter=Q(tipo='salida'))
+            )
+        ),
+        'topProductosChart': [
+            {'id': r['producto_id'], 'codigo_interno': r['producto__codigo_interno'], 'total_movimientos': r['total']}
+            for r in ConsumoDiario.objects.filter(sucursal=sucursal_id, fecha__gte=hace_30_dias)
+            .exclude(producto__status='inactivo')
+            .values('producto_id', 'producto__codigo_interno')
+            .annotate(total=Sum('movimientos'))
+            .order_by('-total', 'producto_id')[:10]
+        ],
+        'productosBajos': list(
+            productos.filter(cantidad_disponible__lt=F('min_stock'))
+            .order_by('-cantidad_disponible')
+            .values('id', 'descripcion', 'categoria__nombre', 'cantidad_disponible', 'min_stock')
+        ),
+    }
+
+
+def _vigente(guardado, version, dia):
+    """El payload guardado es del mismo día, con las mismas versiones y de hace menos de FRESCO."""
+    if guardado['dia'] != dia:
+        return False
+    if any(guardado['version'].get(llave) != v for llave, v in version.items()):
+        return False
+    return timezone.now() < guardado['generado'] + timezone.timedelta(seconds=FRESCO)
+
+
+def _esperar_calculo(llave, candado):
+    """Payload que guarde quien tiene el candado; None si lo suelta sin guardarlo o vence VENTANA."""
+    limite = monotonic() + VENTANA
+    while monotonic() < limite:
+        sleep(ESPERA)
+        guardado = cache.get(llave)
+        if guardado is not None:
+            return guardado['datos']
+        if cache.get(candado) is None:
+            return None
+    return None
+
+
+def obtener(sucursal_id):
+    llave = f'dashboard:{sucursal_id}'
+    candado = f'{llave}:calculando'
+    version = versiones.leer(LLAVE_GLOBAL, _llave_sucursal(sucursal_id))
+    # movimientosChart cubre los últimos 30 días: cambia con la fecha.
+    dia = timezone.localdate()
+    guardado = cache.get(llave)
+
+    if guardado is not None and _vigente(guardado, version, dia):
+        return guardado['datos']
+
+    # Falta o es viejo: lo recalcula quien obtiene el candado.
+    con_candado = cache.add(candado, True, VENTANA)
+    if not con_candado:
+        if guardado is not None:
+            return guardado['datos']
+        datos = _esperar_calculo(llave, candado)
+        if datos is not None:
+            return datos
+
+    try:
+        # Las versiones se leyeron antes de calcular: el payload nunca es más viejo que ellas.
+        datos = calcular(sucursal_id)
+        cache.set(llave, {
+            'version': version, 'dia': dia, 'generado': timezone.now(), 'datos': datos,
+        }, 60 * 60 * 24)
+    finally:
+        if con_candado:
+            cache.delete(candado)
+    return datos
@@ -0,0 +1,131 @@
+"""Exportaciones de productos: las usan las vistas exportar_* y los trabajos en segundo plano.
+
+Cada función recibe (sucursal_id, params, usuario), con params como los
+query params de la vista, y devuelve una utils.exports.Exportacion.
+"""
+from utils.exports import Exportacion, Hoja
+
+from . import reorden
+from .queries import productos_queryset, rendimiento_data, reorden_data
+
+COLUMNAS_REORDEN = [
+    ('proveedor', 'Proveedor'),
+    ('codigo_interno', 'Código'),
+    ('descripcion', 'Descripción'),
+    ('cantidad_disponible', 'Disponible'),
+    ('min_stock', 'Mínimo'),
+    ('consumo_mensual', 'Consumo mensual'),
+    ('dias_cobertura', 'Días cobertura'),
+    ('cantidad_sugerida', 'Cantidad sugerida'),
+]
+
+
+def rendimiento_de(sucursal_id, params):
+    return rendimiento_data(
+        sucursal_id=sucursal_id,
+        fecha_inicio=params.get('fechaInicio'),
+        fecha_fin=params.get('fechaFin'),
+        por_cantidad=(params.get('porCantidad') or '').lower() in ('1', 'true'),
+    )
+
+
+def sucursales_de(usuario):
+    """Sucursales activas del usuario, para los reportes consolidados."""
+    return usuario.profile.sucursales.filter(activo=True).order_by('nombre')
+
+
+def reorden_consolidado_de(usuario):
+    return reorden.planear(sucursales_de(usuario).values_list('id', flat=True))
+
+
+def existencias(sucursal_id, params, usuario):
+    # Solo las columnas exportadas: sin equipos ni instancias de Producto/Categoría.
+    campos = {'codigo_interno', 'descripcion', 'categoria', 'min_stock', 'cantidad_disponible'}
+    filas = (
+        productos_queryset(sucursal_id, campos=campos, expandir=set())
+        .order_by('codigo_interno')
+        .values_list('codigo_interno', 'descripcion', 'categoria__nombre', 'cantidad_disponible', 'min_stock')
+    )
+    columnas = [
+        ('codigo_interno', 'Código'),
+        ('descripcion', 'Descripción'),
+        ('categoria', 'Categoría'),
+        ('cantidad_disponible', 'Disponible'),
+        ('min_stock', 'Mínimo'),
+    ]
+    return Exportacion('existencias', [Hoja('Existencias', columnas, filas)])
+
+
+def rendimiento(sucursal_id, params, usuario):
+    columnas = [
+        ('codigo_interno', 'Código'),
+        ('descripcion', 'Descripción'),
+        ('vida_util', 'Vida útil'),
+        ('ciclos', 'Ciclos'),
+        ('uso_promedio', 'Uso promedio'),
+        ('desviacion', 'Desviación'),
+        ('ratio', 'Ratio'),
+    ]
+    filas = [[r[campo] for campo, _ in columnas] for r in rendimiento_de(sucursal_id, params)]
+    return Exportacion('rendimiento', [Hoja('Rendimiento', columnas, filas)])
+
+
+def _filas_reorden(grupos):
+    return [
+        (
+            grupo['proveedor_nombre'],
+            p['codigo_interno'],
+            p['descripcion'],
+            p['cantidad_disponible'],
+            p['min_stock'],
+            p['consumo_mensual'],
+            p['dias_cobertura'],
+            p['cantidad_sugerida'],
+        )
+        for grupo in grupos
+        for p in grupo['productos']
+    ]
+
+
+def reorden_sucursal(sucursal_id, params, usuario):
+    filas = _filas_reorden(reorden_data(sucursal_id=sucursal_id))
+    return Exportacion('reorden', [Hoja('Reorden', COLUMNAS_REORDEN, filas)])
+
+
+def reorden_consolidado(sucursal_id, params, usuario):
+    """Hojas Consolidado y Por sucursal.
+
+    CSV y NDJSON tienen una sola tabla: las filas por sucursal, de las que se
+    deriva el consolidado.
+    """
+    plan = reorden_consolidado_de(usuario)
+    consolidado = [
+        (
+            grupo['proveedor_nombre'],
+            p['codigo_interno'],
+            p['descripcion'],
+            p['cantidad_disponible'],
+            p['consumo_mensual'],
+            p['cantidad_sugerida'],
+            p['sucursales'],
+        )
+        for grupo in plan['consolidado']
+        for p in grupo['productos']
+    ]
+    por_sucursal = [
+        (sucursal['sucursal_nombre'], *fila)
+        for sucursal in plan['sucursales']
+        for fila in _filas_reorden(sucursal['proveedores'])
+    ]
+    return Exportacion('reorden_consolidado', [
+        Hoja('Consolidado', [
+            ('proveedor', 'Proveedor'),
+            ('codigo_interno', 'Código'),
+            ('descripcion', 'Descripción'),
+            ('cantidad_disponible', 'Disponible total'),
+            ('consumo_mensual', 'Consumo mensual'),
+            ('cantidad_sugerida', 'Cantidad sugerida'),
+            ('sucursales', 'Sucursales'),
+        ], consolidado),
+        Hoja('Por sucursal', [('sucursal', 'Sucursal')] + COLUMNAS_REORDEN, por_sucursal),
+    ], plana=1)
@@ -0,0 +1,124 @@
+"""Listados de solo lectura construidos desde .values().
+
+Evitan crear una instancia de modelo y recorrer el árbol de campos de
+ModelSerializer por fila: cada listado pide sus columnas con .values(), trae
+las relaciones many-to-many en una consulta agrupada y arma los dicts con la
+misma forma y el mismo orden de llaves que el serializer correspondiente.
+Categoría, proveedor y equipos salen ya serializados de la caché de catálogos
+(catalogos.py): solo se consultan sus ids.
+"""
+from collections import defaultdict
+
+from rest_framework import serializers
+
+from . import catalogos
+from .models import Producto
+
+_fecha = serializers.DateTimeField()
+
+
+def anidado(fila, prefijo, campos):
+    """Dict de una FK traída con columnas `prefijo__campo`; None si la FK es nula."""
+    if fila[f'{prefijo}__id'] is None:
+        return None
+    return {campo: fila[f'{prefijo}__{campo}'] for campo in campos}
+
+
+def equipos_por_producto(producto_ids):
+    """{producto_id: [equipo, ...]} con una consulta a la tabla intermedia.
+
+    Mismo filtro y orden (nombre) que el Prefetch de productos_queryset.
+    """
+    pares = list(
+        Producto.equipos.through.objects
+        .filter(producto_id__in=producto_ids)
+        .values_list('producto_id', 'equipo_id')
+    )
+    catalogo = catalogos.obtener_con('equipo', {equipo_id for _producto_id, equipo_id in pares})
+    orden = {pk: i for i, pk in enumerate(catalogo['objetos'])}
+    equipos = defaultdict(list)
+    for producto_id, equipo_id in sorted(pares, key=lambda par: orden[par[1]]):
+        equipo = catalogo['objetos'][equipo_id]
+        if equipo.activo and equipo.marca.activo:
+            equipos[producto_id].append(catalogo['datos'][equipo_id])
+    return equipos
+
+
+class ProductoListado:
+    """Equivalente de ProductoSerializer(many=True) para el listado."""
+    columnas = (
+        'id', 'cantidad_disponible', 'categoria_id', 'proveedor_id', 'codigo_interno', 'descripcion', 'unidad_medida', 'sku', 'min_stock', 'vida_util',
+        'creado', 'actualizado', 'status',
+    )
+
+    def __init__(self, context):
+        self.context = context
+
+    def valores(self, queryset):
+        return queryset.prefetch_related(None).values(*self.columnas)
+
+    def construir(self, filas):
+        filas = list(filas)
+        equipos = equipos_por_producto([f['id'] for f in filas])
+        categorias = catalogos.obtener_con('categoria', {f['categoria_id'] for f in filas})['datos']
+        proveedores = catalogos.obtener_con(
+            'proveedor', {f['proveedor_id'] for f in filas if f['proveedor_id'] is not None}
+        )['datos']
+        return [
+            {
+                'id': f['id'],
+                'cantidad_disponible': f['cantidad_disponible'],
+                'categoria': categorias[f['categoria_id']],
+                'equipos': equipos.get(f['id'], []),
+                'proveedor': proveedores.get(f['proveedor_id']),
+                'codigo_interno': f['codigo_interno'],
+                'descripcion': f['descripcion'],
+                'unidad_medida': f['unidad_medida'],
+                'sku': f['sku'],
+                'min_stock': f['min_stock'],
+                'vida_util': f['vida_util'],
+                'creado': _fecha.to_representation(f['creado']),
+                'actualizado': _fecha.to_representation(f['actualizado']),
+                'status': f['status'],
+            }
+            for f in filas
+        ]
+
+
+class LoteListado:
+    """Equivalente de LoteSerializer(many=True) para el listado."""
+    columnas = (
+        'id', 'cantidad_restante', 'producto_id', 'producto__codigo_interno', 'producto__descripcion',
+        'codigo_lote', 'cantidad_inicial', 'modo_unidades', 'fecha_entrada', 'creado', 'actualizado',
+        'sucursal_id',
+    )
+
+    def __init__(self, context):
+        self.context = context
+
+    def valores(self, queryset):
+        return queryset.prefetch_related(None).values(*self.columnas)
+
+    def construir(self, filas):
+        filas = list(filas)
+        equipos = equipos_por_producto({f['producto_id'] for f in filas})
+        return [
+            {
+                'id': f['id'],
+                'cantidad_restante': f['cantidad_restante'],
+                'producto': {
+                    'id': f['producto_id'],
+                    'codigo_interno': f['producto__codigo_interno'],
+                    'descripcion': f['producto__descripcion'],
+                    'equipos': equipos.get(f['producto_id'], []),
+                },
+                'codigo_lote': f['codigo_lote'],
+                'cantidad_inicial': f['cantidad_inicial'],
+                'modo_unidades': f['modo_unidades'],
+                'fecha_entrada': _fecha.to_representation(f['fecha_entrada']),
+                'creado': _fecha.to_representation(f['creado']),
+                'actualizado': _fecha.to_representation(f['actualizado']),
+                'sucursal': f['sucursal_id'],
+            }
+            for f in filas
+        ]
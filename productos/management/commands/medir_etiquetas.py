@@ -0,0 +1,55 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from productos.unidades import codigo_unidad
+from utils import pdf_barcodes
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide las etiquetas por unidad de un lote de N unidades: PDF en streaming '
+        '(pdf_en_streaming) contra el documento completo en memoria (render_etiquetas), '
+        'con tiempo y pico de memoria. No toca la base de datos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--unidades', type=int, default=10000)
+        parser.add_argument(
+            '--sin-comparar', action='store_true',
+            help='Mide solo el streaming (render_etiquetas es lento con muchas unidades).',
+        )
+
+    def handle(self, *args, **options):
+        n = options['unidades']
+
+        def etiquetas():
+            # Mismas etiquetas que un lote compacto recorrido con iter_unidades().
+            for serie in range(1, n + 1):
+                yield pdf_barcodes.Etiqueta(
+                    codigo_unidad('MED-LOTE', serie), 'MED-0001 - Producto medición', 'Lote MED-LOTE',
+                )
+
+        def streaming():
+            total = 0
+            for bloque in pdf_barcodes.pdf_en_streaming(etiquetas()):
+                total += len(bloque)
+            return total
+
+        def en_memoria():
+            return len(pdf_barcodes.render_etiquetas(etiquetas()))
+
+        paginas = -(-n // pdf_barcodes.LABELS_PER_PAGE)
+        self.stdout.write(f'{n} unidades, {paginas} hojas:')
+        medidas = [('streaming', streaming)] + ([] if options['sin_comparar'] else [('en memoria', en_memoria)])
+        for nombre, funcion in medidas:
+            tracemalloc.start()
+            inicio = time.perf_counter()
+            tamano = funcion()
+            segundos = time.perf_counter() - inicio
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.stdout.write(
+                f'  {nombre}: {segundos:.2f}s, {tamano / 1024:.0f} KB de PDF, pico de memoria {pico / 1024:.0f} KB'
+            )
@@ -0,0 +1,125 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from movimiento.listados import MovimientoListado
+from movimiento.models import DetalleSalida, Movimiento, MovimientoItem
+from movimiento.serializers import MovimientoSerializer
+from movimiento.views import MovimientoViewSet
+from organizacion.models import Cliente, PerfilUsuario, Sucursal
+from productos.listados import LoteListado, ProductoListado
+from productos.models import Categoría, Equipo, Lote, Marca, Producto, Proveedor
+from productos.queries import lotes_queryset, productos_queryset
+from productos.serializers import LoteSerializer, ProductoSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara el tiempo de los listados de productos, lotes y movimientos con el '
+        'serializer contra el camino rápido desde .values(). Crea N filas de prueba '
+        'dentro de una transacción que se revierte al final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=10000)
+        parser.add_argument('--repeticiones', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                sucursal = self._sembrar(options['filas'])
+                request = Request(RequestFactory().get('/'))
+                request.branch_id = sucursal.pk
+                context = {'request': request}
+
+                casos = [
+                    ('productos', lambda: productos_queryset(sucursal.pk), ProductoSerializer, ProductoListado),
+                    ('lotes', lambda: lotes_queryset(sucursal.pk), LoteSerializer, LoteListado),
+                    (
+                        'movimientos',
+                        lambda: MovimientoViewSet.queryset.filter(sucursal=sucursal.pk),
+                        MovimientoSerializer, MovimientoListado,
+                    ),
+                ]
+                for nombre, queryset, serializer_class, listado_class in casos:
+                    self._medir(nombre, queryset, serializer_class, listado_class, context, options['repeticiones'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _medir(self, nombre, queryset, serializer_class, listado_class, context, repeticiones):
+        def serializer():
+            return serializer_class(queryset(), many=True, context=context).data
+
+        def rapido():
+            listado = listado_class(context)
+            return listado.construir(listado.valores(queryset()))
+
+        lento_json = json.dumps(serializer(), cls=JSONEncoder)
+        rapido_json = json.dumps(rapido(), cls=JSONEncoder)
+        iguales = 'sí' if lento_json == rapido_json else 'NO'
+
+        t_lento = min(self._cronometrar(serializer) for _ in range(repeticiones))
+        t_rapido = min(self._cronometrar(rapido) for _ in range(repeticiones))
+        self.stdout.write(
+            f'{nombre:<12} serializer {t_lento:7.3f}s  values() {t_rapido:7.3f}s  '
+            f'x{t_lento / t_rapido:5.1f}  JSON idéntico: {iguales}'
+        )
+
+    @staticmethod
+    def _cronometrar(funcion):
+        inicio = time.perf_counter()
+        funcion()
+        return time.perf_counter() - inicio
+
+    def _sembrar(self, n):
+        sucursal = Sucursal.objects.create(nombre='Sucursal medición')
+        usuario = User.objects.create_user(username='medicion_listados', first_name='Medición')
+        PerfilUsuario.objects.create(usuario=usuario, rol='admin')
+        cliente = Cliente.objects.create(nombre='Cliente medición', sucursal=sucursal)
+        categoria = Categoría.objects.create(nombre='Categoría medición')
+        proveedor = Proveedor.objects.create(nombre='Proveedor medición')
+        marca = Marca.objects.create(nombre='Marca medición')
+        equipos = Equipo.objects.bulk_create([Equipo(nombre=f'EQ-MED-{i}', marca=marca) for i in range(5)])
+
+        productos = Producto.objects.bulk_create([
+            Producto(
+                codigo_interno=f'MED-{i:06d}', descripcion=f'Producto medición {i}', categoria=categoria,
+                sku=f'SKU-MED-{i:06d}', min_stock=5, proveedor=proveedor if i % 2 else None,
+            )
+            for i in range(n)
+        ], batch_size=1000)
+        Producto.equipos.through.objects.bulk_create([
+            Producto.equipos.through(producto_id=p.pk, equipo_id=equipos[i % len(equipos)].pk)
+            for i, p in enumerate(productos)
+        ], batch_size=1000)
+        # bulk_create no pasa por Lote.save(): el resumen StockSucursal no hace falta aquí.
+        lotes = Lote.objects.bulk_create([
+            Lote(
+                producto=p, codigo_lote=f'L-MED-{i:06d}', cantidad_inicial=10, cantidad_restante=10,
+                modo_unidades='rango', sucursal=sucursal,
+            )
+            for i, p in enumerate(productos)
+        ], batch_size=1000)
+
+        movimientos = Movimiento.objects.bulk_create([
+            Movimiento(tipo='salida', creado_por=usuario, sucursal=sucursal) for _ in range(n)
+        ], batch_size=1000)
+        DetalleSalida.objects.bulk_create([
+            DetalleSalida(movimiento=m, cliente=cliente, subtipo='venta') for m in movimientos
+        ], batch_size=1000)
+        MovimientoItem.objects.bulk_create([
+            MovimientoItem(movimiento=m, producto=l.producto, lote=l, cantidad=1)
+            for m, l in zip(movimientos, lotes)
+        ], batch_size=1000)
+        return sucursal
@@ -0,0 +1,120 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from movimiento.models import ConsumoDiario
+from organizacion.models import Sucursal
+from productos import reorden
+from productos.models import Producto, Proveedor, StockSucursal
+
+from .medir_listados import Command as MedirListados, _Rollback
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide por separado productos.reorden.cargar() (consultas y matrices) y '
+        'productos.reorden.armar() (cálculo vectorizado y armado de la respuesta) '
+        'con N productos × M sucursales. Siembra StockSucursal y ConsumoDiario '
+        'dentro de una transacción que se revierte al final; con --sin-base mide '
+        'solo armar() sobre datos sintéticos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=10000)
+        parser.add_argument('--sucursales', type=int, default=20)
+        parser.add_argument('--proveedores', type=int, default=50)
+        parser.add_argument('--repeticiones', type=int, default=3)
+        parser.add_argument('--sin-base', action='store_true')
+
+    def handle(self, *args, **options):
+        n_productos, n_sucursales = options['productos'], options['sucursales']
+        if options['sin_base']:
+            datos = self._sintetico(n_productos, n_sucursales, options['proveedores'])
+            self._reportar(n_productos, n_sucursales, None, self._medir_armar(datos, options['repeticiones']))
+            return
+
+        try:
+            with transaction.atomic():
+                sucursal_ids = self._sembrar(n_productos, n_sucursales, options['proveedores'])
+                t_cargar = min(
+                    self._cronometrar(reorden.cargar, sucursal_ids) for _ in range(options['repeticiones'])
+                )
+                datos = reorden.cargar(sucursal_ids)
+                self._reportar(n_productos, n_sucursales, t_cargar, self._medir_armar(datos, options['repeticiones']))
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _medir_armar(self, datos, repeticiones):
+        return min(self._cronometrar(reorden.armar, datos) for _ in range(repeticiones)), reorden.armar(datos)
+
+    def _reportar(self, n_productos, n_sucursales, t_cargar, medicion):
+        t_armar, plan = medicion
+        sugeridos = sum(len(g['productos']) for s in plan['sucursales'] for g in s['proveedores'])
+        carga = 'cargar() -' if t_cargar is None else f'cargar() {t_cargar:.3f}s'
+        self.stdout.write(
+            f'{n_productos} productos × {n_sucursales} sucursales: {carga}  armar() {t_armar:.3f}s '
+            f'({sugeridos} sugerencias en todas las sucursales, '
+            f'{sum(len(g["productos"]) for g in plan["consolidado"])} productos consolidados)'
+        )
+
+    @staticmethod
+    def _cronometrar(funcion, *args):
+        inicio = time.perf_counter()
+        funcion(*args)
+        return time.perf_counter() - inicio
+
+    def _sembrar(self, n_productos, n_sucursales, n_proveedores):
+        """Productos de medir_listados más StockSucursal y ConsumoDiario en cada celda sucursal × producto."""
+        rng = np.random.default_rng(0)
+        sucursales = [MedirListados()._sembrar(n_productos)]
+        sucursales += Sucursal.objects.bulk_create([
+            Sucursal(nombre=f'Sucursal medición {i}') for i in range(1, n_sucursales)
+        ])
+        productos = list(Producto.objects.filter(codigo_interno__startswith='MED-').order_by('id'))
+        proveedores = Proveedor.objects.bulk_create([
+            Proveedor(nombre=f'Proveedor medición {i}') for i in range(n_proveedores)
+        ])
+        elegidos = rng.integers(0, n_proveedores + 1, len(productos))  # n_proveedores = sin proveedor
+        for producto, i in zip(productos, elegidos.tolist()):
+            producto.proveedor = proveedores[i] if i < n_proveedores else None
+            producto.min_stock = int(rng.integers(0, 20))
+        Producto.objects.bulk_update(productos, ['proveedor', 'min_stock'], batch_size=1000)
+
+        disponible = rng.integers(0, 60, (len(sucursales), len(productos)))
+        consumo = rng.poisson(30, (len(sucursales), len(productos)))
+        dias = rng.integers(0, 150, (len(sucursales), len(productos)))
+        hoy = timezone.localdate()
+        StockSucursal.objects.bulk_create([
+            StockSucursal(sucursal=s, producto=p, cantidad_disponible=int(disponible[i, j]))
+            for i, s in enumerate(sucursales) for j, p in enumerate(productos)
+        ], batch_size=2000)
+        ConsumoDiario.objects.bulk_create([
+            ConsumoDiario(
+                sucursal=s, producto=p, fecha=hoy - timedelta(days=int(dias[i, j])), tipo='salida',
+                items=1, unidades=int(consumo[i, j]), movimientos=1,
+            )
+            for i, s in enumerate(sucursales) for j, p in enumerate(productos)
+        ], batch_size=2000)
+        return [s.pk for s in sucursales]
+
+    @staticmethod
+    def _sintetico(n_productos, n_sucursales, n_proveedores):
+        rng = np.random.default_rng(0)
+        min_stock = rng.integers(0, 20, n_productos)
+        proveedores = rng.integers(0, n_proveedores + 1, n_productos)  # 0 = sin proveedor
+        return {
+            'config': {'lead_time': 15, 'meses_objetivo': 2, 'meses_historial': 6},
+            'productos': [
+                (i + 1, f'MED-{i:06d}', f'Producto medición {i}', int(min_stock[i]), int(proveedores[i]) or None)
+                for i in range(n_productos)
+            ],
+            'sucursales': [(i + 1, f'Sucursal {i}') for i in range(n_sucursales)],
+            'proveedores': {i: f'Proveedor {i}' for i in range(1, n_proveedores + 1)},
+            'disponible': rng.integers(0, 60, (n_sucursales, n_productos)),
+            'consumo': rng.poisson(30, (n_sucursales, n_productos)),
+        }
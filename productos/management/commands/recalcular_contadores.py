@@ -0,0 +1,115 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from productos.models import Lote, RangoUnidades, StockSucursal, Unidad
+
+
+def _disponibles_reales():
+    """Unidades disponibles según la fuente de verdad de cada modo de lote."""
+    filas = (
+        Unidad.objects.filter(lote=OuterRef('pk'), status='disponible')
+        .values('lote')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    ocupadas = (
+        RangoUnidades.objects.filter(lote=OuterRef('pk'))
+        .values('lote')
+        .annotate(total=Sum(F('fin') - F('inicio') + 1))
+        .values('total')
+    )
+    return Case(
+        When(modo_unidades='rango', then=F('cantidad_inicial') - Coalesce(Subquery(ocupadas), Value(0))),
+        default=Coalesce(Subquery(filas), Value(0)),
+        output_field=IntegerField(),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula Lote.cantidad_restante a partir de las unidades disponibles '
+        '(filas Unidad o rangos de series, según el modo del lote) '
+        'y reconstruye el resumen StockSucursal.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar', action='store_true',
+            help='Solo reporta contadores incorrectos, sin corregirlos.',
+        )
+        parser.add_argument('--sucursal', type=int, help='Limita el recálculo a una sucursal.')
+
+    def handle(self, *args, **options):
+        lotes = Lote.objects.all()
+        stock = StockSucursal.objects.all()
+        if options['sucursal']:
+            lotes = lotes.filter(sucursal=options['sucursal'])
+            stock = stock.filter(sucursal=options['sucursal'])
+
+        lotes_incorrectos = self._lotes_incorrectos(lotes)
+
+        if options['verificar']:
+            stock_incorrecto = self._stock_incorrecto(lotes, stock)
+            if lotes_incorrectos or stock_incorrecto:
+                raise CommandError(
+                    f'{len(lotes_incorrectos)} lotes y {len(stock_incorrecto)} filas de stock '
+                    f'con contador incorrecto.'
+                )
+            self.stdout.write(self.style.SUCCESS('Todos los contadores coinciden.'))
+            return
+
+        # Se recalcula dentro del UPDATE para no pisar aprobaciones concurrentes.
+        with transaction.atomic():
+            Lote.objects.filter(pk__in=[pk for pk, *_ in lotes_incorrectos]).update(
+                cantidad_restante=_disponibles_reales()
+            )
+            pares = set(lotes.values_list('producto_id', 'sucursal_id').distinct())
+            pares |= set(stock.values_list('producto_id', 'sucursal_id'))
+            pares_ordenados = sorted(pares)
+            for i in range(0, len(pares_ordenados), 500):
+                StockSucursal.recalcular(pares_ordenados[i:i + 500])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(lotes_incorrectos)} lotes corregidos; {len(pares)} filas de stock recalculadas.'
+        ))
+
+    def _lotes_incorrectos(self, lotes):
+        filas = (
+            lotes.annotate(reales=_disponibles_reales())
+            .values_list('pk', 'codigo_lote', 'cantidad_restante', 'reales')
+            .order_by('pk')
+        )
+        incorrectos = [fila for fila in filas if fila[2] != fila[3]]
+        for _pk, codigo, guardado, real in incorrectos:
+            self.stdout.write(f'Lote {codigo}: contador={guardado}, unidades disponibles={real}')
+        return incorrectos
+
+    def _stock_incorrecto(self, lotes, stock):
+        esperado = {
+            (r['producto_id'], r['sucursal_id']): (r['disponibles'], r['abiertos'], r['mas_antiguo'])
+            for r in lotes.filter(cantidad_restante__gt=0)
+            .values('producto_id', 'sucursal_id')
+            .annotate(
+                disponibles=Sum('cantidad_restante'),
+                abiertos=Count('id'),
+                mas_antiguo=Min('fecha_entrada'),
+            )
+            .order_by()
+        }
+        guardado = {
+            (s.producto_id, s.sucursal_id): (s.cantidad_disponible, s.lotes_abiertos, s.lote_mas_antiguo)
+            for s in stock
+        }
+
+        incorrectos = []
+        for par in esperado.keys() | guardado.keys():
+            real = esperado.get(par, (0, 0, None))
+            if guardado.get(par, (0, 0, None)) != real:
+                incorrectos.append(par)
+                self.stdout.write(
+                    f'Stock producto={par[0]} sucursal={par[1]}: '
+                    f'guardado={guardado.get(par)}, esperado={real}'
+                )
+        return incorrectos
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:13
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_cantidad_restante(apps, schema_editor):
+    Lote = apps.get_model('productos', 'Lote')
+    Unidad = apps.get_model('productos', 'Unidad')
+    disponibles = (
+        Unidad.objects.filter(lote=OuterRef('pk'), status='disponible')
+        .values('lote')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    Lote.objects.update(cantidad_restante=Coalesce(Subquery(disponibles), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0021_fill_and_fix_lote_sucursal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lote',
+            name='cantidad_restante',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_cantidad_restante, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def fill_stock(apps, schema_editor):
+    Lote = apps.get_model('productos', 'Lote')
+    StockSucursal = apps.get_model('productos', 'StockSucursal')
+    filas = (
+        Lote.objects.filter(cantidad_restante__gt=0)
+        .values('producto_id', 'sucursal_id')
+        .annotate(disponibles=Sum('cantidad_restante'), abiertos=Count('id'), mas_antiguo=Min('fecha_entrada'))
+        .order_by()
+    )
+    StockSucursal.objects.bulk_create(
+        [
+            StockSucursal(
+                producto_id=f['producto_id'],
+                sucursal_id=f['sucursal_id'],
+                cantidad_disponible=f['disponibles'],
+                lotes_abiertos=f['abiertos'],
+                lote_mas_antiguo=f['mas_antiguo'],
+            )
+            for f in filas.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0022_lote_cantidad_restante'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSucursal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad_disponible', models.PositiveIntegerField(default=0)),
+                ('lotes_abiertos', models.PositiveIntegerField(default=0)),
+                ('lote_mas_antiguo', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_sucursales', to='productos.producto')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='organizacion.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Stock por sucursal',
+                'verbose_name_plural': 'Stock por sucursal',
+                'constraints': [models.UniqueConstraint(fields=('sucursal', 'producto'), name='stock_sucursal_producto_unico')],
+            },
+        ),
+        migrations.RunPython(fill_stock, reverse_code=migrations.RunPython.noop),
+    ]
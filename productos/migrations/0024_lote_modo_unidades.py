@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0023_stocksucursal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lote',
+            name='modo_unidades',
+            field=models.CharField(choices=[('individual', 'Una fila por unidad'), ('rango', 'Rango compacto de series')], default='individual', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='RangoUnidades',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.PositiveIntegerField()),
+                ('fin', models.PositiveIntegerField()),
+                ('status', models.CharField(default='retirada', max_length=20)),
+                ('actualizado', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rangos', to='productos.lote')),
+            ],
+            options={
+                'verbose_name': 'Rango de unidades',
+                'verbose_name_plural': 'Rangos de unidades',
+                'ordering': ['lote', 'inicio'],
+            },
+        ),
+    ]
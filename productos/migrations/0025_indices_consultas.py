@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0024_lote_modo_unidades'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(condition=models.Q(('cantidad_restante__gt', 0)), fields=['sucursal', 'producto', 'fecha_entrada'], name='lote_abierto_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('status', 'inactivo'), _negated=True), fields=['codigo_interno'], name='producto_activo_codigo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rangounidades',
+            index=models.Index(fields=['lote', 'inicio'], name='rango_lote_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='unidad',
+            index=models.Index(condition=models.Q(('status', 'disponible')), fields=['lote', 'id'], name='unidad_lote_disponible_idx'),
+        ),
+    ]
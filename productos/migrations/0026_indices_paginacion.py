@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0025_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(fields=['sucursal', '-creado', '-id'], name='lote_sucursal_pagina_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0027_catalogo_actualizado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(condition=models.Q(('modo_unidades', 'rango')), fields=['sucursal', 'id'], name='lote_compacto_idx'),
+        ),
+    ]
@@ -1,13 +1,18 @@
 import uuid
+from collections import Counter, defaultdict
 
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, F, Min, Q, Sum, Value, When
 from django.utils import timezone
 
+from .unidades import UnidadVirtual, codigo_unidad, tomar_series, tramos_libres
+
 
 class Marca(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     activo = models.BooleanField(default=True)
+    actualizado = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'Marca'
@@ -22,6 +27,7 @@ class Equipo(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     marca = models.ForeignKey(Marca, on_delete=models.CASCADE, related_name='equipos')
     activo = models.BooleanField(default=True)
+    actualizado = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'Equipo'
@@ -35,6 +41,7 @@ class Equipo(models.Model):
 class Categoría(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     descripcion = models.TextField(blank=True, null=True)
+    actualizado = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'Categoría'
@@ -52,6 +59,7 @@ class Proveedor(models.Model):
     correo = models.EmailField(blank=True, null=True)
     direccion = models.TextField(blank=True, null=True)
     activo = models.BooleanField(default=True)
+    actualizado = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'Proveedor'
@@ -90,6 +98,14 @@ class Producto(models.Model):
     class Meta:
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
+        indexes = [
+            # productos_queryset y exportaciones: solo productos no inactivos, por código.
+            models.Index(
+                fields=['codigo_interno'], condition=~models.Q(status='inactivo'), name='producto_activo_codigo_idx'
+            ),
+            # Validadores de GET condicional: max(actualizado).
+            models.Index(fields=['actualizado'], name='producto_actualizado_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if self.status == 'inactivo' and self.movimientoitem_set.exists():
@@ -101,11 +117,22 @@ class Producto(models.Model):
 
 
 class Lote(models.Model):
+    MODOS_UNIDADES = [
+        ('individual', 'Una fila por unidad'),
+        ('rango', 'Rango compacto de series'),
+    ]
+
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='lotes')
     codigo_lote = models.CharField(max_length=100, unique=True)
     sucursal = models.ForeignKey('organizacion.Sucursal', on_delete=models.PROTECT, related_name='lotes')
 
     cantidad_inicial = models.PositiveIntegerField()
+    # Contador de unidades con status='disponible'. Se mantiene en la misma
+    # transacción que crea o retira unidades; ver recalcular_contadores.
+    cantidad_restante = models.PositiveIntegerField(default=0)
+    # 'rango': las unidades son las series 1..cantidad_inicial y solo se guardan
+    # los tramos no disponibles en RangoUnidades (ver productos/unidades.py).
+    modo_unidades = models.CharField(max_length=10, choices=MODOS_UNIDADES, default='individual')
 
     fecha_entrada = models.DateTimeField(default=timezone.now)
     creado = models.DateTimeField(default=timezone.now)
@@ -114,10 +141,271 @@ class Lote(models.Model):
     class Meta:
         verbose_name = 'Lote'
         verbose_name_plural = 'Lotes'
+        indexes = [
+            # StockSucursal.recalcular y lotes abiertos por sucursal.
+            models.Index(
+                fields=['sucursal', 'producto', 'fecha_entrada'],
+                condition=models.Q(cantidad_restante__gt=0),
+                name='lote_abierto_idx',
+            ),
+            # Paginación keyset del listado por sucursal.
+            models.Index(fields=['sucursal', '-creado', '-id'], name='lote_sucursal_pagina_idx'),
+            # Validadores de GET condicional: max(actualizado) y conteo por sucursal.
+            models.Index(fields=['sucursal', 'actualizado'], name='lote_sucursal_actualizado_idx'),
+            # Unidades de lotes compactos por sucursal, en orden de lote (UnidadViewSet).
+            models.Index(fields=['sucursal', 'id'], condition=models.Q(modo_unidades='rango'), name='lote_compacto_idx'),
+        ]
     
     def __str__(self):
         return self.codigo_lote
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            StockSucursal.recalcular([(self.producto_id, self.sucursal_id)])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            StockSucursal.recalcular([(self.producto_id, self.sucursal_id)])
+            return resultado
+
+    @classmethod
+    def ajustar_cantidad_restante(cls, lote_id, delta):
+        """Suma delta (positivo o negativo) al contador de disponibles del lote."""
+        cls.ajustar_cantidades({lote_id: delta})
+
+    def codigo_unidad(self, serie):
+        return codigo_unidad(self.codigo_lote, serie)
+
+    def iter_unidades(self, despues_de=0, status=None):
+        """Itera las unidades del lote en orden, sin importar el modo de almacenamiento.
+
+        despues_de (id en lotes individuales, serie en compactos) y status
+        acotan el recorrido. En lotes compactos se resuelven por tramo: una
+        página profunda o un filtro por status no generan las unidades que saltan.
+        """
+        if self.modo_unidades != 'rango':
+            unidades = self.unidades.filter(pk__gt=despues_de)
+            if status:
+                unidades = unidades.filter(status=status)
+            yield from unidades.order_by('id').iterator(chunk_size=2000)
+            return
+
+        for inicio, fin, status_tramo, actualizado in self.tramos():
+            if fin <= despues_de or (status and status_tramo != status):
+                continue
+            for serie in range(max(inicio, despues_de + 1), fin + 1):
+                yield UnidadVirtual(self.pk, serie, self.codigo_unidad(serie), status_tramo, actualizado)
+
+    def tramos(self):
+        """Tramos (inicio, fin, status, actualizado) que cubren las series 1..cantidad_inicial, en orden.
+
+        Los huecos entre RangoUnidades son series disponibles desde fecha_entrada.
+        """
+        ocupados = [(t.inicio, t.fin, t.status, t.actualizado) for t in self.rangos.all()]  # Meta.ordering: por inicio
+        libres = [
+            (inicio, fin, 'disponible', self.fecha_entrada)
+            for inicio, fin in tramos_libres(self.cantidad_inicial, [(i, f) for i, f, _, _ in ocupados])
+        ]
+        return sorted(ocupados + libres, key=lambda tramo: tramo[0])
+
+    def unidad_virtual(self, serie):
+        if not 1 <= serie <= self.cantidad_inicial:
+            return None
+        tramo = self.rangos.filter(inicio__lte=serie, fin__gte=serie).first()
+        if tramo:
+            return UnidadVirtual(self.pk, serie, self.codigo_unidad(serie), tramo.status, tramo.actualizado)
+        return UnidadVirtual(self.pk, serie, self.codigo_unidad(serie), 'disponible', self.fecha_entrada)
+
+    @classmethod
+    def descontar(cls, cantidades):
+        """Resta {lote_id: cantidad} a cantidad_restante; ver ajustar_cantidades."""
+        cls.ajustar_cantidades({pk: -n for pk, n in cantidades.items()})
+
+    @classmethod
+    def ajustar_cantidades(cls, deltas):
+        """Suma {lote_id: delta} a cantidad_restante con un solo UPDATE y recalcula su stock una vez."""
+        deltas = {pk: n for pk, n in deltas.items() if n}
+        if not deltas:
+            return
+        cls.objects.filter(pk__in=deltas).update(
+            cantidad_restante=F('cantidad_restante') + Case(
+                *[When(pk=pk, then=Value(n)) for pk, n in deltas.items()], default=Value(0),
+            ),
+            actualizado=timezone.now(),
+        )
+        StockSucursal.recalcular(cls.objects.filter(pk__in=deltas).values_list('producto_id', 'sucursal_id'))
+
+    def retirar_series(self, cantidad, status='retirada'):
+        """Marca las primeras `cantidad` series disponibles de un lote compacto.
+
+        El llamador debe tener bloqueada la fila del lote (select_for_update).
+        Devuelve los tramos tomados [(inicio, fin), ...]; ver retirar_series_de.
+        """
+        return Lote.retirar_series_de([(self, cantidad)], status)[0]
+
+    @classmethod
+    def retirar_series_de(cls, pedidos, status='retirada'):
+        """retirar_series para varios pedidos [(lote, cantidad)] con un número fijo de consultas.
+
+        Los lotes deben estar bloqueados y pueden repetirse; cada pedido toma las
+        series libres que dejaron los anteriores. Extiende los tramos contiguos con
+        el mismo status en lugar de crear filas nuevas, así un lote consumido en
+        orden conserva un único tramo. Devuelve los tramos tomados por pedido y
+        ajusta cantidad_restante.
+        """
+        tramos_de = defaultdict(list)
+        for tramo in RangoUnidades.objects.filter(lote__in={lote.pk for lote, _ in pedidos}).order_by('lote', 'inicio'):
+            tramos_de[tramo.lote_id].append(tramo)
+
+        ahora = timezone.now()
+        cambiados = {}  # id(tramo) -> tramo por guardar
+        borrados = set()
+        descuentos = Counter()
+        resultado = []
+        for lote, cantidad in pedidos:
+            tramos = tramos_de[lote.pk]
+            tomados = tomar_series(tramos_libres(lote.cantidad_inicial, [(t.inicio, t.fin) for t in tramos]), cantidad)
+            if tomados is None:
+                raise ValueError(f'No hay suficientes unidades disponibles en el lote {lote.codigo_lote}')
+
+            por_fin = {t.fin: t for t in tramos if t.status == status}
+            por_inicio = {t.inicio: t for t in tramos if t.status == status}
+            for inicio, fin in tomados:
+                previo = por_fin.pop(inicio - 1, None)
+                siguiente = por_inicio.pop(fin + 1, None)
+                if previo and siguiente:
+                    previo.fin = siguiente.fin
+                    tramos.remove(siguiente)
+                    cambiados.pop(id(siguiente), None)
+                    if siguiente.pk:
+                        borrados.add(siguiente.pk)
+                elif previo:
+                    previo.fin = fin
+                elif siguiente:
+                    siguiente.inicio = inicio
+                    previo = siguiente
+                else:
+                    previo = RangoUnidades(lote=lote, inicio=inicio, fin=fin, status=status)
+                    tramos.append(previo)
+                previo.actualizado = ahora
+                cambiados[id(previo)] = previo
+                por_fin[previo.fin] = previo
+                por_inicio[previo.inicio] = previo
+            tramos.sort(key=lambda t: t.inicio)
+            descuentos[lote.pk] += cantidad
+            resultado.append(tomados)
+
+        RangoUnidades.objects.filter(pk__in=borrados).delete()
+        RangoUnidades.objects.bulk_update(
+            [t for t in cambiados.values() if t.pk], ['inicio', 'fin', 'actualizado'],
+        )
+        RangoUnidades.objects.bulk_create([t for t in cambiados.values() if not t.pk])
+        cls.descontar(descuentos)
+        return resultado
+
+
+class RangoUnidades(models.Model):
+    """Tramo de series [inicio, fin] de un lote compacto que ya no está disponible."""
+    lote = models.ForeignKey(Lote, on_delete=models.CASCADE, related_name='rangos')
+    inicio = models.PositiveIntegerField()
+    fin = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, default='retirada')
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Rango de unidades'
+        verbose_name_plural = 'Rangos de unidades'
+        ordering = ['lote', 'inicio']
+        indexes = [
+            models.Index(fields=['lote', 'inicio'], name='rango_lote_inicio_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.lote.codigo_lote} [{self.inicio}-{self.fin}] {self.status}'
+
+
+class UnidadQuerySet(models.QuerySet):
+    # A partir de cuántas unidades crear_disponibles usa COPY en PostgreSQL.
+    UNIDADES_COPY = 5000
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create no pasa por save(): se ajustan los contadores por lote aquí.
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Lote.ajustar_cantidades(Counter(u.lote_id for u in objs if u.status == 'disponible'))
+        return objs
+
+    def crear_disponibles(self, lotes):
+        """Inserta cantidad_inicial unidades disponibles por lote, sin tocar los contadores.
+
+        Para lotes recién creados con cantidad_restante = cantidad_inicial. Las
+        consultas dependen del total de unidades, no de los lotes; en PostgreSQL,
+        con UNIDADES_COPY o más, se cargan con COPY en una sola operación.
+        """
+        conexion = connections[self.db]
+        total = sum(lote.cantidad_inicial for lote in lotes)
+        filas = ((lote.pk, str(uuid.uuid4())) for lote in lotes for _ in range(lote.cantidad_inicial))
+        if conexion.vendor == 'postgresql' and total >= self.UNIDADES_COPY:
+            q = conexion.ops.quote_name
+            ahora = timezone.now()
+            with conexion.cursor() as cursor, cursor.copy(
+                f'COPY {q(Unidad._meta.db_table)} (lote_id, codigo_unidad, status, actualizado) FROM STDIN'
+            ) as copia:
+                for lote_id, codigo in filas:
+                    copia.write_row((lote_id, codigo, 'disponible', ahora))
+            return
+        super().bulk_create([Unidad(lote_id=pk, codigo_unidad=codigo) for pk, codigo in filas], batch_size=2000)
+
+    def retirar_disponibles(self, pedidas, status='retirada'):
+        """Retira las primeras n unidades disponibles (por id) de cada lote {lote_id: n} en una sentencia.
+
+        UPDATE ... RETURNING: elige, marca y devuelve las unidades de una vez. En
+        PostgreSQL las filas se eligen con FOR UPDATE SKIP LOCKED, así dos
+        aprobaciones simultáneas del mismo lote toman unidades distintas sin
+        esperarse; si las que quedan libres no alcanzan se devuelven menos.
+        Devuelve {lote_id: [ids]} en orden, con una lista (quizá vacía) por cada
+        lote pedido. No ajusta cantidad_restante.
+        """
+        retiradas = {lote_id: [] for lote_id in pedidas}
+        pedidas = {lote_id: n for lote_id, n in pedidas.items() if n}
+        if not pedidas:
+            return retiradas
+        conexion = connections[self.db]
+        q = conexion.ops.quote_name
+        tabla = q(Unidad._meta.db_table)
+        ahora = conexion.ops.adapt_datetimefield_value(timezone.now())
+
+        if conexion.vendor == 'postgresql':
+            sql = (
+                f'WITH pedidas (lote_id, n) AS (VALUES {", ".join(["(%s::bigint, %s::integer)"] * len(pedidas))}) '
+                f'UPDATE {tabla} SET status = %s, actualizado = %s WHERE id IN ('
+                f'SELECT u.id FROM pedidas CROSS JOIN LATERAL ('
+                f'SELECT id FROM {tabla} WHERE lote_id = pedidas.lote_id AND status = %s '
+                f'ORDER BY id LIMIT pedidas.n FOR UPDATE SKIP LOCKED) u'
+                f') RETURNING lote_id, id'
+            )
+            parametros = [v for par in pedidas.items() for v in par] + [status, ahora, 'disponible']
+        else:
+            # SQLite bloquea toda la base al escribir: basta con numerar las disponibles por lote.
+            sql = (
+                f'UPDATE {tabla} SET status = %s, actualizado = %s WHERE id IN ('
+                f'SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY lote_id ORDER BY id) AS orden, '
+                f'CASE lote_id {" ".join(["WHEN %s THEN %s"] * len(pedidas))} END AS limite '
+                f'FROM {tabla} WHERE status = %s AND lote_id IN ({", ".join(["%s"] * len(pedidas))})'
+                f') WHERE orden <= limite'
+                f') RETURNING lote_id, id'
+            )
+            parametros = [status, ahora, *(v for par in pedidas.items() for v in par), 'disponible', *pedidas]
+
+        with conexion.cursor() as cursor:
+            cursor.execute(sql, parametros)
+            filas = sorted(cursor.fetchall())
+        for lote_id, unidad_id in filas:
+            retiradas[lote_id].append(unidad_id)
+        return retiradas
+
 
 class Unidad(models.Model):
     lote = models.ForeignKey(Lote, on_delete=models.CASCADE, related_name='unidades')
@@ -125,9 +413,124 @@ class Unidad(models.Model):
     status = models.CharField(max_length=20, default='disponible')
     actualizado = models.DateTimeField(auto_now=True)
 
+    objects = UnidadQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Unidad'
         verbose_name_plural = 'Unidades'
+        indexes = [
+            # Asignación de unidades: disponibles de un lote en orden de id.
+            models.Index(
+                fields=['lote', 'id'], condition=models.Q(status='disponible'), name='unidad_lote_disponible_idx'
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._status_db = instance.__dict__.get('status')
+        instance._lote_db = instance.__dict__.get('lote_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Descuenta del lote y status guardados y suma a los nuevos (la unidad puede cambiar de lote).
+        deltas = Counter({self.lote_id: int(self.status == 'disponible')})
+        if not self._state.adding:
+            deltas[getattr(self, '_lote_db', self.lote_id)] -= int(getattr(self, '_status_db', None) == 'disponible')
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Lote.ajustar_cantidades(deltas)
+        self._status_db = self.status
+        self._lote_db = self.lote_id
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            if getattr(self, '_status_db', self.status) == 'disponible':
+                Lote.ajustar_cantidad_restante(getattr(self, '_lote_db', self.lote_id), -1)
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return f'Unidad de {self.lote.producto.codigo_interno}, lote {self.lote.codigo_lote}: {self.codigo_unidad}'
+
+
+class StockSucursal(models.Model):
+    """Resumen de existencias por (producto, sucursal).
+
+    Modelo de lectura derivado de Lote.cantidad_restante; se recalcula en la
+    misma transacción que modifica los contadores de sus lotes.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='stock_sucursales')
+    sucursal = models.ForeignKey('organizacion.Sucursal', on_delete=models.CASCADE, related_name='stock')
+
+    cantidad_disponible = models.PositiveIntegerField(default=0)
+    lotes_abiertos = models.PositiveIntegerField(default=0)
+    lote_mas_antiguo = models.DateTimeField(blank=True, null=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Stock por sucursal'
+        verbose_name_plural = 'Stock por sucursal'
+        constraints = [
+            models.UniqueConstraint(fields=['sucursal', 'producto'], name='stock_sucursal_producto_unico'),
+        ]
+
+    def __str__(self):
+        return f'{self.producto_id} en sucursal {self.sucursal_id}: {self.cantidad_disponible}'
+
+    @classmethod
+    def recalcular(cls, pares):
+        """Recalcula las filas de los pares (producto_id, sucursal_id) indicados.
+
+        Primero crea las filas que falten y las bloquea en orden (sucursal,
+        producto): dos transacciones que tocan el mismo par se esperan aquí, y
+        la segunda agrega los lotes ya con lo que confirmó la primera en lugar
+        de pisarlo con un total viejo. El orden fijo evita deadlocks entre
+        llamadas con varios pares. Luego, una consulta agregada sobre Lote y un
+        upsert, sin importar cuántos pares.
+        """
+        pares = sorted(set(pares), key=lambda par: (par[1], par[0]))
+        if not pares:
+            return
+
+        filtro = Q()
+        for producto_id, sucursal_id in pares:
+            filtro |= Q(producto_id=producto_id, sucursal_id=sucursal_id)
+
+        cls.objects.bulk_create(
+            [cls(producto_id=producto_id, sucursal_id=sucursal_id) for producto_id, sucursal_id in pares],
+            ignore_conflicts=True,
+        )
+        list(cls.objects.filter(filtro).order_by('sucursal_id', 'producto_id').select_for_update().values_list('pk'))
+
+        agregados = {
+            (r['producto_id'], r['sucursal_id']): r
+            for r in Lote.objects.filter(filtro, cantidad_restante__gt=0)
+            .values('producto_id', 'sucursal_id')
+            .annotate(
+                disponibles=Sum('cantidad_restante'),
+                abiertos=Count('id'),
+                mas_antiguo=Min('fecha_entrada'),
+            )
+            .order_by()
+        }
+
+        ahora = timezone.now()
+        filas = []
+        for producto_id, sucursal_id in pares:
+            r = agregados.get((producto_id, sucursal_id), {})
+            filas.append(cls(
+                producto_id=producto_id,
+                sucursal_id=sucursal_id,
+                cantidad_disponible=r.get('disponibles') or 0,
+                lotes_abiertos=r.get('abiertos') or 0,
+                lote_mas_antiguo=r.get('mas_antiguo'),
+                actualizado=ahora,
+            ))
+
+        cls.objects.bulk_create(
+            filas,
+            update_conflicts=True,
+            unique_fields=['sucursal', 'producto'],
+            update_fields=['cantidad_disponible', 'lotes_abiertos', 'lote_mas_antiguo', 'actualizado'],
+        )
@@ -1,49 +1,83 @@
-from datetime import timedelta
-from collections import defaultdict
+from math import sqrt
 
-from django.db.models import Count, OuterRef, Subquery, IntegerField, Value, Prefetch, Q, Sum
-from django.db.models.functions import Coalesce
-from django.utils import timezone
+from django.db.models import (
+    Count, F, FilteredRelation, FloatField, OuterRef, Subquery, IntegerField, Value, Prefetch, Q, Sum,
+)
+from django.db.models.functions import Cast, Coalesce
 
-from .models import Lote, Producto, Unidad, Equipo
-from movimiento.models import MovimientoItem
-from system.models import ConfiguracionSistema
+from . import reorden
+from .models import Lote, Producto, Equipo, StockSucursal
+from movimiento.models import CicloRendimiento, RendimientoEquipo
 
 
-def productos_queryset(sucursal_id=None):
-    unidades_subquery = (
-        Unidad.objects.filter(lote__producto=OuterRef('pk'), status='disponible')
-        .values('lote__producto')
-        .annotate(total=Count('id'))
-    )
+def _columnas(modelo, campos):
+    """Columnas concretas para .only() a partir de los campos pedidos por ?fields=."""
+    concretos = {f.name for f in modelo._meta.concrete_fields}
+    return {'id'} | (set(campos) & concretos)
 
-    if sucursal_id is not None:
-        unidades_subquery = unidades_subquery.filter(lote__sucursal=sucursal_id)
 
-    return (
-        Producto.objects.exclude(status='inactivo')
-        .select_related('categoria', 'proveedor')
-        .prefetch_related(
-            Prefetch(
-                'equipos',
-                queryset=Equipo.objects.filter(activo=True, marca__activo=True).select_related('marca')
-            ),
+def productos_queryset(sucursal_id=None, campos=None, expandir=None):
+    """Productos no inactivos con sus existencias.
+
+    campos / expandir: conjuntos de ?fields= / ?expand= (None = todo). Las
+    relaciones que no se piden o no se expanden no se cargan.
+    """
+    def incluye(campo):
+        return campos is None or campo in campos
+
+    def expande(campo):
+        return incluye(campo) and (expandir is None or campo in expandir)
+
+    qs = Producto.objects.exclude(status='inactivo')
+
+    relacionados = [r for r in ('categoria', 'proveedor') if expande(r)]
+    if relacionados:
+        qs = qs.select_related(*relacionados)
+    if incluye('equipos'):
+        equipos = Equipo.objects.filter(activo=True, marca__activo=True)
+        if expande('equipos'):
+            equipos = equipos.select_related('marca')
+        qs = qs.prefetch_related(Prefetch('equipos', queryset=equipos))
+    if campos is not None:
+        qs = qs.only(*_columnas(Producto, campos))
+
+    if not incluye('cantidad_disponible'):
+        return qs
+
+    # Existencias desde el resumen StockSucursal: un LEFT JOIN sobre la fila
+    # (producto, sucursal) en lugar de contar unidades por producto.
+    if sucursal_id is not None:
+        return qs.annotate(
+            stock_local=FilteredRelation('stock_sucursales', condition=Q(stock_sucursales__sucursal=sucursal_id)),
+            cantidad_disponible=Coalesce(F('stock_local__cantidad_disponible'), Value(0)),
         )
-        .annotate(
-            cantidad_disponible=Coalesce(
-                Subquery(unidades_subquery.values('total'), output_field=IntegerField()),
-                Value(0)
-            )
+
+    stock_subquery = (
+        StockSucursal.objects.filter(producto=OuterRef('pk'))
+        .values('producto')
+        .annotate(total=Sum('cantidad_disponible'))
+    )
+    return qs.annotate(
+        cantidad_disponible=Coalesce(
+            Subquery(stock_subquery.values('total'), output_field=IntegerField()),
+            Value(0)
         )
     )
 
 
-def lotes_queryset(sucursal_id=None):
+def lotes_queryset(sucursal_id=None, campos=None, expandir=None):
+    """Lotes de productos no inactivos; campos / expandir como en productos_queryset."""
     qs = Lote.objects.exclude(producto__status='inactivo')
 
     if sucursal_id is not None:
         qs = qs.filter(sucursal=sucursal_id)
 
+    if campos is not None:
+        qs = qs.only(*_columnas(Lote, campos))
+
+    if (campos is not None and 'producto' not in campos) or (expandir is not None and 'producto' not in expandir):
+        return qs
+
     return (
         qs
         .select_related('producto')
@@ -53,164 +87,84 @@ def lotes_queryset(sucursal_id=None):
                 queryset=Equipo.objects.filter(activo=True, marca__activo=True).select_related('marca')
             ),
         )
-        .annotate(cantidad_restante=Count('unidades', filter=Q(unidades__status='disponible')))
     )
 
 
-def rendimiento_data(sucursal_id, fecha_inicio=None, fecha_fin=None):
+def rendimiento_data(sucursal_id, fecha_inicio=None, fecha_fin=None, por_cantidad=False):
     """Rendimiento real de piezas/consumibles por producto.
 
-    Para cada par (producto, equipo_cliente) se ordenan las salidas aprobadas con
-    contador_uso_snapshot y se toman las diferencias consecutivas: cada delta es el
-    uso real consumido entre dos entregas. Se compara contra Producto.vida_util
-    (uso esperado entre entregas).
+    Cada delta es el uso de contador consumido entre dos entregas consecutivas
+    del mismo (producto, equipo_cliente); se compara contra Producto.vida_util
+    (uso esperado entre entregas). Los deltas ya están agregados en
+    RendimientoEquipo; con fechas se suman los CicloRendimiento del rango.
+
+    Por defecto se asume 1 pieza por entrega. Con por_cantidad=True cada delta se
+    divide entre la cantidad de la entrega previa (las piezas que cubrieron ese
+    intervalo), suponiendo que se consumen juntas.
 
     Devuelve una lista de dicts por producto:
         producto_id, codigo_interno, descripcion, vida_util,
-        ciclos (nº de deltas), uso_promedio, ratio (uso_promedio / vida_util)
+        ciclos (nº de deltas), uso_promedio, desviacion, ratio (uso_promedio / vida_util)
     ratio < 1 => la pieza se consume antes de lo esperado (rinde menos);
     ratio > 1 => dura más de lo esperado.
     """
-    items = (
-        MovimientoItem.objects.filter(
-            movimiento__tipo='salida',
-            movimiento__aprobado=True,
-            movimiento__sucursal=sucursal_id,
-            equipo_cliente__isnull=False,
-            contador_uso_snapshot__isnull=False,
+    if fecha_inicio or fecha_fin:
+        filas = CicloRendimiento.objects.filter(sucursal=sucursal_id)
+        if fecha_inicio:
+            filas = filas.filter(fecha_anterior__gte=fecha_inicio)
+        if fecha_fin:
+            filas = filas.filter(fecha__lte=fecha_fin)
+        uso = Cast('delta', FloatField())
+        if por_cantidad:
+            uso = uso / F('cantidad_anterior')
+        agregados = filas.values('producto_id').annotate(
+            n=Count('id'), suma=Sum(uso), cuadrados=Sum(uso * uso),
         )
-        .select_related('producto')
-        .order_by('producto_id', 'equipo_cliente_id', 'movimiento__creado')
-    )
-
-    if fecha_inicio:
-        items = items.filter(movimiento__creado__date__gte=fecha_inicio)
-    if fecha_fin:
-        items = items.filter(movimiento__creado__date__lte=fecha_fin)
-
-    # Snapshots agrupados por (producto, equipo_cliente), ya ordenados por fecha.
-    snapshots = defaultdict(list)
-    productos_info = {}
-    for it in items:
-        snapshots[(it.producto_id, it.equipo_cliente_id)].append(it.contador_uso_snapshot)
-        productos_info[it.producto_id] = it.producto
-
-    # Deltas consecutivos por producto.
-    # TODO: el cálculo no considera la cantidad (MovimientoItem.cantidad) de cada
-    # salida. Asume 1 pieza por entrega. Si una salida entrega cantidad > 1, el uso
-    # real por pieza sería delta / cantidad_de_la_entrega_previa (las piezas que
-    # cubrieron ese intervalo). Definir si las N piezas se consumen juntas o se
-    # almacenan antes de hacer el cálculo sensible a la cantidad.
-    deltas_por_producto = defaultdict(list)
-    for (producto_id, _eq), snaps in snapshots.items():
-        for anterior, actual in zip(snaps, snaps[1:]):
-            delta = actual - anterior
-            if delta >= 0:
-                deltas_por_producto[producto_id].append(delta)
+    else:
+        sufijo = '_por_pieza' if por_cantidad else ''
+        agregados = (
+            RendimientoEquipo.objects.filter(sucursal=sucursal_id)
+            .values('producto_id')
+            .annotate(n=Sum('ciclos'), suma=Sum(f'suma{sufijo}'), cuadrados=Sum(f'suma_cuadrados{sufijo}'))
+            .filter(n__gt=0)
+        )
+    agregados = {r['producto_id']: r for r in agregados.order_by()}
 
     resultado = []
-    for producto_id, deltas in deltas_por_producto.items():
-        if not deltas:
-            continue
-        producto = productos_info[producto_id]
-        uso_promedio = sum(deltas) / len(deltas)
-        vida_util = producto.vida_util or 1
+    productos = Producto.objects.filter(pk__in=agregados).values('id', 'codigo_interno', 'descripcion', 'vida_util')
+    for producto in productos:
+        r = agregados[producto['id']]
+        uso_promedio = r['suma'] / r['n']
+        varianza = max(r['cuadrados'] / r['n'] - uso_promedio ** 2, 0)
+        vida_util = producto['vida_util'] or 1
         resultado.append({
-            'producto_id': producto_id,
-            'codigo_interno': producto.codigo_interno,
-            'descripcion': producto.descripcion,
-            'vida_util': producto.vida_util,
-            'ciclos': len(deltas),
+            'producto_id': producto['id'],
+            'codigo_interno': producto['codigo_interno'],
+            'descripcion': producto['descripcion'],
+            'vida_util': producto['vida_util'],
+            'ciclos': r['n'],
             'uso_promedio': round(uso_promedio, 2),
+            'desviacion': round(sqrt(varianza), 2),
             'ratio': round(uso_promedio / vida_util, 2),
         })
 
-    resultado.sort(key=lambda r: r['ratio'])
+    resultado.sort(key=lambda r: (r['ratio'], r['producto_id']))
     return resultado
 
 
-def _config_int(clave, default):
-    try:
-        cfg = ConfiguracionSistema.objects.get(clave=clave)
-        return int(cfg.valor)
-    except (ConfiguracionSistema.DoesNotExist, TypeError, ValueError):
-        return default
-
-
 def reorden_data(sucursal_id):
     """Sugerencias heurísticas de reorden por proveedor.
 
-    NO es predicción con IA: se basa en el consumo promedio mensual histórico.
-        consumo_mensual = unidades salidas aprobadas en los últimos N meses / N
-        dias_cobertura  = cantidad_disponible / (consumo_mensual / 30)
-        sugerir si: cantidad_disponible < min_stock  O  dias_cobertura < lead_time
-        cantidad_sugerida = consumo_mensual * meses_objetivo - cantidad_disponible
+    NO es predicción con IA: se basa en el consumo promedio mensual histórico
+    (ver productos/reorden.py, que evalúa la misma heurística para varias
+    sucursales a la vez).
 
-    Parámetros configurables vía ConfiguracionSistema (claves):
+    Parámetros configurables vía ConfiguracionSistema (claves, defectos en
+    system/configuracion.py):
         reorden_lead_time_dias, reorden_meses_objetivo, reorden_meses_historial.
 
     Devuelve lista agrupada por proveedor:
         [{proveedor_id, proveedor_nombre, productos: [ {...}, ... ]}]
     """
-    # Valores por defecto si no existen las claves en ConfiguracionSistema.
-    REORDEN_LEAD_TIME_DIAS = 15
-    REORDEN_MESES_OBJETIVO = 2
-    REORDEN_MESES_HISTORIAL = 6
-
-    lead_time = _config_int('reorden_lead_time_dias', REORDEN_LEAD_TIME_DIAS)
-    meses_objetivo = _config_int('reorden_meses_objetivo', REORDEN_MESES_OBJETIVO)
-    meses_historial = _config_int('reorden_meses_historial', REORDEN_MESES_HISTORIAL)
-
-    desde = timezone.now() - timedelta(days=30 * meses_historial)
-
-    # Consumo total por producto en la ventana histórica (salidas aprobadas).
-    consumo = (
-        MovimientoItem.objects.filter(
-            movimiento__tipo='salida',
-            movimiento__aprobado=True,
-            movimiento__sucursal=sucursal_id,
-            movimiento__creado__gte=desde,
-        )
-        .values('producto_id')
-        .annotate(total=Sum('cantidad'))
-    )
-    consumo_mensual_por_producto = {
-        c['producto_id']: (c['total'] or 0) / meses_historial for c in consumo
-    }
-
-    productos = productos_queryset(sucursal_id).select_related('proveedor')
-
-    grupos = {}
-    for p in productos:
-        consumo_mensual = consumo_mensual_por_producto.get(p.pk, 0)
-
-        if consumo_mensual > 0:
-            dias_cobertura = p.cantidad_disponible / (consumo_mensual / 30)
-        else:
-            dias_cobertura = float('inf')
-
-        bajo_minimo = p.cantidad_disponible < p.min_stock
-        sin_cobertura = dias_cobertura < lead_time
-        if not (bajo_minimo or sin_cobertura):
-            continue
-
-        prov = p.proveedor
-        prov_id = prov.pk if prov else None
-        if prov_id not in grupos:
-            grupos[prov_id] = {
-                'proveedor_id': prov_id,
-                'proveedor_nombre': prov.nombre if prov else 'Sin proveedor',
-                'productos': [],
-            }
-
-        grupos[prov_id]['productos'].append({
-            'producto_id': p.pk,
-            'codigo_interno': p.codigo_interno,
-            'descripcion': p.descripcion,
-            'cantidad_disponible': p.cantidad_disponible,
-            'min_stock': p.min_stock,
-            'consumo_mensual': round(consumo_mensual, 2),
-            'dias_cobertura': None if dias_cobertura == float('inf') else round(dias_cobertura, 1),
-            'cantidad_sugerida': max(0, round(consumo_mensual * meses_objetivo - p.cantidad_disponible)),
-        })
-    return list(grupos.values())
+    sucursales = reorden.planear([int(sucursal_id)])['sucursales']
+    return sucursales[0]['proveedores'] if sucursales else []
@@ -0,0 +1,188 @@
+"""Planeación de reorden vectorizada para una o varias sucursales.
+
+Las existencias (StockSucursal) y el consumo (ConsumoDiario) de todas las
+sucursales pedidas se cargan en matrices NumPy de sucursal × producto y la
+heurística de reorden_data se evalúa en una sola pasada sobre ellas:
+
+    consumo_mensual = unidades salidas aprobadas en los últimos N meses / N
+    dias_cobertura  = cantidad_disponible / (consumo_mensual / 30)
+    sugerir si: cantidad_disponible < min_stock  O  dias_cobertura < lead_time
+    cantidad_sugerida = consumo_mensual * meses_objetivo - cantidad_disponible
+
+Solo se recorren en Python las celdas sugeridas, para armar la respuesta.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import catalogos
+from .models import Producto, StockSucursal
+from movimiento.models import ConsumoDiario
+from organizacion.models import Sucursal
+from system import configuracion
+
+
+def parametros():
+    config = configuracion.leer('reorden_lead_time_dias', 'reorden_meses_objetivo', 'reorden_meses_historial')
+    return {
+        'lead_time': config['reorden_lead_time_dias'],
+        'meses_objetivo': config['reorden_meses_objetivo'],
+        'meses_historial': config['reorden_meses_historial'],
+    }
+
+
+def calcular(disponible, consumo_total, min_stock, lead_time, meses_objetivo, meses_historial):
+    """Heurística de reorden sobre matrices (sucursal × producto).
+
+    min_stock es un vector por producto. Devuelve (consumo_mensual,
+    dias_cobertura, sugerir, cantidad_sugerida); dias_cobertura es inf sin consumo.
+    """
+    consumo_mensual = consumo_total / meses_historial
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dias_cobertura = np.where(consumo_mensual > 0, disponible / (consumo_mensual / 30), np.inf)
+    sugerir = (disponible < min_stock) | (dias_cobertura < lead_time)
+    # np.rint redondea al par más cercano, igual que round().
+    cantidad_sugerida = np.maximum(0, np.rint(consumo_mensual * meses_objetivo - disponible)).astype(np.int64)
+    return consumo_mensual, dias_cobertura, sugerir, cantidad_sugerida
+
+
+def _matriz(filas, sucursal_ids, producto_ids):
+    """Matriz sucursal × producto a partir de tuplas (sucursal_id, producto_id, valor).
+
+    Las tuplas de productos o sucursales que no están en los ids se ignoran.
+    """
+    matriz = np.zeros((len(sucursal_ids), len(producto_ids)), dtype=np.int64)
+    if not filas or not len(producto_ids):
+        return matriz
+    datos = np.array(filas, dtype=np.int64)
+
+    def posiciones(ids, valores):
+        orden = np.argsort(ids)
+        pos = np.searchsorted(ids, valores, sorter=orden).clip(max=len(ids) - 1)
+        indice = orden[pos]
+        return indice, ids[indice] == valores
+
+    fila, en_sucursales = posiciones(sucursal_ids, datos[:, 0])
+    columna, en_productos = posiciones(producto_ids, datos[:, 1])
+    validas = en_sucursales & en_productos
+    matriz[fila[validas], columna[validas]] = datos[validas, 2]
+    return matriz
+
+
+def cargar(sucursal_ids):
+    """Productos, sucursales y matrices de existencias y consumo desde la base de datos."""
+    config = parametros()
+    desde = timezone.localdate() - timedelta(days=30 * config['meses_historial'])
+
+    productos = list(
+        Producto.objects.exclude(status='inactivo').order_by('codigo_interno', 'id')
+        .values_list('id', 'codigo_interno', 'descripcion', 'min_stock', 'proveedor_id')
+    )
+    nombres = dict(Sucursal.objects.filter(pk__in=sucursal_ids).values_list('id', 'nombre'))
+    sucursales = [(pk, nombres[pk]) for pk in dict.fromkeys(sucursal_ids) if pk in nombres]
+
+    ids_sucursal = np.array([s[0] for s in sucursales], dtype=np.int64)
+    ids_producto = np.array([p[0] for p in productos], dtype=np.int64)
+    existencias = StockSucursal.objects.filter(sucursal__in=ids_sucursal.tolist()).values_list(
+        'sucursal_id', 'producto_id', 'cantidad_disponible',
+    )
+    consumo = (
+        ConsumoDiario.objects.filter(sucursal__in=ids_sucursal.tolist(), tipo='salida', fecha__gte=desde)
+        .values_list('sucursal_id', 'producto_id')
+        .annotate(total=Sum('unidades'))
+        .order_by()
+    )
+
+    proveedor_ids = {p[4] for p in productos if p[4] is not None}
+    proveedores = catalogos.obtener_con('proveedor', proveedor_ids)['objetos']
+    return {
+        'config': config,
+        'productos': productos,
+        'sucursales': sucursales,
+        'proveedores': {pk: proveedores[pk].nombre for pk in proveedor_ids},
+        'disponible': _matriz(list(existencias), ids_sucursal, ids_producto),
+        'consumo': _matriz(list(consumo), ids_sucursal, ids_producto),
+    }
+
+
+def _agrupar(filas, productos, proveedores):
+    """[(columna, dict)] en orden de producto -> grupos por proveedor en orden de aparición."""
+    grupos = {}
+    for columna, fila in filas:
+        prov_id = productos[columna][4]
+        if prov_id not in grupos:
+            grupos[prov_id] = {
+                'proveedor_id': prov_id,
+                'proveedor_nombre': proveedores[prov_id] if prov_id is not None else 'Sin proveedor',
+                'productos': [],
+            }
+        grupos[prov_id]['productos'].append(fila)
+    return list(grupos.values())
+
+
+def armar(datos):
+    """Pedidos por sucursal y consolidados por proveedor a partir de cargar()."""
+    productos = datos['productos']
+    config = datos['config']
+    disponible = datos['disponible']
+    min_stock = np.array([p[3] for p in productos], dtype=np.int64)
+    consumo_mensual, dias_cobertura, sugerir, cantidad_sugerida = calcular(
+        disponible, datos['consumo'], min_stock, **config,
+    )
+
+    por_sucursal = []
+    for i, (sucursal_id, sucursal_nombre) in enumerate(datos['sucursales']):
+        filas = []
+        for columna in np.flatnonzero(sugerir[i]).tolist():
+            producto_id, codigo, descripcion, minimo, _prov = productos[columna]
+            dias = float(dias_cobertura[i, columna])
+            filas.append((columna, {
+                'producto_id': producto_id,
+                'codigo_interno': codigo,
+                'descripcion': descripcion,
+                'cantidad_disponible': int(disponible[i, columna]),
+                'min_stock': minimo,
+                'consumo_mensual': round(float(consumo_mensual[i, columna]), 2),
+                'dias_cobertura': None if dias == float('inf') else round(dias, 1),
+                'cantidad_sugerida': int(cantidad_sugerida[i, columna]),
+            }))
+        por_sucursal.append({
+            'sucursal_id': sucursal_id,
+            'sucursal_nombre': sucursal_nombre,
+            'proveedores': _agrupar(filas, productos, datos['proveedores']),
+        })
+
+    # Consolidado: lo sugerido en cada sucursal, sumado por producto.
+    sucursales_sugeridas = sugerir.sum(axis=0)
+    total_sugerido = np.where(sugerir, cantidad_sugerida, 0).sum(axis=0)
+    total_disponible = disponible.sum(axis=0)
+    total_consumo = consumo_mensual.sum(axis=0)
+    filas = []
+    for columna in np.flatnonzero(sucursales_sugeridas).tolist():
+        producto_id, codigo, descripcion, _minimo, _prov = productos[columna]
+        filas.append((columna, {
+            'producto_id': producto_id,
+            'codigo_interno': codigo,
+            'descripcion': descripcion,
+            'cantidad_disponible': int(total_disponible[columna]),
+            'consumo_mensual': round(float(total_consumo[columna]), 2),
+            'cantidad_sugerida': int(total_sugerido[columna]),
+            'sucursales': int(sucursales_sugeridas[columna]),
+        }))
+
+    return {
+        'sucursales': por_sucursal,
+        'consolidado': _agrupar(filas, productos, datos['proveedores']),
+    }
+
+
+def planear(sucursal_ids):
+    """Sugerencias de reorden de varias sucursales.
+
+    Devuelve {'sucursales': [{sucursal_id, sucursal_nombre, proveedores}],
+    'consolidado': [{proveedor_id, proveedor_nombre, productos}]}; `proveedores`
+    tiene la misma forma que reorden_data().
+    """
+    return armar(cargar(list(sucursal_ids)))
@@ -1,7 +1,10 @@
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 
-from .models import Producto, Categoría, Marca, Proveedor, Equipo, Lote, Unidad
+from . import catalogos
+from .models import Producto, Categoría, Marca, Proveedor, Equipo, Lote, Unidad, StockSucursal
 from organizacion.models import EquipoCliente
+from utils.mixins import CamposDinamicosMixin
 
 __all__ = [
     'CategoriaSerializer',
@@ -15,60 +18,93 @@ __all__ = [
 ]
 
 
+class CatalogoRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField que resuelve los ids contra la caché de catálogos
+    (productos/catalogos.py) en lugar de hacer un SELECT por id."""
+
+    def __init__(self, catalogo, **kwargs):
+        self.catalogo = catalogo
+        kwargs.setdefault('queryset', catalogos.CATALOGOS[catalogo].objects.all())
+        super().__init__(**kwargs)
+
+    def objetos(self):
+        # Con many=True el mismo hijo valida todos los ids: se lee la caché una vez.
+        if not hasattr(self, '_objetos'):
+            self._objetos = catalogos.obtener(self.catalogo)[self.catalogo]['objetos']
+        return self._objetos
+
+    def to_internal_value(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        try:
+            if isinstance(data, bool):
+                raise TypeError
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        objeto = self.objetos().get(pk)
+        if objeto is None:
+            # Puede ser una fila de otra transacción aún no invalidada: se confirma en la base.
+            return super().to_internal_value(pk)
+        return objeto
+
+
 class CategoriaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Categoría
-        fields = '__all__'
+        exclude = ['actualizado']
         read_only_fields = ['id',]
 
 
 class MarcaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Marca
-        fields = '__all__'
+        exclude = ['actualizado']
         read_only_fields = ['id',]
 
 
 class EquipoSerializer(serializers.ModelSerializer):
     marca = MarcaSerializer(read_only=True)
-    marca_id = serializers.PrimaryKeyRelatedField(
-        queryset=Marca.objects.all(),
+    marca_id = CatalogoRelatedField(
+        'marca',
         write_only=True,
         source='marca'
     )
 
     class Meta:
         model = Equipo
-        fields = '__all__'
+        exclude = ['actualizado']
         read_only_fields = ['id',]
 
 
 class ProveedorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Proveedor
-        fields = '__all__'
+        exclude = ['actualizado']
         read_only_fields = ['id',]
 
 
-class ProductoSerializer(serializers.ModelSerializer):
+class ProductoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    campos_expandibles = ('categoria', 'proveedor', 'equipos')
+
     cantidad_disponible = serializers.SerializerMethodField()
     categoria = CategoriaSerializer(read_only=True)
     equipos = EquipoSerializer(read_only=True, many=True)
     proveedor = ProveedorSerializer(read_only=True)
 
-    categoria_id = serializers.PrimaryKeyRelatedField(
-        queryset=Categoría.objects.all(),
+    categoria_id = CatalogoRelatedField(
+        'categoria',
         write_only=True,
         source='categoria'
     )
-    equipos_id = serializers.PrimaryKeyRelatedField(
-        queryset=Equipo.objects.all().select_related('marca'),
+    equipos_id = CatalogoRelatedField(
+        'equipo',
         write_only=True,
         many=True,
         source='equipos'
     )
-    proveedor_id = serializers.PrimaryKeyRelatedField(
-        queryset=Proveedor.objects.all(),
+    proveedor_id = CatalogoRelatedField(
+        'proveedor',
         write_only=True,
         source='proveedor',
         allow_null=True
@@ -79,16 +115,31 @@ class ProductoSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['id', 'creado', 'actualizado']
 
+    def create(self, validated_data):
+        return self._con_equipos(super().create(validated_data))
+
+    def update(self, instance, validated_data):
+        return self._con_equipos(super().update(instance, validated_data))
+
+    @staticmethod
+    def _con_equipos(instance):
+        # La respuesta anida cada equipo con su marca: una consulta en lugar de una por equipo.
+        prefetch_related_objects([instance], Prefetch('equipos', queryset=Equipo.objects.select_related('marca')))
+        return instance
+
     def get_cantidad_disponible(self, instance: Producto):
         if hasattr(instance, 'cantidad_disponible'):
             return instance.cantidad_disponible
         
-        return Unidad.objects.filter(
-            lote__producto=instance, status='disponible', lote__sucursal=self.context['request'].branch_id
-        ).count()
+        stock = StockSucursal.objects.filter(
+            producto=instance, sucursal=self.context['request'].branch_id
+        ).values_list('cantidad_disponible', flat=True).first()
+        return stock or 0
+
 
+class LoteSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    campos_expandibles = ('producto',)
 
-class LoteSerializer(serializers.ModelSerializer):
     class InlineProductoSerializer(ProductoSerializer):
         class Meta(ProductoSerializer.Meta):
             fields = ['id', 'codigo_interno', 'descripcion', 'equipos']
@@ -99,15 +150,10 @@ class LoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Lote
         fields = '__all__'
-        read_only_fields = ['id', 'creado', 'actualizado']
+        read_only_fields = ['id', 'creado', 'actualizado', 'modo_unidades']
     
     def get_cantidad_restante(self, instance: Lote):
-        if hasattr(instance, 'cantidad_restante'):
-            return instance.cantidad_restante
-        
-        return instance.unidades.filter(
-            status='disponible', lote__sucursal=self.context['request'].branch_id
-        ).count()
+        return instance.cantidad_restante
 
 
 class UnidadSerializer(serializers.ModelSerializer):
@@ -116,6 +162,11 @@ class UnidadSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['id', 'actualizado']
 
+    def validate_lote(self, value: Lote):
+        if value.modo_unidades == 'rango':
+            raise serializers.ValidationError('Las unidades de un lote compacto se derivan de su rango de series.')
+        return value
+
 
 class EquipoClienteSerializer(serializers.ModelSerializer):
     cliente_id = serializers.IntegerField(source='cliente.id', read_only=True)
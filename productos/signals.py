@@ -0,0 +1,47 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import catalogos, dashboard
+from .models import Categoría, Equipo, Marca, Producto, Proveedor
+from movimiento.signals import movimiento_aprobado
+from organizacion.models import Cliente
+
+
+@receiver(m2m_changed, sender=Producto.equipos.through)
+def tocar_producto_equipos(sender, instance, action, reverse, pk_set, **kwargs):
+    """Cambiar los equipos de un producto no pasa por Producto.save(); se marca
+    `actualizado` para que los validadores de GET condicional lo detecten."""
+    # pre_clear: después de limpiar ya no se sabe qué productos tenía el equipo.
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        productos = instance.producto_set.all() if action == 'pre_clear' else Producto.objects.filter(pk__in=pk_set)
+    else:
+        productos = Producto.objects.filter(pk=instance.pk)
+    productos.update(actualizado=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Categoría)
+@receiver([post_save, post_delete], sender=Marca)
+@receiver([post_save, post_delete], sender=Equipo)
+@receiver([post_save, post_delete], sender=Proveedor)
+def invalidar_catalogo(sender, **kwargs):
+    catalogos.invalidar_al_confirmar(catalogos.nombre_de(sender))
+
+
+@receiver([post_save, post_delete], sender=Producto)
+@receiver([post_save, post_delete], sender=Categoría)
+@receiver([post_save, post_delete], sender=Proveedor)
+def invalidar_dashboards(sender, **kwargs):
+    dashboard.invalidar()
+
+
+@receiver([post_save, post_delete], sender=Cliente)
+def invalidar_dashboard_cliente(sender, instance, **kwargs):
+    dashboard.invalidar(instance.sucursal_id)
+
+
+@receiver(movimiento_aprobado)
+def invalidar_dashboard_aprobacion(sender, instance, **kwargs):
+    dashboard.invalidar(instance.sucursal_id)
@@ -1,12 +1,34 @@
+import base64
+import json
+import re
+import threading
+import time
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIRequestFactory
 from rest_framework import status
 
-from movimiento.models import Movimiento, MovimientoItem, DetalleSalida
-from system.models import RegistroActividad
+from movimiento.models import (
+    CicloRendimiento, ConsumoDiario, Movimiento, MovimientoItem, DetalleEntrada, DetalleSalida, RendimientoEquipo,
+    UltimaEntrega,
+)
+from system.models import AlertaInventario, RegistroActividad
 from organizacion.models import Cliente, EquipoCliente, PerfilUsuario, Sucursal
-from .models import Marca, Equipo, Categoría, Proveedor, Producto, Lote, Unidad
+from . import catalogos, dashboard
+from .models import Marca, Equipo, Categoría, Proveedor, Producto, Lote, StockSucursal, Unidad
+from .queries import rendimiento_data, reorden_data
+from .views import LoteViewSet, ProductoViewSet
+from utils.pagination import PaginacionKeyset
 from .serializers import (
     CategoriaSerializer, MarcaSerializer, EquipoSerializer, ProveedorSerializer,
     ProductoSerializer, LoteSerializer, UnidadSerializer
@@ -105,6 +127,60 @@ class UnidadModelTest(APITestCase):
         self.assertIn("Unidad de P003, lote L002:", str(unidad))
 
 
+@override_settings(LOTES_UNIDADES_COMPACTAS=False)
+class RetirarDisponiblesTest(APITestCase):
+    """Unidad.objects.retirar_disponibles: PostgreSQL (LATERAL + SKIP LOCKED) y SQLite
+    (ROW_NUMBER) toman las mismas unidades; CI corre esta clase en ambas bases."""
+
+    def setUp(self):
+        categoria = Categoría.objects.create(nombre='Retiro')
+        self.lotes = [
+            Lote.objects.create(
+                producto=Producto.objects.create(
+                    codigo_interno=f'P-RET{i}', descripcion='Toner', categoria=categoria, sku=f'SKU-RET{i}',
+                    min_stock=0,
+                ),
+                codigo_lote=f'L-RET{i}', cantidad_inicial=0, sucursal_id=1,
+            )
+            for i in range(4)
+        ]
+        # Ids intercalados entre los tres primeros lotes; el cuarto no tiene unidades.
+        Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(6) for lote in self.lotes[:3]])
+        for n, unidad in enumerate(Unidad.objects.order_by('pk')):
+            if n % 4 == 1:
+                Unidad.objects.filter(pk=unidad.pk).update(status='vendida')
+
+    def _esperadas(self, pedidas):
+        return {
+            lote_id: list(
+                Unidad.objects.filter(lote_id=lote_id, status='disponible').order_by('pk').values_list('pk', flat=True)[:n]
+            ) if n else []
+            for lote_id, n in pedidas.items()
+        }
+
+    def test_mismas_unidades_que_en_python(self):
+        a, b, c, vacio = (lote.pk for lote in self.lotes)
+        for pedidas in ({a: 3, b: 10, c: 0, vacio: 2}, {a: 2, c: 1}, {a: 5, b: 1, c: 9}):
+            with self.subTest(pedidas=pedidas):
+                esperadas = self._esperadas(pedidas)
+                retiradas = Unidad.objects.retirar_disponibles(pedidas)
+
+                self.assertEqual(retiradas, esperadas)
+                self.assertEqual(
+                    set(Unidad.objects.filter(status='retirada', pk__in=[u for ids in esperadas.values() for u in ids])
+                        .values_list('pk', flat=True)),
+                    {u for ids in esperadas.values() for u in ids},
+                )
+        self.assertFalse(Unidad.objects.filter(status='disponible').exists())
+
+    def test_una_lista_por_lote_pedido(self):
+        a = self.lotes[0].pk
+        self.assertEqual(Unidad.objects.retirar_disponibles({}), {})
+        with self.assertNumQueries(0):
+            self.assertEqual(Unidad.objects.retirar_disponibles({a: 0}), {a: []})
+        self.assertEqual(Unidad.objects.retirar_disponibles({self.lotes[3].pk: 1}), {self.lotes[3].pk: []})
+
+
 class CategoriaSerializerTest(APITestCase):
     def test_serializer(self):
         categoria = Categoría.objects.create(nombre="Tinta")
@@ -526,11 +602,15 @@ class CambioAnticipadoTest(APITestCase):
             tipo='salida', creado_por=self.operativo, sucursal=self.sucursal,
         )
         DetalleSalida.objects.create(movimiento=prior_mov, cliente=self.cliente, tecnico='Prior', subtipo='renta')
-        MovimientoItem.objects.create(
+        prior_item = MovimientoItem.objects.create(
             movimiento=prior_mov, producto=self.producto, cantidad=1,
             lote=self.lote, equipo_cliente=self.equipo_cliente,
             contador_uso_snapshot=0,
         )
+        UltimaEntrega.objects.create(
+            producto=self.producto, equipo_cliente=self.equipo_cliente, item=prior_item,
+            contador_uso_snapshot=0, creado=prior_mov.creado,
+        )
 
         self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id}
 
@@ -622,16 +702,18 @@ class RendimientoTest(APITestCase):
             alias='Rend-Alias', contador_uso=240,
         )
 
-    def _salida(self, snapshot):
+    def _salida(self, snapshot, cantidad=1, equipo_cliente=None, creado=None):
         mov = Movimiento.objects.create(
             tipo='salida', creado_por=self.admin, sucursal=self.sucursal, aprobado=True,
+            creado=creado or timezone.now(),
         )
         DetalleSalida.objects.create(movimiento=mov, cliente=self.cliente)
-        MovimientoItem.objects.create(
-            movimiento=mov, producto=self.producto, cantidad=1,
-            lote=self.lote, equipo_cliente=self.equipo_cliente,
+        item = MovimientoItem.objects.create(
+            movimiento=mov, producto=self.producto, cantidad=cantidad,
+            lote=self.lote, equipo_cliente=equipo_cliente or self.equipo_cliente,
             contador_uso_snapshot=snapshot,
         )
+        RendimientoEquipo.registrar(item)
 
     def test_rendimiento_calcula_ratio(self):
         # snapshots 0 -> 120 -> 240 => dos deltas de 120; vida_util 100 => ratio 1.2
@@ -657,6 +739,93 @@ class RendimientoTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, [])
 
+    def test_rendimiento_por_cantidad(self):
+        # 2 piezas entregadas en 0 cubren hasta 240 => 120 por pieza
+        self._salida(0, cantidad=2)
+        self._salida(240)
+
+        response = self.client.get('/api/v1/productos/rendimiento/', **self.headers)
+        self.assertEqual(response.data[0]['uso_promedio'], 240.0)
+
+        response = self.client.get('/api/v1/productos/rendimiento/?porCantidad=true', **self.headers)
+        fila = response.data[0]
+        self.assertEqual(fila['ciclos'], 1)
+        self.assertEqual(fila['uso_promedio'], 120.0)
+        self.assertEqual(fila['ratio'], 1.2)
+
+    def test_rendimiento_entre_fechas(self):
+        def hace(dias):
+            return timezone.now() - timezone.timedelta(days=dias)
+
+        self._salida(0, creado=hace(20))
+        self._salida(300, creado=hace(10))
+        self._salida(400, creado=hace(5))
+        self._salida(500)
+
+        def ciclos(query):
+            response = self.client.get(f'/api/v1/productos/rendimiento/?{query}', **self.headers)
+            return [(f['ciclos'], f['uso_promedio']) for f in response.data]
+
+        self.assertEqual(ciclos(''), [(3, 166.67)])
+        # Solo cuentan los ciclos con ambas entregas dentro del rango.
+        desde = timezone.localdate(hace(12))
+        self.assertEqual(ciclos(f'fechaInicio={desde}'), [(2, 100.0)])
+        self.assertEqual(ciclos(f'fechaInicio={desde}&fechaFin={timezone.localdate(hace(6))}'), [])
+        self.assertEqual(ciclos(f'fechaFin={timezone.localdate(hace(1))}'), [(2, 200.0)])
+
+    def test_poblar_rendimiento_igual_a_incremental(self):
+        otro = EquipoCliente.objects.create(
+            equipo=Equipo.objects.create(nombre='EQ-Rend-2', marca=self.marca),
+            cliente=self.cliente, alias='Rend-Otro', contador_uso=200,
+        )
+        self._salida(0, cantidad=3)
+        self._salida(90)
+        self._salida(10, equipo_cliente=otro)
+        self._salida(5, equipo_cliente=otro)  # contador reiniciado: delta negativo, se ignora
+        self._salida(75, cantidad=2, equipo_cliente=otro)
+        self._salida(200, equipo_cliente=otro)
+
+        incremental = [rendimiento_data(self.sucursal.id, por_cantidad=p) for p in (False, True)]
+        self.assertEqual(incremental[0][0]['ciclos'], 3)
+        self.assertEqual(incremental[0][0]['uso_promedio'], round((90 + 70 + 125) / 3, 2))
+        self.assertEqual(incremental[1][0]['uso_promedio'], round((30 + 70 + 62.5) / 3, 2))
+
+        call_command('poblar_rendimiento', stdout=StringIO())
+        self.assertEqual([rendimiento_data(self.sucursal.id, por_cantidad=p) for p in (False, True)], incremental)
+
+
+    def test_aprobacion_fuera_de_orden_igual_a_poblar(self):
+        def hace(dias):
+            return timezone.now() - timezone.timedelta(days=dias)
+
+        def filas():
+            pares = RendimientoEquipo.objects.values_list(
+                'sucursal', 'producto', 'equipo_cliente', 'ultimo_snapshot', 'ultima_cantidad', 'ultima_fecha',
+                'ultimo_creado', 'ciclos', 'suma', 'suma_cuadrados', 'suma_por_pieza', 'suma_cuadrados_por_pieza',
+            )
+            ciclos = CicloRendimiento.objects.values_list('fecha_anterior', 'fecha', 'delta', 'cantidad_anterior')
+            return set(pares), sorted(ciclos)
+
+        # Se aprueban en otro orden que el de creación: 100 (hace 5 días), 300 (hoy) y al final 0 (hace 10).
+        self._salida(100, creado=hace(5))
+        self._salida(300, cantidad=2)
+        self._salida(0, cantidad=4, creado=hace(10))
+
+        rendimiento = RendimientoEquipo.objects.get()
+        self.assertEqual((rendimiento.ciclos, rendimiento.suma, rendimiento.ultimo_snapshot), (2, 300, 300))
+        self.assertEqual(rendimiento.suma_por_pieza, 100 / 4 + 200 / 1)
+        aprobadas = filas()
+
+        call_command('poblar_rendimiento', stdout=StringIO())
+        self.assertEqual(filas(), aprobadas)
+
+        # Después sigue sumando en orden.
+        self._salida(450)
+        self.assertEqual(RendimientoEquipo.objects.get().ciclos, 3)
+        aprobadas = filas()
+        call_command('poblar_rendimiento', stdout=StringIO())
+        self.assertEqual(filas(), aprobadas)
+
 
 class ExportacionTest(APITestCase):
     XLSX_CT = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -685,7 +854,7 @@ class ExportacionTest(APITestCase):
     def _load(self, response):
         from openpyxl import load_workbook
         import io
-        return load_workbook(io.BytesIO(response.content)).active
+        return load_workbook(io.BytesIO(response.getvalue())).active
 
     def test_exportar_existencias(self):
         response = self.client.get('/api/v1/productos/exportar/existencias/', **self.headers)
@@ -702,6 +871,33 @@ class ExportacionTest(APITestCase):
         self.assertEqual(fila[3], 3)  # 3 unidades disponibles
         self.assertEqual(fila[4], 2)  # min_stock
 
+    def test_exportar_existencias_csv_y_ndjson(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/v1/productos/exportar/existencias/?formato=csv', **self.headers)
+            contenido = response.getvalue().decode()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('existencias.csv', response['Content-Disposition'])
+        self.assertEqual(
+            contenido.splitlines(),
+            ['codigo_interno,descripcion,categoria,cantidad_disponible,min_stock', 'P-EXP,Producto Exp,Cat Exp,3,2'],
+        )
+        # Proyección: ni equipos ni una consulta por producto.
+        self.assertFalse([q for q in ctx.captured_queries if 'productos_equipo' in q['sql']])
+
+        response = self.client.get('/api/v1/productos/exportar/existencias/?formato=ndjson', **self.headers)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(linea) for linea in response.getvalue().decode().splitlines()],
+            [{
+                'codigo_interno': 'P-EXP', 'descripcion': 'Producto Exp', 'categoria': 'Cat Exp',
+                'cantidad_disponible': 3, 'min_stock': 2,
+            }],
+        )
+
+    def test_exportar_formato_invalido(self):
+        response = self.client.get('/api/v1/productos/exportar/existencias/?formato=pdf', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_exportar_rendimiento_vacio(self):
         response = self.client.get('/api/v1/productos/exportar/rendimiento/', **self.headers)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -742,6 +938,7 @@ class ReordenTest(APITestCase):
             tipo='salida', creado_por=self.admin, sucursal=self.sucursal, aprobado=True,
         )
         MovimientoItem.objects.create(movimiento=mov, producto=producto, cantidad=cantidad)
+        ConsumoDiario.registrar(mov)
 
     def test_producto_bajo_minimo_aparece_con_sugerencia(self):
         # min_stock=10, disponibles=3 => bajo mínimo. Consumo 12 en 6 meses => 2/mes.
@@ -768,3 +965,1065 @@ class ReordenTest(APITestCase):
         response = self.client.get('/api/v1/productos/reorden/', **self.headers)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, [])
+
+
+class ReordenConsolidadoTest(APITestCase):
+    XLSX_CT = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin_reo_cons', password='pass')
+        PerfilUsuario.objects.create(usuario=self.admin, rol='admin')
+        self.norte = Sucursal.objects.create(nombre='Suc Norte')
+        self.sur = Sucursal.objects.create(nombre='Suc Sur')
+        ajena = Sucursal.objects.create(nombre='Suc Ajena')
+        self.admin.profile.sucursales.add(self.norte, self.sur)
+        self.client.force_login(self.admin)
+        self.headers = {'HTTP_X_BRANCH_ID': self.norte.id}
+
+        categoria = Categoría.objects.create(nombre='Cat Reo Cons')
+        proveedor = Proveedor.objects.create(nombre='Prov Reo Cons')
+        self.toner = Producto.objects.create(
+            codigo_interno='P-CONS-A', descripcion='Toner', categoria=categoria,
+            sku='SKU-CONS-A', min_stock=10, proveedor=proveedor,
+        )
+        self.tambor = Producto.objects.create(
+            codigo_interno='P-CONS-B', descripcion='Tambor', categoria=categoria,
+            sku='SKU-CONS-B', min_stock=1,
+        )
+        self._existencias(self.toner, self.norte, 3)
+        self._existencias(self.tambor, self.norte, 5)
+        self._existencias(self.tambor, self.sur, 5)
+        self._consumo(self.toner, self.norte, 12)  # 2/mes
+        self._consumo(self.toner, self.sur, 6)     # 1/mes, sin existencias
+        self._consumo(self.tambor, self.sur, 60)   # 10/mes: 15 días de cobertura con 5
+        self._consumo(self.tambor, self.sur, 6)
+        self._consumo(self.toner, ajena, 600)
+
+    def _existencias(self, producto, sucursal, cantidad):
+        lote = Lote.objects.create(
+            producto=producto, codigo_lote=f'L-{producto.codigo_interno}-{sucursal.pk}',
+            cantidad_inicial=cantidad, sucursal=sucursal,
+        )
+        Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(cantidad)])
+
+    def _consumo(self, producto, sucursal, cantidad):
+        mov = Movimiento.objects.create(tipo='salida', creado_por=self.admin, sucursal=sucursal, aprobado=True)
+        MovimientoItem.objects.create(movimiento=mov, producto=producto, cantidad=cantidad)
+        ConsumoDiario.registrar(mov)
+
+    def test_por_sucursal_y_consolidado(self):
+        response = self.client.get('/api/v1/productos/reorden/consolidado/', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        sucursales = response.data['sucursales']
+        self.assertEqual([s['sucursal_nombre'] for s in sucursales], ['Suc Norte', 'Suc Sur'])
+        # Cada sucursal coincide con /reorden/ de esa sucursal.
+        for sucursal in sucursales:
+            self.assertEqual(sucursal['proveedores'], reorden_data(sucursal['sucursal_id']))
+
+        sur = {p['codigo_interno']: p for g in sucursales[1]['proveedores'] for p in g['productos']}
+        self.assertEqual(sur['P-CONS-A']['cantidad_sugerida'], 2)
+        self.assertEqual(sur['P-CONS-A']['dias_cobertura'], 0.0)
+        self.assertEqual(sur['P-CONS-B']['dias_cobertura'], 13.6)
+        self.assertEqual(sur['P-CONS-B']['cantidad_sugerida'], 17)
+
+        consolidado = {
+            g['proveedor_nombre']: {p['codigo_interno']: p for p in g['productos']}
+            for g in response.data['consolidado']
+        }
+        toner = consolidado['Prov Reo Cons']['P-CONS-A']
+        self.assertEqual(toner['sucursales'], 2)
+        self.assertEqual(toner['cantidad_disponible'], 3)
+        self.assertEqual(toner['consumo_mensual'], 3.0)
+        self.assertEqual(toner['cantidad_sugerida'], 1 + 2)
+        tambor = consolidado['Sin proveedor']['P-CONS-B']
+        self.assertEqual((tambor['sucursales'], tambor['cantidad_disponible'], tambor['cantidad_sugerida']), (1, 10, 17))
+
+    def test_exportar_consolidado(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+
+        response = self.client.get('/api/v1/productos/exportar/reorden/consolidado/', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], self.XLSX_CT)
+        wb = load_workbook(BytesIO(response.getvalue()))
+        self.assertEqual(wb.sheetnames, ['Consolidado', 'Por sucursal'])
+        self.assertEqual(wb['Consolidado'].max_row, 3)
+        self.assertEqual(wb['Por sucursal'].max_row, 4)
+
+        # CSV: solo la tabla por sucursal.
+        response = self.client.get('/api/v1/productos/exportar/reorden/consolidado/?formato=csv', **self.headers)
+        lineas = response.getvalue().decode().splitlines()
+        self.assertEqual(lineas[0].split(',')[:3], ['sucursal', 'proveedor', 'codigo_interno'])
+        self.assertEqual(len(lineas), 4)
+
+
+class ContadorLoteTest(APITestCase):
+    def setUp(self):
+        self.sucursal = Sucursal.objects.create(nombre='Suc Contador')
+        categoria = Categoría.objects.create(nombre='Cat Contador')
+        self.producto = Producto.objects.create(
+            codigo_interno='P-CNT', descripcion='Contador',
+            categoria=categoria, unidad_medida='pieza',
+            sku='SKU-CNT', min_stock=1,
+        )
+        self.lote = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-CNT',
+            cantidad_inicial=4, sucursal=self.sucursal,
+        )
+
+    def test_unidades_actualizan_contador(self):
+        Unidad.objects.bulk_create([Unidad(lote=self.lote) for _ in range(3)])
+        unidad = Unidad.objects.create(lote=self.lote)
+        self.lote.refresh_from_db()
+        self.assertEqual(self.lote.cantidad_restante, 4)
+
+        unidad = Unidad.objects.get(pk=unidad.pk)
+        unidad.status = 'retirada'
+        unidad.save()
+        self.lote.refresh_from_db()
+        self.assertEqual(self.lote.cantidad_restante, 3)
+
+    def test_productos_queryset_suma_contadores(self):
+        from productos.queries import productos_queryset
+
+        Unidad.objects.bulk_create([Unidad(lote=self.lote) for _ in range(4)])
+        producto = productos_queryset(self.sucursal.id).get(pk=self.producto.pk)
+        self.assertEqual(producto.cantidad_disponible, 4)
+
+    def test_recalcular_contadores(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        Unidad.objects.bulk_create([Unidad(lote=self.lote) for _ in range(4)])
+        Lote.objects.filter(pk=self.lote.pk).update(cantidad_restante=9)
+
+        with self.assertRaises(CommandError):
+            call_command('recalcular_contadores', '--verificar', stdout=StringIO())
+
+        call_command('recalcular_contadores', stdout=StringIO())
+        self.lote.refresh_from_db()
+        self.assertEqual(self.lote.cantidad_restante, 4)
+
+
+class StockSucursalTest(APITestCase):
+    def setUp(self):
+        self.sucursal = Sucursal.objects.create(nombre='Suc Stock')
+        self.otra = Sucursal.objects.create(nombre='Suc Stock 2')
+        categoria = Categoría.objects.create(nombre='Cat Stock')
+        self.producto = Producto.objects.create(
+            codigo_interno='P-STK', descripcion='Stock',
+            categoria=categoria, unidad_medida='pieza',
+            sku='SKU-STK', min_stock=1,
+        )
+
+    def _lote(self, codigo, sucursal, unidades, fecha=None):
+        lote = Lote.objects.create(
+            producto=self.producto, codigo_lote=codigo, cantidad_inicial=unidades,
+            sucursal=sucursal, fecha_entrada=fecha or timezone.now(),
+        )
+        Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(unidades)])
+        return lote
+
+    def test_resumen_por_sucursal(self):
+        antiguo = timezone.now() - timezone.timedelta(days=400)
+        self._lote('L-STK-1', self.sucursal, 3, fecha=antiguo)
+        self._lote('L-STK-2', self.sucursal, 2)
+        self._lote('L-STK-3', self.otra, 5)
+
+        stock = StockSucursal.objects.get(producto=self.producto, sucursal=self.sucursal)
+        self.assertEqual(stock.cantidad_disponible, 5)
+        self.assertEqual(stock.lotes_abiertos, 2)
+        self.assertEqual(stock.lote_mas_antiguo, antiguo)
+
+    def test_lote_agotado_sale_del_resumen(self):
+        antiguo = timezone.now() - timezone.timedelta(days=400)
+        lote = self._lote('L-STK-4', self.sucursal, 1, fecha=antiguo)
+        reciente = self._lote('L-STK-5', self.sucursal, 1)
+
+        unidad = lote.unidades.get()
+        unidad.status = 'retirada'
+        unidad.save()
+
+        stock = StockSucursal.objects.get(producto=self.producto, sucursal=self.sucursal)
+        self.assertEqual(stock.cantidad_disponible, 1)
+        self.assertEqual(stock.lotes_abiertos, 1)
+        self.assertEqual(stock.lote_mas_antiguo, reciente.fecha_entrada)
+
+    def test_mover_unidad_de_lote(self):
+        origen = self._lote('L-STK-8', self.sucursal, 2)
+        destino = self._lote('L-STK-9', self.otra, 1)
+
+        def restantes():
+            return (
+                Lote.objects.get(pk=origen.pk).cantidad_restante,
+                Lote.objects.get(pk=destino.pk).cantidad_restante,
+                dict(StockSucursal.objects.filter(producto=self.producto)
+                     .values_list('sucursal_id', 'cantidad_disponible')),
+            )
+
+        unidad = origen.unidades.first()
+        unidad.lote = destino
+        unidad.save()
+        self.assertEqual(restantes(), (1, 2, {self.sucursal.pk: 1, self.otra.pk: 2}))
+
+        # Cambiar de lote y de status a la vez: solo se descuenta del lote anterior.
+        unidad = Unidad.objects.get(pk=unidad.pk)
+        unidad.lote, unidad.status = origen, 'retirada'
+        unidad.save()
+        self.assertEqual(restantes(), (1, 1, {self.sucursal.pk: 1, self.otra.pk: 1}))
+
+        # Borrar descuenta del lote guardado, no del asignado sin guardar.
+        disponible = origen.unidades.get(status='disponible')
+        disponible.lote = destino
+        disponible.delete()
+        self.assertEqual(restantes(), (0, 1, {self.sucursal.pk: 0, self.otra.pk: 1}))
+
+    def test_bulk_create_recalcula_una_vez(self):
+        a = Lote.objects.create(producto=self.producto, codigo_lote='L-STK-6', cantidad_inicial=2, sucursal=self.sucursal)
+        b = Lote.objects.create(producto=self.producto, codigo_lote='L-STK-7', cantidad_inicial=3, sucursal=self.otra)
+
+        with patch.object(StockSucursal, 'recalcular', wraps=StockSucursal.recalcular) as recalcular:
+            Unidad.objects.bulk_create([Unidad(lote=a), Unidad(lote=a), Unidad(lote=b), Unidad(lote=b), Unidad(lote=b)])
+
+        self.assertEqual(recalcular.call_count, 1)
+        self.assertEqual(
+            dict(StockSucursal.objects.filter(producto=self.producto).values_list('sucursal_id', 'cantidad_disponible')),
+            {self.sucursal.pk: 2, self.otra.pk: 3},
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SQLite serializa las escrituras.')
+class StockSucursalConcurrenteTest(TransactionTestCase):
+    serialized_rollback = True
+
+    def test_dos_lotes_del_mismo_par_en_paralelo(self):
+        sucursal = Sucursal.objects.create(nombre='Suc Concurrente')
+        categoria = Categoría.objects.create(nombre='Cat Concurrente')
+        producto = Producto.objects.create(
+            codigo_interno='P-CONC', descripcion='Concurrente', categoria=categoria, sku='SKU-CONC', min_stock=0,
+        )
+        a, b = (
+            Lote.objects.create(
+                producto=producto, codigo_lote=codigo, cantidad_inicial=10, cantidad_restante=10, sucursal=sucursal,
+            )
+            for codigo in ('L-CONC-1', 'L-CONC-2')
+        )
+        primero_sin_confirmar = threading.Event()
+
+        def primero():
+            try:
+                with transaction.atomic():
+                    Lote.descontar({a.pk: 3})
+                    primero_sin_confirmar.set()
+                    time.sleep(0.5)  # el segundo recalcula mientras este no ha confirmado
+            finally:
+                connection.close()
+
+        def segundo():
+            primero_sin_confirmar.wait()
+            try:
+                with transaction.atomic():
+                    Lote.descontar({b.pk: 4})
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=primero), threading.Thread(target=segundo)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(StockSucursal.objects.get(producto=producto, sucursal=sucursal).cantidad_disponible, 13)
+
+
+class LoteCompactoTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='compacto', password='pass')
+        self.sucursal = Sucursal.objects.create(nombre='Suc Compacto')
+        PerfilUsuario.objects.create(usuario=self.user, rol='admin')
+        self.user.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.user)
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id}
+
+        categoria = Categoría.objects.create(nombre='Cat Compacto')
+        self.producto = Producto.objects.create(
+            codigo_interno='P-CMP', descripcion='Compacto',
+            categoria=categoria, unidad_medida='pieza',
+            sku='SKU-CMP', min_stock=1,
+        )
+        self.lote = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-CMP', cantidad_inicial=5,
+            cantidad_restante=5, modo_unidades='rango', sucursal=self.sucursal,
+        )
+
+    def test_tramos_libres(self):
+        from .unidades import tramos_libres, tomar_series
+
+        libres = list(tramos_libres(10, [(1, 2), (5, 5)]))
+        self.assertEqual(libres, [(3, 4), (6, 10)])
+        self.assertEqual(tomar_series(libres, 3), [(3, 4), (6, 6)])
+        self.assertIsNone(tomar_series(libres, 8))
+
+    def test_list_incluye_unidades_derivadas(self):
+        with transaction.atomic():
+            Lote.objects.select_for_update().get(pk=self.lote.pk).retirar_series(2)
+
+        response = self.client.get(reverse('unidad-list'), {'lote': self.lote.pk}, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['results'][0]['codigo_unidad'], 'L-CMP-000001')
+        self.assertEqual([u['status'] for u in response.data['results']].count('retirada'), 2)
+
+        response = self.client.get(
+            reverse('unidad-list'), {'lote': self.lote.pk, 'status': 'disponible'}, **self.headers
+        )
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_pagina_profunda_sin_recorrer_series_previas(self):
+        grande = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-CMP-GRANDE', cantidad_inicial=1_000_000,
+            cantidad_restante=1_000_000, modo_unidades='rango', sucursal=self.sucursal,
+        )
+        with transaction.atomic():
+            Lote.objects.select_for_update().get(pk=grande.pk).retirar_series(999_990)
+        params = {'lote': grande.pk, 'limite': 5}
+
+        with patch.object(Lote, 'codigo_unidad', autospec=True, side_effect=Lote.codigo_unidad) as generadas:
+            cursor = PaginacionKeyset.codificar_cursor([grande.pk, 999_000])
+            response = self.client.get(reverse('unidad-list'), {**params, 'cursor': cursor}, **self.headers)
+            self.assertEqual(
+                [u['codigo_unidad'] for u in response.data['results']], [f'L-CMP-GRANDE-{s}' for s in range(999_001, 999_006)]
+            )
+            self.assertLessEqual(generadas.call_count, 6)
+
+            generadas.reset_mock()
+            response = self.client.get(reverse('unidad-list'), {**params, 'status': 'disponible'}, **self.headers)
+            self.assertEqual(response.data['results'][0]['codigo_unidad'], 'L-CMP-GRANDE-999991')
+            self.assertEqual(len(response.data['results']), 5)
+            self.assertLessEqual(generadas.call_count, 6)
+
+    def test_retrieve_por_codigo(self):
+        url = reverse('unidad-detail', kwargs={'pk': 'L-CMP-000004'})
+        response = self.client.get(url, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'disponible')
+
+        url = reverse('unidad-detail', kwargs={'pk': 'L-CMP-000009'})
+        response = self.client.get(url, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_rechaza_lote_compacto(self):
+        response = self.client.post(reverse('unidad-list'), {'lote': self.lote.pk}, format='json', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Los planes se verifican contra PostgreSQL.')
+class PlanesConsultaTest(APITestCase):
+    """Cada consulta caliente debe usar un índice en lugar de recorrer la tabla completa.
+
+    Se desactiva enable_seqscan para que el planificador elija un índice siempre
+    que exista uno aplicable; un Seq Scan (o un recorrido completo de la llave
+    primaria) significa que falta el índice.
+    """
+    OPCIONES_PLANIFICADOR = ('enable_seqscan', 'enable_mergejoin', 'enable_hashjoin')
+    # Catálogos globales que se leen completos por diseño. Producto no: las
+    # listas de productos activos deben usar producto_activo_codigo_idx.
+    TABLAS_COMPLETAS = {
+        'productos_categoría', 'productos_marca', 'productos_proveedor', 'productos_equipo',
+        'organizacion_sucursal', 'system_configuracionsistema',
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        # Las filas que revirtieron las pruebas anteriores siguen ocupando páginas
+        # de tablas e índices y cambian los costos: se compactan antes de abrir la
+        # transacción para que el plan no dependa de qué pruebas corrieron antes.
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM FULL')
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        # La sucursal por defecto (pk=1) la crea la migración 0021.
+        cls.sucursal = Sucursal.objects.get(pk=1)
+        cls.admin = User.objects.create_user(username='admin_planes', password='pass')
+        PerfilUsuario.objects.create(usuario=cls.admin, rol='admin')
+        cls.admin.profile.sucursales.add(cls.sucursal)
+
+        categoria = Categoría.objects.create(nombre='Cat Planes')
+        proveedor = Proveedor.objects.create(nombre='Prov Planes')
+        equipo = Equipo.objects.create(nombre='EQ-Planes', marca=Marca.objects.create(nombre='Marca Planes'))
+        cliente = Cliente.objects.create(nombre='Cli Planes', sucursal=cls.sucursal)
+        equipo_cliente = EquipoCliente.objects.create(
+            equipo=equipo, cliente=cliente, alias='Planes', contador_uso=500,
+        )
+
+        for i in range(30):
+            producto = Producto.objects.create(
+                codigo_interno=f'P-PLN-{i}', descripcion=f'Planes {i}', categoria=categoria,
+                sku=f'SKU-PLN-{i}', min_stock=5, proveedor=proveedor,
+            )
+            producto.equipos.add(equipo)
+            lote = Lote.objects.create(
+                producto=producto, codigo_lote=f'L-PLN-{i}', cantidad_inicial=4, sucursal=cls.sucursal,
+            )
+            Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(4)])
+
+            mov = Movimiento.objects.create(
+                tipo='salida', creado_por=cls.admin, sucursal=cls.sucursal, aprobado=True,
+            )
+            DetalleSalida.objects.create(movimiento=mov, cliente=cliente, subtipo='renta')
+            item = MovimientoItem.objects.create(
+                movimiento=mov, producto=producto, cantidad=1, lote=lote,
+                equipo_cliente=equipo_cliente, contador_uso_snapshot=i * 10,
+            )
+            ConsumoDiario.registrar(mov)
+            RendimientoEquipo.registrar(item)
+            AlertaInventario.objects.create(
+                producto=producto, tipo_alerta='low_stock', mensaje='-', sucursal=cls.sucursal,
+            )
+            RegistroActividad.objects.create(
+                usuario=cls.admin, accion='create', descripcion='-', sucursal=cls.sucursal,
+            )
+        # El catálogo real acumula productos dados de baja: con ellos recorrer la
+        # tabla completa cuesta más que el índice parcial de activos.
+        Producto.objects.bulk_create([
+            Producto(
+                codigo_interno=f'P-PLN-BAJA-{i}', descripcion='Baja', categoria=categoria,
+                sku=f'SKU-PLN-BAJA-{i}', min_stock=0, status='inactivo',
+            )
+            for i in range(300)
+        ])
+        # Estadísticas de estos datos y no de lo que dejaron las pruebas
+        # anteriores: los planes no dependen del orden en que corren.
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        # Se pide JSON: el formulario del API navegable lista tablas completas.
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id, 'HTTP_ACCEPT': 'application/json'}
+
+    def _escaneos_completos(self, nodo):
+        tabla = nodo.get('Relation Name')
+        tipo = nodo['Node Type']
+        completos = []
+        if tabla and tabla not in self.TABLAS_COMPLETAS:
+            if tipo == 'Seq Scan':
+                completos.append(f'Seq Scan on {tabla}')
+            elif tipo in ('Index Scan', 'Index Only Scan') and 'Index Cond' not in nodo \
+                    and nodo.get('Index Name', '').endswith('_pkey'):
+                completos.append(f'{tipo} sin condición on {tabla}')
+        for hijo in nodo.get('Plans', []):
+            completos.extend(self._escaneos_completos(hijo))
+        return completos
+
+    def _indices(self, nodo):
+        return {nodo.get('Index Name')} - {None} | {i for hijo in nodo.get('Plans', []) for i in self._indices(hijo)}
+
+    def _assert_sin_escaneos_completos(self, funcion):
+        """Falla si algún SELECT de funcion() recorre una tabla completa; devuelve los planes."""
+        with CaptureQueriesContext(connection) as ctx:
+            funcion()
+
+        # Los .iterator() (exportaciones) llegan como DECLARE ... CURSOR FOR SELECT.
+        consultas = [re.sub(r'^DECLARE .+? CURSOR (WITH(OUT)? HOLD )?FOR ', '', q['sql']) for q in ctx.captured_queries]
+        consultas = [sql for sql in consultas if sql.lstrip().upper().startswith('SELECT')]
+        self.assertTrue(consultas)
+        planes = []
+        with connection.cursor() as cursor:
+            # Sin merge/hash join el planificador resuelve cada JOIN por índice,
+            # así que un recorrido completo solo queda donde falta un índice.
+            for opcion in self.OPCIONES_PLANIFICADOR:
+                cursor.execute(f'SET {opcion} = off')
+            try:
+                for sql in consultas:
+                    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                    plan = cursor.fetchone()[0][0]['Plan']
+                    completos = self._escaneos_completos(plan)
+                    self.assertEqual(completos, [], f'{completos}\n{sql}')
+                    planes.append(plan)
+            finally:
+                for opcion in self.OPCIONES_PLANIFICADOR:
+                    cursor.execute(f'RESET {opcion}')
+        return planes
+
+    def test_productos_activos_por_indice_parcial(self):
+        def lista():
+            self.assertEqual(self.client.get(reverse('producto-list'), **self.headers).status_code, status.HTTP_200_OK)
+
+        def exportacion():
+            response = self.client.get('/api/v1/productos/exportar/existencias/?formato=csv', **self.headers)
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 31)
+
+        from .queries import productos_queryset
+
+        for nombre, funcion in (
+            ('productos_queryset', lambda: list(productos_queryset(self.sucursal.id))),
+            ('ProductoViewSet', lista),
+            ('exportar existencias', exportacion),
+        ):
+            with self.subTest(nombre):
+                planes = self._assert_sin_escaneos_completos(funcion)
+                indices = set().union(*(self._indices(plan) for plan in planes))
+                self.assertIn('producto_activo_codigo_idx', indices)
+
+    def test_queries_productos(self):
+        from .queries import lotes_queryset, productos_queryset, rendimiento_data, reorden_data
+
+        self._assert_sin_escaneos_completos(lambda: list(productos_queryset(self.sucursal.id)))
+        self._assert_sin_escaneos_completos(lambda: list(lotes_queryset(self.sucursal.id)))
+        self._assert_sin_escaneos_completos(lambda: rendimiento_data(self.sucursal.id))
+        self._assert_sin_escaneos_completos(
+            lambda: rendimiento_data(self.sucursal.id, fecha_inicio=timezone.localdate(), por_cantidad=True)
+        )
+        self._assert_sin_escaneos_completos(lambda: reorden_data(self.sucursal.id))
+
+    def test_alertas(self):
+        from system.alertas import (
+            generar_high_rotation, generar_low_stock, generar_old_product, generar_unusual_movement,
+        )
+
+        for generar in (generar_low_stock, generar_old_product, generar_unusual_movement, generar_high_rotation):
+            self._assert_sin_escaneos_completos(lambda: generar(self.sucursal.id))
+
+    def test_viewsets(self):
+        urls = [
+            reverse('producto-list'),
+            reverse('lote-list'),
+            reverse('unidad-list'),
+            reverse('movimientos-list'),
+            reverse('alertas-list'),
+            reverse('actividades-list'),
+            reverse('cliente-list'),
+            '/api/v1/productos/dashboard/',
+        ]
+        urls += [f'{url}?limite=10' for url in urls[:6]]
+        for url in urls:
+            self._assert_sin_escaneos_completos(
+                lambda: self.assertEqual(self.client.get(url, **self.headers).status_code, status.HTTP_200_OK)
+            )
+
+
+class PaginacionKeysetTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='paginas', password='pass')
+        self.sucursal = Sucursal.objects.create(nombre='Suc Paginas')
+        PerfilUsuario.objects.create(usuario=self.user, rol='admin')
+        self.user.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.user)
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id}
+
+        categoria = Categoría.objects.create(nombre='Cat Paginas')
+        for i in range(7):
+            Producto.objects.create(
+                codigo_interno=f'P-PAG-{i}', descripcion='Paginas', categoria=categoria,
+                sku=f'SKU-PAG-{i}', min_stock=1,
+            )
+        self.producto = Producto.objects.get(codigo_interno='P-PAG-0')
+
+    def _recorrer(self, url, params):
+        vistos, paginas = [], 0
+        response = self.client.get(url, params, **self.headers)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            vistos.extend(response.data['results'])
+            paginas += 1
+            if not response.data['hay_mas']:
+                self.assertIsNone(response.data['siguiente'])
+                return vistos, paginas
+            response = self.client.get(response.data['siguiente'], **self.headers)
+
+    def test_sin_parametros_lista_completa(self):
+        response = self.client.get(reverse('producto-list'), **self.headers)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+    def test_sin_parametros_acotada(self):
+        with patch.object(PaginacionKeyset, 'maximo_sin_paginar', 6):
+            response = self.client.get(reverse('producto-list'), **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('limite', response.data)
+
+        with patch.object(PaginacionKeyset, 'maximo_sin_paginar', 7):
+            response = self.client.get(reverse('producto-list'), **self.headers)
+        self.assertEqual(len(response.data), 7)
+
+    def test_unidades_siempre_paginadas(self):
+        lote = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-PAG-DEF', cantidad_inicial=60,
+            cantidad_restante=60, modo_unidades='rango', sucursal=self.sucursal,
+        )
+        response = self.client.get(reverse('unidad-list'), **self.headers)
+        self.assertEqual(len(response.data['results']), PaginacionKeyset.limite_default)
+        self.assertTrue(response.data['hay_mas'])
+        self.assertEqual(response.data['results'][0]['codigo_unidad'], lote.codigo_unidad(1))
+
+    def test_productos_por_codigo(self):
+        vistos, paginas = self._recorrer(reverse('producto-list'), {'limite': 3})
+        self.assertEqual(paginas, 3)
+        self.assertEqual([p['codigo_interno'] for p in vistos], [f'P-PAG-{i}' for i in range(7)])
+
+    def test_lotes_mismo_creado_desempata_por_id(self):
+        creado = timezone.now()
+        lotes = [
+            Lote.objects.create(
+                producto=self.producto, codigo_lote=f'L-PAG-{i}', cantidad_inicial=1,
+                sucursal=self.sucursal, creado=creado,
+            )
+            for i in range(5)
+        ]
+        vistos, _ = self._recorrer(reverse('lote-list'), {'limite': 2})
+        self.assertEqual([l['id'] for l in vistos], [l.pk for l in reversed(lotes)])
+
+    def test_unidades_mezcla_filas_y_lotes_compactos(self):
+        individual = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-PAG-IND', cantidad_inicial=3, sucursal=self.sucursal,
+        )
+        Unidad.objects.bulk_create([Unidad(lote=individual) for _ in range(3)])
+        compacto = Lote.objects.create(
+            producto=self.producto, codigo_lote='L-PAG-CMP', cantidad_inicial=4,
+            cantidad_restante=4, modo_unidades='rango', sucursal=self.sucursal,
+        )
+
+        vistos, paginas = self._recorrer(reverse('unidad-list'), {'limite': 2})
+        self.assertEqual(paginas, 4)
+        self.assertEqual([u['lote'] for u in vistos], [individual.pk] * 3 + [compacto.pk] * 4)
+        self.assertEqual(
+            [u['codigo_unidad'] for u in vistos[3:]], [compacto.codigo_unidad(s) for s in range(1, 5)]
+        )
+
+    def test_cursor_invalido(self):
+        response = self.client.get(reverse('producto-list'), {'cursor': 'no-es-un-cursor'}, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_alterado(self):
+        cursores = [
+            base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+            for valores in (5, None, {'a': 1}, [], [1], ['a', 'b'], [[1], {}], [1, 2, 3])
+        ] + [base64.urlsafe_b64encode(b'\xff\xfe').decode()]
+        for nombre in ('producto-list', 'lote-list', 'unidad-list'):
+            for cursor in cursores:
+                with self.subTest(vista=nombre, cursor=cursor):
+                    response = self.client.get(reverse(nombre), {'cursor': cursor, 'limite': 2}, **self.headers)
+                    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CamposDinamicosTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='campos', password='pass')
+        self.sucursal = Sucursal.objects.create(nombre='Suc Campos')
+        PerfilUsuario.objects.create(usuario=self.user, rol='admin')
+        self.user.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.user)
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id, 'HTTP_ACCEPT': 'application/json'}
+
+        self.categoria = Categoría.objects.create(nombre='Cat Campos')
+        self.equipo = Equipo.objects.create(nombre='EQ-Campos', marca=Marca.objects.create(nombre='Marca Campos'))
+        for i in range(3):
+            producto = Producto.objects.create(
+                codigo_interno=f'P-CAM-{i}', descripcion='Campos', categoria=self.categoria,
+                sku=f'SKU-CAM-{i}', min_stock=1,
+            )
+            producto.equipos.add(self.equipo)
+            Lote.objects.create(
+                producto=producto, codigo_lote=f'L-CAM-{i}', cantidad_inicial=2,
+                cantidad_restante=2, modo_unidades='rango', sucursal=self.sucursal,
+            )
+
+    def test_fields_recorta_respuesta_y_consulta(self):
+        params = {'fields': 'id,codigo_interno,descripcion,cantidad_disponible'}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('producto-list'), params, **self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data[0]), {'id', 'codigo_interno', 'descripcion', 'cantidad_disponible'})
+        self.assertEqual(response.data[0]['cantidad_disponible'], 2)
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('productos_categor', sql)
+        self.assertNotIn('productos_producto_equipos', ' '.join(q['sql'] for q in ctx.captured_queries))
+
+    def test_expand_devuelve_ids_de_relaciones_no_expandidas(self):
+        response = self.client.get(reverse('producto-list'), {'expand': 'categoria'}, **self.headers)
+        producto = response.data[0]
+        self.assertEqual(producto['categoria']['nombre'], 'Cat Campos')
+        self.assertEqual(producto['equipos'], [self.equipo.pk])
+        self.assertIsNone(producto['proveedor'])
+
+    def test_sin_parametros_no_cambia(self):
+        response = self.client.get(reverse('producto-list'), **self.headers)
+        self.assertEqual(response.data[0]['equipos'][0]['marca']['nombre'], 'Marca Campos')
+        self.assertIn('sku', response.data[0])
+
+    def test_lotes_sin_expandir_producto(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                reverse('lote-list'), {'fields': 'id,codigo_lote,producto,cantidad_restante', 'expand': ''},
+                **self.headers,
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data[0]), {'id', 'codigo_lote', 'producto', 'cantidad_restante'})
+        self.assertIsInstance(response.data[0]['producto'], int)
+        self.assertNotIn('productos_producto_equipos', ' '.join(q['sql'] for q in ctx.captured_queries))
+
+    def test_fields_con_paginacion(self):
+        response = self.client.get(
+            reverse('producto-list'), {'fields': 'id', 'limite': 2}, **self.headers
+        )
+        self.assertEqual(response.data['results'], [{'id': p.pk} for p in Producto.objects.order_by('codigo_interno')[:2]])
+        response = self.client.get(response.data['siguiente'], **self.headers)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class ListadoRapidoTest(APITestCase):
+    """El listado desde .values() debe dar el mismo JSON que el serializer."""
+    def setUp(self):
+        self.user = User.objects.create_user(username='rapido', password='pass')
+        self.sucursal = Sucursal.objects.create(nombre='Suc Rapido')
+        PerfilUsuario.objects.create(usuario=self.user, rol='admin')
+        self.user.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.user)
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id, 'HTTP_ACCEPT': 'application/json'}
+
+        categoria = Categoría.objects.create(nombre='Cat Rapido', descripcion='desc')
+        proveedor = Proveedor.objects.create(nombre='Prov Rapido', telefono='555')
+        marca = Marca.objects.create(nombre='Marca Rapido')
+        equipo_b = Equipo.objects.create(nombre='B-Rapido', marca=marca)
+        equipo_a = Equipo.objects.create(nombre='A-Rapido', marca=marca)
+        inactivo = Equipo.objects.create(nombre='C-Rapido', marca=marca, activo=False)
+
+        con_todo = Producto.objects.create(
+            codigo_interno='P-RAP-1', descripcion='Con todo', categoria=categoria,
+            sku='SKU-RAP-1', min_stock=2, proveedor=proveedor,
+        )
+        con_todo.equipos.add(equipo_b, equipo_a, inactivo)
+        Producto.objects.create(
+            codigo_interno='P-RAP-2', descripcion='Sin relaciones', categoria=categoria,
+            sku='SKU-RAP-2', min_stock=2,
+        )
+        Lote.objects.create(
+            producto=con_todo, codigo_lote='L-RAP-1', cantidad_inicial=4,
+            cantidad_restante=4, modo_unidades='rango', sucursal=self.sucursal,
+        )
+
+    def _comparar(self, url, params=None):
+        with CaptureQueriesContext(connection) as rapido_ctx:
+            rapido = self.client.get(url, params, **self.headers)
+        with patch.object(ProductoViewSet, 'listado_rapido', None), \
+                patch.object(LoteViewSet, 'listado_rapido', None):
+            lento = self.client.get(url, params, **self.headers)
+        self.assertEqual(rapido.status_code, status.HTTP_200_OK)
+        self.assertEqual(rapido.content, lento.content)
+        return rapido, rapido_ctx
+
+    def test_productos_mismo_json(self):
+        response, _ = self._comparar(reverse('producto-list'))
+        productos = {p['codigo_interno']: p for p in response.json()}
+        self.assertEqual([e['nombre'] for e in productos['P-RAP-1']['equipos']], ['A-Rapido', 'B-Rapido'])
+        self.assertIsNone(productos['P-RAP-2']['proveedor'])
+
+    def test_lotes_mismo_json(self):
+        self._comparar(reverse('lote-list'))
+
+    def test_paginado_mismo_json(self):
+        self._comparar(reverse('producto-list'), {'limite': 1})
+
+    def test_consultas_constantes(self):
+        _, ctx = self._comparar(reverse('producto-list'))
+        consultas = len(ctx)
+        for i in range(3, 8):
+            Producto.objects.create(
+                codigo_interno=f'P-RAP-{i}', descripcion='Extra',
+                categoria=Categoría.objects.first(), sku=f'SKU-RAP-{i}', min_stock=1,
+            ).equipos.add(*Equipo.objects.all())
+        _, ctx = self._comparar(reverse('producto-list'))
+        self.assertEqual(len(ctx), consultas)
+
+
+class GetCondicionalTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='condicional', password='pass')
+        self.sucursal = Sucursal.objects.create(nombre='Suc Condicional')
+        PerfilUsuario.objects.create(usuario=self.user, rol='admin')
+        self.user.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.user)
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id, 'HTTP_ACCEPT': 'application/json'}
+
+        self.categoria = Categoría.objects.create(nombre='Cat Condicional')
+        self.equipo = Equipo.objects.create(nombre='EQ-Cond', marca=Marca.objects.create(nombre='Marca Cond'))
+        self.producto = Producto.objects.create(
+            codigo_interno='P-COND', descripcion='Condicional', categoria=self.categoria,
+            sku='SKU-COND', min_stock=1,
+        )
+
+    def _get(self, url, etag=None):
+        headers = dict(self.headers)
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.get(url, **headers)
+
+    def test_304_con_etag_vigente(self):
+        url = reverse('producto-list')
+        response = self._get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._get(url, response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        # Sin armar el listado: no se consulta la tabla de equipos por producto.
+        self.assertFalse(any('productos_producto_equipos' in q['sql'] for q in ctx.captured_queries))
+
+    def test_cambios_invalidan_etag(self):
+        url = reverse('producto-list')
+        cambios = [
+            lambda: self.producto.save(),
+            lambda: self.producto.equipos.add(self.equipo),
+            lambda: self.categoria.save(),
+            lambda: Lote.objects.create(
+                producto=self.producto, codigo_lote='L-COND', cantidad_inicial=2,
+                cantidad_restante=2, modo_unidades='rango', sucursal=self.sucursal,
+            ),
+            lambda: Producto.objects.create(
+                codigo_interno='P-COND-2', descripcion='Otro', categoria=self.categoria,
+                sku='SKU-COND-2', min_stock=1,
+            ),
+        ]
+        etag = self._get(url)['ETag']
+        for cambio in cambios:
+            cambio()
+            response = self._get(url, etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response['ETag']
+
+    def test_etag_por_sucursal(self):
+        otra = Sucursal.objects.create(nombre='Suc Condicional 2')
+        self.user.profile.sucursales.add(otra)
+        url = reverse('categoría-list')
+        etag = self._get(url)['ETag']
+        response = self.client.get(url, HTTP_X_BRANCH_ID=otra.id, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_catalogos_y_lotes(self):
+        for nombre in ('categoría-list', 'marca-list', 'equipo-list', 'proveedor-list', 'lote-list'):
+            url = reverse(nombre)
+            etag = self._get(url)['ETag']
+            self.assertEqual(self._get(url, etag).status_code, status.HTTP_304_NOT_MODIFIED, nombre)
+
+        etag = self._get(reverse('equipo-list'))['ETag']
+        # La versión del catálogo cambia con save() (señal), no con queryset.update().
+        marca = self.equipo.marca
+        marca.activo = False
+        marca.save()
+        self.assertEqual(self._get(reverse('equipo-list'), etag).status_code, status.HTTP_200_OK)
+
+
+class CatalogosCacheTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='catalogos', password='pass')
+        self.sucursal = Sucursal.objects.create(nombre='Suc Catálogos')
+        PerfilUsuario.objects.create(usuario=self.user, rol='admin')
+        self.user.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.user)
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id, 'HTTP_ACCEPT': 'application/json'}
+
+        self.categoria = Categoría.objects.create(nombre='Cat Caché')
+        self.proveedor = Proveedor.objects.create(nombre='Prov Caché')
+        marca = Marca.objects.create(nombre='Marca Caché')
+        self.equipos = [Equipo.objects.create(nombre=f'EQ-CACHE-{i}', marca=marca) for i in range(3)]
+
+    @staticmethod
+    def _consultas_a(ctx, tabla):
+        return [q['sql'] for q in ctx.captured_queries if f'FROM "{tabla}"' in q['sql']]
+
+    def test_listado_desde_cache_compartida(self):
+        url = reverse('categoría-list')
+        esperado = self.client.get(url, **self.headers).data
+
+        # Otro worker: sin la copia del proceso, pero con la caché compartida.
+        catalogos._locales.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, **self.headers)
+        self.assertEqual(response.data, esperado)
+        self.assertEqual(self._consultas_a(ctx, 'productos_categoría'), [])
+
+    def test_guardar_y_borrar_invalidan(self):
+        url = reverse('proveedor-list')
+        self.assertEqual([p['nombre'] for p in self.client.get(url, **self.headers).data], ['Prov Caché'])
+
+        nuevo = Proveedor.objects.create(nombre='Prov Nuevo')
+        self.assertEqual(len(self.client.get(url, **self.headers).data), 2)
+
+        nuevo.activo = False
+        nuevo.save()
+        self.assertEqual(len(self.client.get(url, **self.headers).data), 1)
+
+        self.proveedor.delete()
+        self.assertEqual(self.client.get(url, **self.headers).data, [])
+
+    def test_cambio_de_marca_invalida_equipos(self):
+        url = reverse('equipo-list')
+        self.assertEqual(len(self.client.get(url, **self.headers).data), 3)
+        marca = self.equipos[0].marca
+        marca.nombre = 'Marca Renombrada'
+        marca.save()
+        self.assertEqual(self.client.get(url, **self.headers).data[0]['marca']['nombre'], 'Marca Renombrada')
+
+    def test_alta_de_producto_sin_consultar_catalogos(self):
+        datos = {
+            'codigo_interno': 'P-CACHE', 'descripcion': 'Caché', 'sku': 'SKU-CACHE', 'min_stock': 1,
+            'categoria_id': self.categoria.pk, 'proveedor_id': self.proveedor.pk,
+            'equipos_id': [e.pk for e in self.equipos],
+        }
+        self.client.get(reverse('producto-list'), **self.headers)  # calienta la caché
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('producto-list'), datos, format='json', **self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data['categoria']['nombre'], 'Cat Caché')
+        self.assertEqual(len(response.data['equipos']), 3)
+        self.assertEqual(self._consultas_a(ctx, 'productos_categoría'), [])
+        self.assertEqual(self._consultas_a(ctx, 'productos_proveedor'), [])
+        # Los equipos se leen por producto (set() y respuesta), nunca uno por id.
+        self.assertEqual(self._consultas_a(ctx, 'productos_marca'), [])
+        self.assertFalse(any('WHERE "productos_equipo"."id"' in sql for sql in self._consultas_a(ctx, 'productos_equipo')))
+
+    def test_id_inexistente(self):
+        datos = {
+            'codigo_interno': 'P-CACHE-X', 'descripcion': 'Caché', 'sku': 'SKU-CACHE-X', 'min_stock': 1,
+            'categoria_id': self.categoria.pk, 'proveedor_id': None, 'equipos_id': [self.equipos[0].pk, 999999],
+        }
+        response = self.client.post(reverse('producto-list'), datos, format='json', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('equipos_id', response.data)
+
+        datos['equipos_id'] = ['x']
+        response = self.client.post(reverse('producto-list'), datos, format='json', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DashboardCacheTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='dashcache', password='pass')
+        self.sucursal = Sucursal.objects.create(nombre='Suc Dash Caché')
+        PerfilUsuario.objects.create(usuario=self.user, rol='admin')
+        self.user.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.user)
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id, 'HTTP_ACCEPT': 'application/json'}
+        self.url = '/api/v1/productos/dashboard/'
+
+        categoria = Categoría.objects.create(nombre='Cat Dash')
+        self.producto = Producto.objects.create(
+            codigo_interno='P-DASH', descripcion='Dash', categoria=categoria, sku='SKU-DASH', min_stock=5,
+        )
+
+    def _stats(self):
+        return self.client.get(self.url, **self.headers).data['stats']
+
+    def test_segunda_llamada_desde_cache(self):
+        primera = self.client.get(self.url, **self.headers).data
+        with CaptureQueriesContext(connection) as ctx:
+            segunda = self.client.get(self.url, **self.headers).data
+        self.assertEqual(segunda, primera)
+        self.assertFalse(any('productos_producto' in q['sql'] for q in ctx.captured_queries))
+
+    def test_cliente_y_aprobacion_invalidan(self):
+        self.assertEqual(self._stats()['clientes'], 0)
+        Cliente.objects.create(nombre='Cliente Dash', sucursal=self.sucursal)
+        self.assertEqual(self._stats()['clientes'], 1)
+
+        movimiento = Movimiento.objects.create(tipo='entrada', creado_por=self.user, sucursal=self.sucursal)
+        DetalleEntrada.objects.create(movimiento=movimiento, numero_factura='F-DASH', recibido_por=self.user)
+        MovimientoItem.objects.create(movimiento=movimiento, producto=self.producto, cantidad=2)
+        self.assertEqual(self._stats()['lotes'], 0)
+        with patch('movimiento.models.validar_factura_entrada'):
+            movimiento.approve(self.user)
+        self.assertEqual(self._stats()['lotes'], 1)
+
+    def test_otra_sucursal_no_se_invalida(self):
+        otra = Sucursal.objects.create(nombre='Suc Dash Otra')
+        self.user.profile.sucursales.add(otra)
+        self.client.get(self.url, HTTP_X_BRANCH_ID=otra.id)
+        Cliente.objects.create(nombre='Cliente Dash', sucursal=self.sucursal)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, HTTP_X_BRANCH_ID=otra.id, HTTP_ACCEPT='application/json')
+        self.assertFalse(any('organizacion_cliente' in q['sql'] for q in ctx.captured_queries))
+
+    def test_ventana_sirve_el_anterior_mientras_otro_recalcula(self):
+        self.assertEqual(self._stats()['productos'], 1)
+        Producto.objects.create(
+            codigo_interno='P-DASH-2', descripcion='Dash 2', categoria=self.producto.categoria,
+            sku='SKU-DASH-2', min_stock=1,
+        )
+        # Otro worker ya está recalculando: se responde el anterior.
+        cache.add(f'dashboard:{self.sucursal.id}:calculando', True, 30)
+        self.assertEqual(self._stats()['productos'], 1)
+        # Si el candado vence sin que el otro guarde nada, la siguiente petición recalcula.
+        cache.delete(f'dashboard:{self.sucursal.id}:calculando')
+        self.assertEqual(self._stats()['productos'], 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DashboardConcurrenteTest(SimpleTestCase):
+    """Ráfagas de peticiones simultáneas: un solo calcular() por sucursal."""
+
+    def setUp(self):
+        cache.clear()
+        self.calculos = []
+
+    def _calcular(self, sucursal_id):
+        self.calculos.append(sucursal_id)
+        time.sleep(0.3)  # las demás peticiones llegan mientras se calcula
+        return {'calculo': len(self.calculos)}
+
+    def _rafaga(self, peticiones=8):
+        respuestas = []
+        salida = threading.Barrier(peticiones)
+
+        def pedir():
+            salida.wait()
+            respuestas.append(dashboard.obtener(1))
+
+        with patch.object(dashboard, 'calcular', side_effect=self._calcular):
+            hilos = [threading.Thread(target=pedir) for _ in range(peticiones)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+        return respuestas
+
+    def test_cache_fria(self):
+        respuestas = self._rafaga()
+        self.assertEqual(len(self.calculos), 1)
+        # Sin copia anterior, las demás esperan el cálculo en curso.
+        self.assertEqual(respuestas, [{'calculo': 1}] * 8)
+
+    def test_cambio_de_dia(self):
+        with patch.object(dashboard, 'calcular', side_effect=self._calcular):
+            self.assertEqual(dashboard.obtener(1), {'calculo': 1})
+        # El payload es de ayer: el primer acceso del día lo encuentra viejo.
+        guardado = cache.get('dashboard:1')
+        guardado['dia'] -= timezone.timedelta(days=1)
+        cache.set('dashboard:1', guardado)
+
+        respuestas = self._rafaga()
+
+        self.assertEqual(len(self.calculos), 2)
+        # Solo una recalcula; las demás reciben el de ayer mientras tanto.
+        self.assertEqual(sorted(r['calculo'] for r in respuestas), [1] * 7 + [2])
+        self.assertEqual(dashboard.obtener(1), {'calculo': 2})
+        self.assertEqual(len(self.calculos), 2)
+
+    def test_fresco_vencido_hace_tiempo(self):
+        with patch.object(dashboard, 'calcular', side_effect=self._calcular):
+            dashboard.obtener(1)
+        guardado = cache.get('dashboard:1')
+        guardado['generado'] -= timezone.timedelta(seconds=dashboard.FRESCO + dashboard.VENTANA * 10)
+        cache.set('dashboard:1', guardado)
+
+        respuestas = self._rafaga()
+        self.assertEqual(len(self.calculos), 2)
+        self.assertEqual(sorted(r['calculo'] for r in respuestas), [1] * 7 + [2])
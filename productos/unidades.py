@@ -0,0 +1,87 @@
+"""Unidades de lotes en modo 'rango'.
+
+Un lote compacto no guarda una fila Unidad por pieza: sus unidades son las
+series 1..cantidad_inicial y solo se almacenan los tramos que ya no están
+disponibles (RangoUnidades). El código de cada unidad se deriva de la serie.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+
+SERIE_DIGITOS = 6
+
+
+@dataclass(frozen=True)
+class UnidadVirtual:
+    """Unidad derivada de un lote compacto; misma forma que UnidadSerializer.
+
+    No hay fila Unidad, así que id es None: el cliente la identifica por
+    codigo_unidad (GET /unidades/<codigo_unidad>/).
+    """
+    lote_id: int
+    serie: int
+    codigo_unidad: str
+    status: str
+    actualizado: datetime
+
+    def as_dict(self):
+        return {
+            'id': None,
+            'codigo_unidad': self.codigo_unidad,
+            'status': self.status,
+            'actualizado': self.actualizado,
+            'lote': self.lote_id,
+        }
+
+
+def codigo_unidad(codigo_lote, serie):
+    return f'{codigo_lote}-{serie:0{SERIE_DIGITOS}d}'
+
+
+def separar_codigo_unidad(codigo):
+    """Devuelve (codigo_lote, serie) o None si el código no es de un lote compacto."""
+    codigo_lote, _, serie = codigo.rpartition('-')
+    if not codigo_lote or len(serie) != SERIE_DIGITOS or not serie.isdigit():
+        return None
+    return codigo_lote, int(serie)
+
+
+def tramos_libres(total, ocupados):
+    """Huecos (inicio, fin) de 1..total que no cubren los tramos ocupados.
+
+    ocupados: iterable de (inicio, fin) inclusivos, ordenado por inicio.
+    """
+    siguiente = 1
+    for inicio, fin in ocupados:
+        if inicio > siguiente:
+            yield siguiente, inicio - 1
+        siguiente = max(siguiente, fin + 1)
+    if siguiente <= total:
+        yield siguiente, total
+
+
+def tomar_series(libres, cantidad):
+    """Toma las primeras `cantidad` series de los huecos libres (menor serie primero)."""
+    tomados = []
+    for inicio, fin in libres:
+        if cantidad <= 0:
+            break
+        hasta = min(fin, inicio + cantidad - 1)
+        tomados.append((inicio, hasta))
+        cantidad -= hasta - inicio + 1
+    return tomados if cantidad <= 0 else None
+
+
+def compactar_status(statuses, disponible='disponible'):
+    """Agrupa una lista de status por serie (1-indexada) en tramos no disponibles.
+
+    Devuelve [(inicio, fin, status), ...] uniendo series consecutivas con el mismo status.
+    """
+    tramos = []
+    for serie, status in enumerate(statuses, start=1):
+        if status == disponible:
+            continue
+        if tramos and tramos[-1][2] == status and tramos[-1][1] == serie - 1:
+            tramos[-1] = (tramos[-1][0], serie, status)
+        else:
+            tramos.append((serie, serie, status))
+    return tramos
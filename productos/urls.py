@@ -18,7 +18,9 @@ urlpatterns = [
     path('dashboard/', dashboard_view),
     path('rendimiento/', rendimiento_view),
     path('reorden/', reorden_view),
+    path('reorden/consolidado/', reorden_consolidado_view),
     path('exportar/existencias/', exportar_existencias_view),
     path('exportar/rendimiento/', exportar_rendimiento_view),
     path('exportar/reorden/', exportar_reorden_view),
+    path('exportar/reorden/consolidado/', exportar_reorden_consolidado_view),
 ]
@@ -1,17 +1,24 @@
-from django.db.models import Count, Sum, Q, F
-from django.utils import timezone
+from heapq import merge
+from itertools import islice
+
+from django.db.models import Exists, OuterRef, Sum
 from django_filters import rest_framework as filters
 from rest_framework import viewsets
 from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 
-from .models import Categoría, Marca, Proveedor, Equipo, Unidad
+from . import catalogos, dashboard, exportaciones
+from .models import Categoría, Marca, Proveedor, Equipo, Lote, Producto, RangoUnidades, StockSucursal, Unidad
 from .serializers import *
-from movimiento.models import Movimiento, MovimientoItem
-from organizacion.models import Cliente, EquipoCliente
-from productos.queries import lotes_queryset, productos_queryset, rendimiento_data, reorden_data
-from utils.exports import xlsx_response
-from utils.mixins import ActivityLogMixin
+from .listados import LoteListado, ProductoListado
+from .unidades import separar_codigo_unidad
+from movimiento.models import MovimientoItem
+from organizacion.models import EquipoCliente
+from productos.queries import lotes_queryset, productos_queryset, reorden_data
+from utils.exports import exportar
+from utils.mixins import ActivityLogMixin, GetCondicionalMixin, ListadoRapidoMixin, validador
+from utils.pagination import PaginacionKeyset, PaginacionKeysetObligatoria
 
 __all__ = [
     'ProductoViewSet',
@@ -24,19 +31,34 @@ __all__ = [
     'dashboard_view',
     'rendimiento_view',
     'reorden_view',
+    'reorden_consolidado_view',
     'exportar_existencias_view',
     'exportar_rendimiento_view',
     'exportar_reorden_view',
+    'exportar_reorden_consolidado_view',
 ]
 
 
-class ProductoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
+class ProductoViewSet(GetCondicionalMixin, ListadoRapidoMixin, ActivityLogMixin, viewsets.ModelViewSet):
     serializer_class = ProductoSerializer
+    listado_rapido = ProductoListado
     filter_backends = [filters.DjangoFilterBackend]
     filterset_fields = ['sku', 'categoria', 'equipos__marca', 'equipos']
+    pagination_class = PaginacionKeyset
+    orden_paginacion = ('codigo_interno', 'id')
 
     def get_queryset(self):
-        return productos_queryset(self.request.branch_id)
+        campos, expandir = self.serializer_class.parametros_campos(self.request)
+        # Orden estable: sin él cada plan (joins o no) devolvía los productos en otro orden.
+        return productos_queryset(self.request.branch_id, campos, expandir).order_by(*self.orden_paginacion)
+
+    def get_validadores(self, queryset):
+        # cantidad_disponible sale de StockSucursal; categoría, proveedor y equipos van anidados.
+        return [
+            validador(queryset),
+            validador(StockSucursal.objects.filter(sucursal=self.request.branch_id)),
+            *catalogos.validadores('categoria', 'proveedor', 'equipo'),
+        ]
     
     def update(self, request, *args, **kwargs):
         try:
@@ -53,41 +75,155 @@ class ProductoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
         self.log(instance, action)
 
 
-class LoteViewSet(ActivityLogMixin, viewsets.ModelViewSet):
+class LoteViewSet(GetCondicionalMixin, ListadoRapidoMixin, ActivityLogMixin, viewsets.ModelViewSet):
     serializer_class = LoteSerializer
+    listado_rapido = LoteListado
     filter_backends = [filters.DjangoFilterBackend]
     filterset_fields = ['producto', 'codigo_lote']
+    pagination_class = PaginacionKeyset
+    orden_paginacion = ('-creado', '-id')
 
     def get_queryset(self):
-        return lotes_queryset(sucursal_id=self.request.branch_id)
+        campos, expandir = self.serializer_class.parametros_campos(self.request)
+        return lotes_queryset(self.request.branch_id, campos, expandir)
+
+    def get_validadores(self, queryset):
+        # El producto anidado incluye sus equipos.
+        return [validador(queryset), validador(Producto.objects.all()), *catalogos.validadores('equipo')]
 
 
 class UnidadViewSet(viewsets.ModelViewSet):
     serializer_class = UnidadSerializer
+    filterset_fields = ['lote', 'status']
+    # Una fila (o serie) por pieza: la lista siempre va por páginas.
+    pagination_class = PaginacionKeysetObligatoria
+    # Llave (lote, id) para filas Unidad y (lote, serie) para lotes compactos.
+    orden_paginacion = ('lote', 'id')
 
     def get_queryset(self):
         return Unidad.objects.exclude(lote__producto__status='inactivo').filter(
             lote__sucursal=self.request.branch_id
         ).select_related('lote')
 
+    def _lotes_compactos(self, status=None):
+        lotes = Lote.objects.filter(
+            sucursal=self.request.branch_id, modo_unidades='rango'
+        ).exclude(producto__status='inactivo')
+        lote_id = self.request.query_params.get('lote')
+        if lote_id:
+            lotes = lotes.filter(pk=lote_id)
+        # Con ?status= se descartan por adelantado los lotes sin unidades en ese status.
+        if status == 'disponible':
+            lotes = lotes.filter(cantidad_restante__gt=0)
+        elif status:
+            lotes = lotes.filter(Exists(RangoUnidades.objects.filter(lote=OuterRef('pk'), status=status)))
+        return lotes.order_by('id')
+
+    def list(self, request, *args, **kwargs):
+        # Filas Unidad de lotes individuales + unidades derivadas de lotes compactos.
+        queryset = self.filter_queryset(self.get_queryset())
+        status_filtro = request.query_params.get('status')
+
+        # Se mezclan en orden (lote, id|serie) las filas Unidad posteriores al
+        # cursor y las unidades virtuales de los lotes compactos posteriores.
+        self.paginator.iniciar(request)
+        limite = self.paginator.limite
+        cursor = self.paginator.decodificar_cursor(request, self.orden_paginacion) or (0, 0)
+        try:
+            lote_id, posicion = (int(valor) for valor in cursor)
+        except (TypeError, ValueError):
+            raise NotFound('Cursor inválido.')
+
+        filas = list(
+            self.paginator.filtrar_posteriores(queryset, self.orden_paginacion, (lote_id, posicion))
+            .order_by(*self.orden_paginacion)[:limite + 1]
+        )
+        reales = (
+            ((fila.lote_id, fila.pk), dato)
+            for fila, dato in zip(filas, self.get_serializer(filas, many=True).data)
+        )
+        # El lote del cursor empieza después de su serie; los demás, desde la primera.
+        virtuales = (
+            ((u.lote_id, u.serie), u.as_dict())
+            for lote in self._lotes_compactos(status_filtro).filter(pk__gte=lote_id)
+            .prefetch_related('rangos').iterator(chunk_size=limite + 1)
+            for u in lote.iter_unidades(despues_de=posicion if lote.pk == lote_id else 0, status=status_filtro)
+        )
+        pagina = self.paginator.cortar_pagina(
+            list(islice(merge(reales, virtuales, key=lambda par: par[0]), limite + 1)),
+            lambda par: list(par[0]),
+        )
+        return self.paginator.get_paginated_response([dato for _llave, dato in pagina])
+
+    def retrieve(self, request, *args, **kwargs):
+        # Las unidades de lotes compactos se consultan por codigo_unidad.
+        partes = separar_codigo_unidad(str(kwargs[self.lookup_field]))
+        if partes is None:
+            return super().retrieve(request, *args, **kwargs)
 
-class CategoriaViewSet(ActivityLogMixin, viewsets.ModelViewSet):
+        codigo_lote, serie = partes
+        lote = self._lotes_compactos().filter(codigo_lote=codigo_lote).first()
+        unidad = lote.unidad_virtual(serie) if lote else None
+        if unidad is None:
+            return Response({'detail': 'No encontrado.'}, status=404)
+        return Response(unidad.as_dict())
+
+
+class CatalogoEnCacheMixin(GetCondicionalMixin):
+    """list() y validadores de GET condicional desde la caché de catálogos
+    (productos/catalogos.py), sin consultar la tabla.
+
+    La vista define `catalogo` y `visible(objeto)`, con el mismo filtro que su
+    queryset; el resto de las acciones siguen usando el queryset.
+    """
+    catalogo = None
+
+    def visible(self, objeto):
+        return True
+
+    def ordenar(self, objetos):
+        return objetos
+
+    def get_validadores(self, queryset):
+        # Un cambio de marca también cambia la versión de equipo (DEPENDIENTES).
+        return catalogos.validadores(self.catalogo)
+
+    def listado_completo(self, request, *args, **kwargs):
+        catalogo = catalogos.obtener(self.catalogo)[self.catalogo]
+        objetos = self.ordenar([o for o in catalogo['objetos'].values() if self.visible(o)])
+        return Response([catalogo['datos'][o.pk] for o in objetos])
+
+
+class CategoriaViewSet(CatalogoEnCacheMixin, ActivityLogMixin, viewsets.ModelViewSet):
     queryset = Categoría.objects.all()
     serializer_class = CategoriaSerializer
+    catalogo = 'categoria'
 
 
-class MarcaViewSet(ActivityLogMixin, viewsets.ModelViewSet):
+class MarcaViewSet(CatalogoEnCacheMixin, ActivityLogMixin, viewsets.ModelViewSet):
     queryset = Marca.objects.filter(activo=True)
     serializer_class = MarcaSerializer
+    catalogo = 'marca'
+
+    def visible(self, objeto):
+        return objeto.activo
 
 
-class EquipoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
+class EquipoViewSet(CatalogoEnCacheMixin, ActivityLogMixin, viewsets.ModelViewSet):
     queryset = (
         Equipo.objects.filter(activo=True, marca__activo=True)
         .order_by('marca__nombre', 'nombre')
         .select_related('marca')
     )
     serializer_class = EquipoSerializer
+    catalogo = 'equipo'
+
+    def visible(self, objeto):
+        return objeto.activo and objeto.marca.activo
+
+    def ordenar(self, objetos):
+        # Ya vienen por nombre; el sort estable deja (marca__nombre, nombre).
+        return sorted(objetos, key=lambda equipo: equipo.marca.nombre)
 
     @action(detail=True, methods=['get'])
     def clientes(self, request, pk=None):
@@ -127,77 +263,23 @@ class EquipoViewSet(ActivityLogMixin, viewsets.ModelViewSet):
         })
 
 
-class ProveedorViewSet(ActivityLogMixin, viewsets.ModelViewSet):
+class ProveedorViewSet(CatalogoEnCacheMixin, ActivityLogMixin, viewsets.ModelViewSet):
     queryset = Proveedor.objects.filter(activo=True)
     serializer_class = ProveedorSerializer
+    catalogo = 'proveedor'
+
+    def visible(self, objeto):
+        return objeto.activo
 
 
 @api_view()
 def dashboard_view(request):
-    branch_id = request.branch_id
-    productos = productos_queryset(sucursal_id=branch_id)
-    categorias = Categoría.objects.all()
-
-    hace_30_dias = (timezone.now() - timezone.timedelta(days=30)).date()
-
-    movs_filter = Q(
-        movimientoitem__movimiento__creado__date__gte=hace_30_dias,
-        movimientoitem__movimiento__aprobado=True,
-        movimientoitem__movimiento__sucursal=branch_id,
-    )
-
-    return Response(
-        {
-            'stats': {
-                'productos': productos.count(),
-                'lotes': lotes_queryset(sucursal_id=branch_id).filter(cantidad_restante__gt=0).count(),
-                'categorias': categorias.count(),
-                'proveedores': Proveedor.objects.filter(activo=True).count(),
-                'clientes': Cliente.objects.filter(activo=True, sucursal=branch_id).count(),
-            },
-            'categoriasChart': (
-                categorias.values('nombre').annotate(
-                    cantidad=Count('producto', filter=Q(producto__status='activo'))
-                )
-                .filter(cantidad__gt=0)
-            ),
-            'movimientosChart': (
-                Movimiento.objects.filter(
-                    creado__date__gte=hace_30_dias, aprobado=True, sucursal=branch_id
-                )
-                .values(fecha_creado=F('creado__date'))
-                .annotate(
-                    entradas=Count('id', filter=Q(tipo='entrada')),
-                    salidas=Count('id', filter=Q(tipo='salida'))
-                )
-            ),
-            'topProductosChart': (
-                productos.values('id', 'codigo_interno')
-                .annotate(
-                    total_movimientos=Count('movimientoitem__movimiento', distinct=True, filter=movs_filter)
-                )
-                .filter(total_movimientos__gt=0)
-                .order_by('-total_movimientos')[:10]
-            ),
-            'productosBajos': (
-                productos.filter(cantidad_disponible__lt=F('min_stock'))
-                .order_by('-cantidad_disponible')
-                .values('id', 'descripcion', 'categoria__nombre', 'cantidad_disponible', 'min_stock')
-            ),
-        }
-    )
+    return Response(dashboard.obtener(request.branch_id))
 
 
 @api_view()
 def rendimiento_view(request):
-    fecha_inicio = request.query_params.get('fechaInicio')
-    fecha_fin = request.query_params.get('fechaFin')
-    data = rendimiento_data(
-        sucursal_id=request.branch_id,
-        fecha_inicio=fecha_inicio,
-        fecha_fin=fecha_fin,
-    )
-    return Response(data)
+    return Response(exportaciones.rendimiento_de(request.branch_id, request.query_params))
 
 
 @api_view()
@@ -208,61 +290,24 @@ def reorden_view(request):
 
 @api_view()
 def exportar_reorden_view(request):
-    grupos = reorden_data(sucursal_id=request.branch_id)
-    headers = [
-        'Proveedor', 'Código', 'Descripción', 'Disponible', 'Mínimo',
-        'Consumo mensual', 'Días cobertura', 'Cantidad sugerida',
-    ]
-    rows = []
-    for grupo in grupos:
-        for p in grupo['productos']:
-            rows.append([
-                grupo['proveedor_nombre'],
-                p['codigo_interno'],
-                p['descripcion'],
-                p['cantidad_disponible'],
-                p['min_stock'],
-                p['consumo_mensual'],
-                p['dias_cobertura'],
-                p['cantidad_sugerida'],
-            ])
-    return xlsx_response(headers, rows, 'reorden.xlsx', sheet_title='Reorden')
+    return exportar(request, exportaciones.reorden_sucursal(request.branch_id, request.query_params, request.user))
+
+
+@api_view()
+def reorden_consolidado_view(request):
+    return Response(exportaciones.reorden_consolidado_de(request.user))
+
+
+@api_view()
+def exportar_reorden_consolidado_view(request):
+    return exportar(request, exportaciones.reorden_consolidado(request.branch_id, request.query_params, request.user))
 
 
 @api_view()
 def exportar_existencias_view(request):
-    productos = productos_queryset(request.branch_id).order_by('codigo_interno')
-    headers = ['Código', 'Descripción', 'Categoría', 'Disponible', 'Mínimo']
-    rows = [
-        [
-            p.codigo_interno,
-            p.descripcion,
-            p.categoria.nombre,
-            p.cantidad_disponible,
-            p.min_stock,
-        ]
-        for p in productos
-    ]
-    return xlsx_response(headers, rows, 'existencias.xlsx', sheet_title='Existencias')
+    return exportar(request, exportaciones.existencias(request.branch_id, request.query_params, request.user))
 
 
 @api_view()
 def exportar_rendimiento_view(request):
-    data = rendimiento_data(
-        sucursal_id=request.branch_id,
-        fecha_inicio=request.query_params.get('fechaInicio'),
-        fecha_fin=request.query_params.get('fechaFin'),
-    )
-    headers = ['Código', 'Descripción', 'Vida útil', 'Ciclos', 'Uso promedio', 'Ratio']
-    rows = [
-        [
-            r['codigo_interno'],
-            r['descripcion'],
-            r['vida_util'],
-            r['ciclos'],
-            r['uso_promedio'],
-            r['ratio'],
-        ]
-        for r in data
-    ]
-    return xlsx_response(headers, rows, 'rendimiento.xlsx', sheet_title='Rendimiento')
+    return exportar(request, exportaciones.rendimiento(request.branch_id, request.query_params, request.user))
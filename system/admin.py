@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import ConfiguracionSistema, RegistroActividad, AlertaInventario
+from .models import ConfiguracionSistema, RegistroActividad, AlertaInventario, TrabajoExportacion
 
 
 @admin.register(ConfiguracionSistema)
@@ -46,3 +46,17 @@ class AlertaInventarioAdmin(admin.ModelAdmin):
         return (obj.mensaje[:60] + '...') if len(obj.mensaje) > 60 else obj.mensaje
     mensaje_resumido.short_description = 'Mensaje'
 
+
+
+@admin.register(TrabajoExportacion)
+class TrabajoExportacionAdmin(admin.ModelAdmin):
+    """Admin para consultar las exportaciones en segundo plano."""
+    list_display = ('tipo', 'formato', 'usuario', 'sucursal', 'estado', 'filas', 'creado', 'expira')
+    list_filter = ('estado', 'tipo', 'sucursal')
+    search_fields = ('usuario__username', 'error')
+    readonly_fields = (
+        'usuario', 'sucursal', 'tipo', 'formato', 'parametros', 'filas', 'total', 'archivo',
+        'error', 'creado', 'iniciado', 'terminado', 'expira',
+    )
+    list_per_page = 25
+    ordering = ('-creado',)
@@ -1,10 +1,10 @@
 from datetime import timedelta
 
-from django.db.models import Count, F
+from django.db.models import F, Sum
 from django.utils import timezone
 
-from movimiento.models import MovimientoItem
-from productos.models import Producto
+from movimiento.models import ConsumoDiario
+from productos.models import Producto, StockSucursal
 from productos.queries import productos_queryset
 
 from .models import AlertaInventario
@@ -54,12 +54,11 @@ def generar_old_product(sucursal_id):
     hace_un_ano = timezone.now() - timedelta(days=365)
 
     ids_antiguos = set(
-        Producto.objects.filter(
-            status='activo',
-            lotes__fecha_entrada__lt=hace_un_ano,
-            lotes__sucursal=sucursal_id,
-            lotes__unidades__status='disponible',
-        ).values_list('pk', flat=True).distinct()
+        StockSucursal.objects.filter(
+            sucursal=sucursal_id,
+            producto__status='activo',
+            lote_mas_antiguo__lt=hace_un_ano,
+        ).values_list('producto_id', flat=True)
     )
 
     alertas_existentes = AlertaInventario.objects.filter(
@@ -84,34 +83,26 @@ def generar_old_product(sucursal_id):
 
 
 def generar_unusual_movement(sucursal_id):
-    now = timezone.now()
-    hace_30_dias = now - timedelta(days=30)
-    hace_6_meses = now - timedelta(days=180)
-
-    movs_recientes = (
-        MovimientoItem.objects.filter(
-            movimiento__tipo='salida',
-            movimiento__aprobado=True,
-            movimiento__sucursal=sucursal_id,
-            movimiento__creado__gte=hace_30_dias,
-        )
-        .values('producto_id')
-        .annotate(total=Count('id'))
-    )
-
-    counts_recientes = {m['producto_id']: m['total'] for m in movs_recientes}
+    hoy = timezone.localdate()
+    hace_30_dias = hoy - timedelta(days=30)
+    hace_6_meses = hoy - timedelta(days=180)
+
+    # Partidas de salida por producto desde el resumen diario: una consulta por ventana.
+    salidas = ConsumoDiario.objects.filter(sucursal=sucursal_id, tipo='salida').values('producto_id').order_by()
+    counts_recientes = {
+        m['producto_id']: m['total']
+        for m in salidas.filter(fecha__gte=hace_30_dias).annotate(total=Sum('items'))
+    }
+    counts_historicos = {
+        m['producto_id']: m['total']
+        for m in salidas.filter(
+            fecha__gte=hace_6_meses, fecha__lt=hace_30_dias, producto_id__in=list(counts_recientes),
+        ).annotate(total=Sum('items'))
+    }
 
     creadas = 0
     for producto_id, total_actual in counts_recientes.items():
-        hist_items = MovimientoItem.objects.filter(
-            movimiento__tipo='salida',
-            movimiento__aprobado=True,
-            movimiento__sucursal=sucursal_id,
-            movimiento__creado__gte=hace_6_meses,
-            movimiento__creado__lt=hace_30_dias,
-            producto_id=producto_id,
-        ).count()
-
+        hist_items = counts_historicos.get(producto_id, 0)
         hist_promedio = hist_items / 6 if hist_items > 0 else 0
 
         if hist_promedio > 0 and total_actual > hist_promedio * 3:
@@ -131,18 +122,13 @@ def generar_unusual_movement(sucursal_id):
 
 
 def generar_high_rotation(sucursal_id, top_n=10):
-    now = timezone.now()
-    hace_30_dias = now - timedelta(days=30)
+    hace_30_dias = timezone.localdate() - timedelta(days=30)
 
     top_productos = list(
-        MovimientoItem.objects.filter(
-            movimiento__aprobado=True,
-            movimiento__sucursal=sucursal_id,
-            movimiento__creado__gte=hace_30_dias,
-        )
+        ConsumoDiario.objects.filter(sucursal=sucursal_id, fecha__gte=hace_30_dias)
         .values('producto_id')
-        .annotate(total=Count('id'))
-        .order_by('-total')[:top_n]
+        .annotate(total=Sum('items'))
+        .order_by('-total', 'producto_id')[:top_n]
     )
 
     creadas = 0
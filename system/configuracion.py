@@ -0,0 +1,58 @@
+"""Lectura tipada y cacheada de ConfiguracionSistema.
+
+Todas las claves se cargan con una sola consulta y cada proceso las recuerda
+junto con la versión de la caché compartida (utils/versiones.py) con la que las
+leyó. Guardar o borrar una fila cambia la versión (ver signals.py) y cada
+worker recarga en su siguiente lectura, sin reiniciar. Una lectura normal
+cuesta una consulta a la caché.
+
+Los cambios con queryset.update() o bulk_create() no disparan señales: hay que
+llamar a invalidar() a mano.
+"""
+from utils import versiones
+
+from .models import ConfiguracionSistema
+
+LLAVE_VERSION = 'configuracion:version'
+
+# clave -> (tipo, valor por defecto). Un valor ausente o inválido usa el defecto.
+CLAVES = {
+    'reorden_lead_time_dias': (int, 15),
+    'reorden_meses_objetivo': (int, 2),
+    'reorden_meses_historial': (int, 6),
+}
+
+_local = None  # (versión, {clave: valor crudo}) de este proceso
+
+
+def invalidar():
+    versiones.cambiar_al_confirmar(LLAVE_VERSION)
+
+
+def _crudos():
+    global _local
+    version = versiones.leer(LLAVE_VERSION)[LLAVE_VERSION]
+    if _local is None or _local[0] != version:
+        # Se lee después de la versión: nunca queda más viejo que ella.
+        _local = (version, dict(ConfiguracionSistema.objects.values_list('clave', 'valor')))
+    return _local[1]
+
+
+def _convertir(clave, crudo):
+    tipo, defecto = CLAVES[clave]
+    if crudo is None:
+        return defecto
+    try:
+        return tipo(crudo)
+    except (TypeError, ValueError):
+        return defecto
+
+
+def leer(*claves):
+    """{clave: valor tipado} de las claves pedidas (todas las de CLAVES si no se indican)."""
+    crudos = _crudos()
+    return {clave: _convertir(clave, crudos.get(clave)) for clave in claves or CLAVES}
+
+
+def valor(clave):
+    return leer(clave)[clave]
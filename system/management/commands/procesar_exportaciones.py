@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from system.models import TrabajoExportacion
+
+
+class Command(BaseCommand):
+    help = (
+        'Worker de exportaciones: genera los TrabajoExportacion pendientes y borra los vencidos. '
+        'Corre hasta que se detiene; puede haber varios a la vez.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Procesa lo pendiente y termina (para cron o pruebas).',
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=2.0,
+            help='Segundos de espera cuando no hay trabajos pendientes (por defecto 2).',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            borrados = TrabajoExportacion.limpiar_vencidos()
+            if borrados:
+                self.stdout.write(f'{borrados} exportaciones vencidas borradas.')
+
+            while (trabajo := TrabajoExportacion.tomar_siguiente()) is not None:
+                trabajo.procesar()
+                self.stdout.write(f'Exportación {trabajo.pk} ({trabajo.tipo}): {trabajo.estado}, {trabajo.filas} filas.')
+
+            if options['una_vez']:
+                return
+            time.sleep(options['intervalo'])
+            # Proceso de larga vida: descarta conexiones caídas o vencidas (CONN_MAX_AGE).
+            close_old_connections()
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizacion', '0007_alter_equipocliente_alias'),
+        ('productos', '0025_indices_consultas'),
+        ('system', '0009_alter_registroactividad_accion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alertainventario',
+            index=models.Index(fields=['sucursal', 'tipo_alerta', 'resuelto'], name='alerta_sucursal_tipo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroactividad',
+            index=models.Index(fields=['sucursal', '-creado'], name='actividad_sucursal_creado_idx'),
+        ),
+    ]
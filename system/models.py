@@ -1,6 +1,13 @@
+from contextlib import suppress
+from datetime import timedelta
+from pathlib import Path, PurePosixPath
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.files.storage import FileSystemStorage
+from django.db import models, transaction
 from django.utils import timezone
+from django.utils.module_loading import import_string
 
 from productos.models import Producto
 
@@ -52,6 +59,9 @@ class RegistroActividad(models.Model):
         verbose_name = 'Registro de actividad'
         verbose_name_plural = 'Registros de actividad'
         ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['sucursal', '-creado'], name='actividad_sucursal_creado_idx'),
+        ]
 
     def __str__(self):
         return f'{self.usuario} - {self.get_accion_display()} ({self.creado.strftime("%Y-%m-%d %H:%M")})'
@@ -77,6 +87,170 @@ class AlertaInventario(models.Model):
         verbose_name = 'Alerta de inventario'
         verbose_name_plural = 'Alertas de inventario'
         ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['sucursal', 'tipo_alerta', 'resuelto'], name='alerta_sucursal_tipo_idx'),
+            # Paginación keyset del listado por sucursal.
+            models.Index(fields=['sucursal', '-creado', '-id'], name='alerta_sucursal_pagina_idx'),
+        ]
 
     def __str__(self):
         return f'{self.get_tipo_alerta_display()} - {self.producto.codigo_interno}'
+
+
+class AlmacenExportaciones(FileSystemStorage):
+    """FileSystemStorage en settings.EXPORTACIONES_ROOT, leído en cada uso."""
+
+    @property
+    def base_location(self):
+        return settings.EXPORTACIONES_ROOT
+
+    @property
+    def location(self):
+        return str(Path(self.base_location).resolve())
+
+
+def _almacen_exportaciones():
+    return AlmacenExportaciones()
+
+
+class TrabajoExportacion(models.Model):
+    """Exportación generada fuera de la petición por `manage.py procesar_exportaciones`.
+
+    La vista solo crea el trabajo (pendiente); el worker lo toma, escribe el
+    archivo en EXPORTACIONES_ROOT y va guardando las filas escritas para que el
+    cliente consulte el avance. El archivo se borra EXPORTACIONES_HORAS después.
+    """
+    TIPOS = [
+        ('movimientos', 'Movimientos'),
+        ('existencias', 'Existencias'),
+        ('rendimiento', 'Rendimiento'),
+        ('reorden', 'Reorden'),
+        ('reorden_consolidado', 'Reorden consolidado'),
+    ]
+    # tipo -> función (sucursal_id, params, usuario) -> utils.exports.Exportacion
+    GENERADORES = {
+        'movimientos': 'movimiento.exportaciones.movimientos',
+        'existencias': 'productos.exportaciones.existencias',
+        'rendimiento': 'productos.exportaciones.rendimiento',
+        'reorden': 'productos.exportaciones.reorden_sucursal',
+        'reorden_consolidado': 'productos.exportaciones.reorden_consolidado',
+    }
+    FORMATOS = [('xlsx', 'XLSX'), ('csv', 'CSV'), ('ndjson', 'NDJSON')]
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('terminado', 'Terminado'),
+        ('error', 'Error'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='exportaciones')
+    sucursal = models.ForeignKey(
+        'organizacion.Sucursal', on_delete=models.CASCADE,
+        related_name='exportaciones',
+    )
+    tipo = models.CharField(max_length=30, choices=TIPOS)
+    formato = models.CharField(max_length=10, choices=FORMATOS, default='xlsx')
+    # Query params de la exportación síncrona equivalente (fechaInicio, fechaFin, ...).
+    parametros = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    filas = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    archivo = models.FileField(storage=_almacen_exportaciones, max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    creado = models.DateTimeField(default=timezone.now)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+    expira = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Trabajo de exportación'
+        verbose_name_plural = 'Trabajos de exportación'
+        ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['estado', 'creado'], name='exportacion_cola_idx'),
+            models.Index(fields=['usuario', 'sucursal', '-creado', '-id'], name='exportacion_usuario_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_tipo_display()} ({self.formato}) - {self.get_estado_display()}'
+
+    @property
+    def progreso(self):
+        """Porcentaje escrito; None mientras se procesa sin total conocido."""
+        if self.estado == 'terminado':
+            return 100
+        if not self.total:
+            return 0 if self.estado == 'pendiente' else None
+        return min(99, self.filas * 100 // self.total)
+
+    @property
+    def nombre_descarga(self):
+        return PurePosixPath(self.archivo.name).name if self.archivo else ''
+
+    @classmethod
+    def tomar_siguiente(cls):
+        """Marca como procesando el pendiente más antiguo; varios workers no toman el mismo."""
+        with transaction.atomic():
+            trabajo = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(estado='pendiente')
+                .order_by('creado', 'id')
+                .first()
+            )
+            if trabajo is None:
+                return None
+            trabajo.estado = 'procesando'
+            trabajo.iniciado = timezone.now()
+            trabajo.save(update_fields=['estado', 'iniciado'])
+        return trabajo
+
+    def _avanzar(self, filas):
+        # Fuera de transacción: el avance es visible de inmediato para quien consulta.
+        self.filas += filas
+        TrabajoExportacion.objects.filter(pk=self.pk).update(filas=self.filas)
+
+    def _escribir(self):
+        from utils.exports import escribir, nombre_archivo, total_filas
+
+        exportacion = import_string(self.GENERADORES[self.tipo])(self.sucursal_id, self.parametros, self.usuario)
+        self.total = total_filas(exportacion, self.formato)
+        TrabajoExportacion.objects.filter(pk=self.pk).update(total=self.total)
+
+        almacen = self.archivo.storage
+        nombre = almacen.generate_filename(f'{self.pk}/{nombre_archivo(exportacion, self.formato)}')
+        ruta = Path(almacen.path(nombre))
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        with open(ruta, 'wb') as destino:
+            escribir(destino, exportacion, self.formato, avance=self._avanzar)
+        return nombre
+
+    def procesar(self):
+        """Genera el archivo; un fallo queda en `error` en lugar de propagarse."""
+        try:
+            self.archivo.name = self._escribir()
+            self.estado = 'terminado'
+        except Exception as e:
+            self.estado = 'error'
+            self.error = str(getattr(e, 'detail', e))
+        self.terminado = timezone.now()
+        self.expira = self.terminado + timedelta(hours=settings.EXPORTACIONES_HORAS)
+        self.save(update_fields=['archivo', 'estado', 'error', 'filas', 'total', 'terminado', 'expira'])
+
+    @classmethod
+    def limpiar_vencidos(cls):
+        """Borra archivos y trabajos vencidos; devuelve cuántos trabajos se borraron."""
+        ahora = timezone.now()
+        # Un worker que murió a media exportación deja el trabajo en procesando.
+        cls.objects.filter(
+            estado='procesando', iniciado__lt=ahora - timedelta(hours=settings.EXPORTACIONES_HORAS),
+        ).update(estado='error', error='Exportación interrumpida.', terminado=ahora, expira=ahora)
+
+        vencidos = list(cls.objects.filter(expira__lt=ahora))
+        for trabajo in vencidos:
+            if trabajo.archivo:
+                carpeta = Path(trabajo.archivo.path).parent
+                trabajo.archivo.delete(save=False)
+                with suppress(OSError):  # ya no existe o tiene otros archivos
+                    carpeta.rmdir()
+        cls.objects.filter(pk__in=[t.pk for t in vencidos]).delete()
+        return len(vencidos)
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from shapeless_serializers.serializers import InlineShapelessModelSerializer
 
-from .models import AlertaInventario, ConfiguracionSistema, RegistroActividad
+from .models import AlertaInventario, ConfiguracionSistema, RegistroActividad, TrabajoExportacion
 from productos.models import Producto
 
 
@@ -31,3 +31,23 @@ class RegistroActividadSerializer(serializers.ModelSerializer):
         model = RegistroActividad
         fields = ['id', 'usuario', 'usuario_nombre', 'accion', 'descripcion', 'segmentos', 'sucursal', 'sucursal_nombre', 'creado']
         read_only_fields = fields
+
+
+class TrabajoExportacionSerializer(serializers.ModelSerializer):
+    progreso = serializers.IntegerField(read_only=True, allow_null=True)
+    archivo = serializers.CharField(source='nombre_descarga', read_only=True)
+
+    class Meta:
+        model = TrabajoExportacion
+        fields = [
+            'id', 'tipo', 'formato', 'parametros', 'estado', 'filas', 'total', 'progreso',
+            'archivo', 'error', 'creado', 'iniciado', 'terminado', 'expira',
+        ]
+        read_only_fields = [
+            'id', 'estado', 'filas', 'total', 'error', 'creado', 'iniciado', 'terminado', 'expira',
+        ]
+
+    def validate_parametros(self, value):
+        if not isinstance(value, dict) or not all(isinstance(v, (str, int)) for v in value.values()):
+            raise serializers.ValidationError('Debe ser un objeto con los filtros de la exportación.')
+        return {clave: str(v) for clave, v in value.items()}
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import configuracion
+from .models import ConfiguracionSistema
+
+
+@receiver([post_save, post_delete], sender=ConfiguracionSistema)
+def invalidar_configuracion(sender, **kwargs):
+    configuracion.invalidar()
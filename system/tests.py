@@ -1,14 +1,27 @@
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from pathlib import Path
 from unittest.mock import patch
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
 
+from movimiento.models import ConsumoDiario
 from organizacion.models import PerfilUsuario, Sucursal
-from productos.models import Categoría, Producto, Proveedor
-from .models import AlertaInventario, ConfiguracionSistema, RegistroActividad
+from productos.models import Categoría, Lote, Producto, Proveedor, Unidad
+from . import configuracion
+from .alertas import generar_high_rotation, generar_unusual_movement
+from .models import AlertaInventario, ConfiguracionSistema, RegistroActividad, TrabajoExportacion
 
 
 # ── Model Tests ──────────────────────────────────────────────────────
@@ -21,6 +34,39 @@ class ConfiguracionSistemaModelTest(TestCase):
         self.assertIn('100', str(cfg))
 
 
+class ConfiguracionCacheTest(TestCase):
+    def test_valores_tipados_con_defecto(self):
+        ConfiguracionSistema.objects.create(clave='reorden_lead_time_dias', valor='20')
+        ConfiguracionSistema.objects.create(clave='reorden_meses_objetivo', valor='dos')
+        self.assertEqual(configuracion.leer(), {
+            'reorden_lead_time_dias': 20,
+            'reorden_meses_objetivo': 2,  # inválido: defecto
+            'reorden_meses_historial': 6,  # ausente: defecto
+        })
+
+    def test_una_consulta_y_luego_cache(self):
+        ConfiguracionSistema.objects.create(clave='reorden_lead_time_dias', valor='20')
+
+        def consultas_configuracion(funcion):
+            # Sin contar las lecturas de la versión (DatabaseCache también usa SQL).
+            with CaptureQueriesContext(connection) as ctx:
+                funcion()
+            return sum('system_configuracionsistema' in q['sql'] for q in ctx.captured_queries)
+
+        self.assertEqual(consultas_configuracion(configuracion.leer), 1)
+        self.assertEqual(consultas_configuracion(configuracion.leer), 0)
+        self.assertEqual(configuracion.valor('reorden_lead_time_dias'), 20)
+
+    def test_guardar_o_borrar_recarga(self):
+        cfg = ConfiguracionSistema.objects.create(clave='reorden_meses_historial', valor='3')
+        self.assertEqual(configuracion.valor('reorden_meses_historial'), 3)
+        cfg.valor = '4'
+        cfg.save()
+        self.assertEqual(configuracion.valor('reorden_meses_historial'), 4)
+        cfg.delete()
+        self.assertEqual(configuracion.valor('reorden_meses_historial'), 6)
+
+
 class RegistroActividadModelTest(TestCase):
     def test_str(self):
         user = User.objects.create_user(username='logger', password='pass')
@@ -47,6 +93,44 @@ class AlertaInventarioModelTest(TestCase):
         self.assertIn('P-ALERT', str(alerta))
 
 
+class AlertasConsumoTest(TestCase):
+    """unusual_movement y high_rotation se calculan desde ConsumoDiario."""
+    def setUp(self):
+        self.sucursal = Sucursal.objects.create(nombre='Suc Consumo')
+        cat = Categoría.objects.create(nombre='Cat Consumo')
+        self.productos = [
+            Producto.objects.create(
+                codigo_interno=f'P-CON-{i}', descripcion=f'Consumo {i}', categoria=cat,
+                unidad_medida='pieza', sku=f'SKU-CON-{i}', min_stock=1,
+            )
+            for i in range(2)
+        ]
+
+    def _consumo(self, producto, dias, items, tipo='salida'):
+        ConsumoDiario.objects.create(
+            sucursal=self.sucursal, producto=producto, tipo=tipo, items=items, unidades=items, movimientos=items,
+            fecha=timezone.localdate() - timedelta(days=dias),
+        )
+
+    def test_unusual_movement(self):
+        # Histórico: 6 partidas en 5 meses => promedio 1/mes. Reciente: 4 > 3 * 1.
+        self._consumo(self.productos[0], 90, 6)
+        self._consumo(self.productos[0], 5, 4)
+        self._consumo(self.productos[1], 90, 6)
+        self._consumo(self.productos[1], 5, 2)
+        self.assertEqual(generar_unusual_movement(self.sucursal.id), (1, 0))
+        alerta = AlertaInventario.objects.get(tipo_alerta='unusual_movement')
+        self.assertEqual(alerta.producto, self.productos[0])
+
+    def test_high_rotation_suma_entradas_y_salidas(self):
+        self._consumo(self.productos[0], 1, 2)
+        self._consumo(self.productos[1], 1, 2)
+        self._consumo(self.productos[1], 2, 1, tipo='entrada')
+        self._consumo(self.productos[0], 45, 10)  # fuera de la ventana
+        self.assertEqual(generar_high_rotation(self.sucursal.id, top_n=1), (1, 0))
+        self.assertEqual(AlertaInventario.objects.get(tipo_alerta='high_rotation').producto, self.productos[1])
+
+
 # ── Endpoint Tests ───────────────────────────────────────────────────
 
 
@@ -159,6 +243,22 @@ class AlertaViewSetTest(APITestCase):
         self.assertEqual(response.data['count'], 0)
         self.assertEqual(response.data['no_leidas'], 0)
 
+    def test_list_paginado_conserva_no_leidas(self):
+        for _ in range(3):
+            AlertaInventario.objects.create(
+                producto=self.producto, tipo_alerta='low_stock', mensaje='Bajo', sucursal=self.sucursal
+            )
+        url = reverse('alertas-list')
+        response = self.client.get(url, {'limite': 2}, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(response.data['hay_mas'])
+        self.assertEqual(response.data['no_leidas'], 3)
+
+        response = self.client.get(response.data['siguiente'], **self.headers)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertFalse(response.data['hay_mas'])
+
     def test_create_returns_405(self):
         url = reverse('alertas-list')
         data = {'producto': self.producto.pk, 'tipo_alerta': 'low_stock', 'mensaje': 'Test'}
@@ -277,3 +377,95 @@ class RegistroActividadViewSetTest(APITestCase):
         response = self.client.get(url, **self.headers)
         self.assertIn('usuario_nombre', response.data[0])
         self.assertEqual(response.data[0]['usuario_nombre'], 'admin')
+
+
+# ── Exportaciones en segundo plano ───────────────────────────────────
+
+
+class TrabajoExportacionTest(APITestCase):
+    def setUp(self):
+        self.carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.carpeta, ignore_errors=True)
+        ajustes = override_settings(EXPORTACIONES_ROOT=Path(self.carpeta))
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.user = User.objects.create_user(username='exp_async', password='pass')
+        PerfilUsuario.objects.create(usuario=self.user, rol='admin')
+        self.sucursal = Sucursal.objects.create(nombre='Suc Exp Async')
+        self.user.profile.sucursales.add(self.sucursal)
+        self.client.force_login(self.user)
+        self.headers = {'HTTP_X_BRANCH_ID': self.sucursal.id}
+
+        producto = Producto.objects.create(
+            codigo_interno='P-ASYNC', descripcion='Producto Async',
+            categoria=Categoría.objects.create(nombre='Cat Async'), unidad_medida='pieza',
+            sku='SKU-ASYNC', min_stock=2,
+        )
+        lote = Lote.objects.create(producto=producto, codigo_lote='L-ASYNC', cantidad_inicial=3, sucursal=self.sucursal)
+        Unidad.objects.bulk_create([Unidad(lote=lote) for _ in range(3)])
+
+    def _worker(self):
+        call_command('procesar_exportaciones', '--una-vez', stdout=io.StringIO())
+
+    def test_crear_procesar_y_descargar(self):
+        response = self.client.post(
+            reverse('exportaciones-list'), {'tipo': 'existencias', 'formato': 'ndjson'}, format='json', **self.headers,
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['estado'], 'pendiente')
+        self.assertEqual(response.data['progreso'], 0)
+        detalle = reverse('exportaciones-detail', args=[response.data['id']])
+        descarga = reverse('exportaciones-descargar', args=[response.data['id']])
+        self.assertEqual(self.client.get(descarga, **self.headers).status_code, status.HTTP_409_CONFLICT)
+        self.assertTrue(RegistroActividad.objects.filter(accion='export', usuario=self.user).exists())
+
+        self._worker()
+
+        response = self.client.get(detalle, **self.headers)
+        self.assertEqual(response.data['estado'], 'terminado')
+        self.assertEqual((response.data['filas'], response.data['total'], response.data['progreso']), (1, 1, 100))
+        self.assertEqual(response.data['archivo'], 'existencias.ndjson')
+
+        response = self.client.get(descarga, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('existencias.ndjson', response['Content-Disposition'])
+        contenido = b''.join(response.streaming_content).decode()
+        self.assertEqual([json.loads(linea) for linea in contenido.splitlines()], [{
+            'codigo_interno': 'P-ASYNC', 'descripcion': 'Producto Async', 'categoria': 'Cat Async',
+            'cantidad_disponible': 3, 'min_stock': 2,
+        }])
+
+    def test_solo_trabajos_propios(self):
+        otro = User.objects.create_user(username='exp_otro', password='pass')
+        trabajo = TrabajoExportacion.objects.create(usuario=otro, sucursal=self.sucursal, tipo='existencias')
+        response = self.client.get(reverse('exportaciones-detail', args=[trabajo.pk]), **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tipo_o_formato_invalido(self):
+        for datos in ({'tipo': 'ventas'}, {'tipo': 'existencias', 'formato': 'pdf'}):
+            response = self.client.post(reverse('exportaciones-list'), datos, format='json', **self.headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(TrabajoExportacion.objects.exists())
+
+    def test_error_del_generador_queda_en_el_trabajo(self):
+        trabajo = TrabajoExportacion.objects.create(
+            usuario=self.user, sucursal=self.sucursal, tipo='movimientos', parametros={'items__producto': 'x'},
+        )
+        self._worker()
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'error')
+        self.assertIn('items__producto', trabajo.error)
+
+    def test_limpiar_vencidos_borra_archivo(self):
+        trabajo = TrabajoExportacion.objects.create(usuario=self.user, sucursal=self.sucursal, tipo='existencias')
+        self._worker()
+        trabajo.refresh_from_db()
+        ruta = Path(trabajo.archivo.path)
+        self.assertTrue(ruta.exists())
+
+        TrabajoExportacion.objects.filter(pk=trabajo.pk).update(expira=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(TrabajoExportacion.limpiar_vencidos(), 1)
+        self.assertFalse(ruta.exists())
+        self.assertFalse(ruta.parent.exists())
+        self.assertFalse(TrabajoExportacion.objects.exists())
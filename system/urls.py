@@ -1,12 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import AlertaViewSet, ConfiguracionSistemaViewSet, RegistroActividadViewSet
+from .views import AlertaViewSet, ConfiguracionSistemaViewSet, RegistroActividadViewSet, TrabajoExportacionViewSet
 
 router = DefaultRouter()
 router.register(r'configuracion', ConfiguracionSistemaViewSet, basename='configuracion')
 router.register(r'alertas', AlertaViewSet, basename='alertas')
 router.register(r'actividades', RegistroActividadViewSet, basename='actividades')
+router.register(r'exportaciones', TrabajoExportacionViewSet, basename='exportaciones')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -2,19 +2,22 @@ from django.conf import settings
 from django.middleware.csrf import get_token
 from django.urls import reverse
 from langchain_core.exceptions import OutputParserException
-from rest_framework import status, viewsets
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from utils.pagination import PaginacionKeyset
 from utils.permissions import HasAdminRole, HasValidBranch
+from utils.streaming import ArchivoStreaming
 
-from .models import AlertaInventario, ConfiguracionSistema, RegistroActividad
+from .models import AlertaInventario, ConfiguracionSistema, RegistroActividad, TrabajoExportacion
 from .serializers import (
     AlertaInventarioSerializer,
     ConfiguracionSistemaSerializer,
     RegistroActividadSerializer,
+    TrabajoExportacionSerializer,
 )
 from organizacion.serializers import UserSerializer
 
@@ -97,6 +100,8 @@ class AlertaViewSet(viewsets.ModelViewSet):
     serializer_class = AlertaInventarioSerializer
     filterset_fields = ['tipo_alerta', 'resuelto']
     http_method_names = ['get', 'patch', 'post']
+    pagination_class = PaginacionKeyset
+    orden_paginacion = ('-creado', '-id')
 
     def get_queryset(self):
         return AlertaInventario.objects.select_related('producto').filter(
@@ -114,9 +119,15 @@ class AlertaViewSet(viewsets.ModelViewSet):
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
         no_leidas = AlertaInventario.objects.filter(resuelto=False, sucursal=request.branch_id).count()
-        
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+            response.data['no_leidas'] = no_leidas
+            return response
+
+        serializer = self.get_serializer(queryset, many=True)
         return Response({
             'count': len(serializer.data),
             'no_leidas': no_leidas,
@@ -166,6 +177,8 @@ class RegistroActividadViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = RegistroActividad.objects.select_related('usuario', 'sucursal').all()
     serializer_class = RegistroActividadSerializer
     filterset_fields = ['usuario', 'accion']
+    pagination_class = PaginacionKeyset
+    orden_paginacion = ('-creado', '-id')
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -183,6 +196,45 @@ class RegistroActividadViewSet(viewsets.ReadOnlyModelViewSet):
         return qs
 
 
+class TrabajoExportacionViewSet(
+    mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet,
+):
+    """Exportaciones en segundo plano del usuario en la sucursal.
+
+    POST crea el trabajo (202) y `manage.py procesar_exportaciones` lo genera;
+    GET consulta estado y progreso, y `descargar` entrega el archivo terminado.
+    """
+    serializer_class = TrabajoExportacionSerializer
+    filterset_fields = ['tipo', 'estado']
+    pagination_class = PaginacionKeyset
+    orden_paginacion = ('-creado', '-id')
+
+    def get_queryset(self):
+        return TrabajoExportacion.objects.filter(usuario=self.request.user, sucursal=self.request.branch_id)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    def perform_create(self, serializer):
+        trabajo = serializer.save(usuario=self.request.user, sucursal_id=self.request.branch_id)
+        RegistroActividad.objects.create(
+            usuario=self.request.user, accion='export', sucursal_id=self.request.branch_id,
+            descripcion=f'Solicitó la exportación de {trabajo.get_tipo_display().lower()} ({trabajo.formato}).',
+        )
+
+    @action(detail=True, methods=['get'])
+    def descargar(self, request, pk=None):
+        trabajo = self.get_object()
+        if trabajo.estado != 'terminado':
+            return Response(
+                {'detail': 'La exportación aún no está lista.', 'estado': trabajo.estado},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return ArchivoStreaming(trabajo.archivo.open('rb'), as_attachment=True, filename=trabajo.nombre_descarga)
+
+
 @api_view(['POST'])
 def chat(request):
     from utils.chatbot import obtener_agente
@@ -21,6 +21,8 @@ TABLAS_PERMITIDAS = {
     'productos_marca',
     'productos_proveedor',
     'productos_unidad',
+    'productos_rangounidades',
+    'productos_stocksucursal',
     'organizacion_cliente',
     'organizacion_equipocliente',
     'organizacion_sucursal',
@@ -80,12 +82,19 @@ def _build_branch_rules(branch_id):
         f"- productos_unidad:             JOIN productos_lote\n"
         f"                                ON productos_unidad.lote_id = productos_lote.id\n"
         f"                                WHERE productos_lote.sucursal_id = {branch_id}\n"
+        f"- productos_rangounidades:      JOIN productos_lote\n"
+        f"                                ON productos_rangounidades.lote_id = productos_lote.id\n"
+        f"                                WHERE productos_lote.sucursal_id = {branch_id}\n"
+        f"- productos_stocksucursal:      WHERE sucursal_id = {branch_id}\n"
         f"- organizacion_equipocliente:   JOIN organizacion_cliente\n"
         f"                                ON organizacion_equipocliente.cliente_id = organizacion_cliente.id\n"
         f"                                WHERE organizacion_cliente.sucursal_id = {branch_id}\n"
         f"- organizacion_sucursal:        WHERE id = {branch_id} (solo tu propia sucursal)\n"
         f"\n"
         f"Tablas globales (no filtrar por sucursal): productos_producto, productos_equipo, productos_marca, productos_categor\u00eda, productos_proveedor\n"
+        f"\n"
+        f"Existencias: usa productos_lote.cantidad_restante o productos_stocksucursal.cantidad_disponible.\n"
+        f"Los lotes con modo_unidades='rango' no tienen filas en productos_unidad.\n"
     )
 
 
@@ -1,8 +1,66 @@
+import csv
 import io
+import json
+import tempfile
+from collections.abc import Callable, Iterable, Sized
+from datetime import date
+from itertools import chain, islice
+from typing import NamedTuple
 
-from django.http import HttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+from rest_framework.exceptions import ValidationError
+
+from .streaming import RespuestaStreaming
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+FORMATOS = {
+    'xlsx': XLSX_CONTENT_TYPE,
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+# Filas que se traen de la base por consulta al exportar (queryset.iterator(chunk_size=...)).
+FILAS_POR_CONSULTA = 2000
+# Filas que se miran para calcular el ancho de las columnas.
+MUESTRA_ANCHOS = 200
+TAMANO_BLOQUE = 64 * 1024
+# Filas de CSV / NDJSON por bloque enviado.
+FILAS_POR_BLOQUE = 500
+
+
+def escribir_xlsx(destino, hojas):
+    """Escribe un .xlsx en `destino` (ruta o archivo binario) con hojas write-only.
+
+    hojas: iterable de (sheet_title, headers, rows); rows puede ser cualquier
+    iterable (p. ej. un generador sobre queryset.iterator()) y se recorre una
+    sola vez, así que la memoria no crece con el número de filas. El ancho de
+    cada columna se calcula con las primeras MUESTRA_ANCHOS filas.
+    """
+    wb = Workbook(write_only=True)
+    for sheet_title, headers, rows in hojas:
+        ws = wb.create_sheet(sheet_title[:31])  # límite de Excel para nombre de hoja
+        rows = iter(rows)
+        muestra = list(islice(rows, MUESTRA_ANCHOS))
+
+        # En modo write-only los anchos se fijan antes de la primera fila.
+        for idx, header in enumerate(headers, start=1):
+            largo_max = max([len(str(header))] + [len(str(row[idx - 1])) for row in muestra if idx - 1 < len(row)])
+            ws.column_dimensions[get_column_letter(idx)].width = min(largo_max + 2, 60)
+
+        encabezados = []
+        for header in headers:
+            celda = WriteOnlyCell(ws, value=header)
+            celda.font = Font(bold=True)
+            encabezados.append(celda)
+        ws.append(encabezados)
+
+        for row in chain(muestra, rows):
+            ws.append(list(row))
+    wb.save(destino)
 
 
 def build_xlsx(headers, rows, sheet_title='Reporte'):
@@ -11,35 +69,169 @@ def build_xlsx(headers, rows, sheet_title='Reporte'):
     headers: lista de encabezados de columna.
     rows: iterable de filas; cada fila es una lista/tupla alineada con headers.
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = sheet_title[:31]  # límite de Excel para nombre de hoja
-
-    ws.append(list(headers))
-    for celda in ws[1]:
-        celda.font = Font(bold=True)
+    return build_xlsx_hojas([(sheet_title, headers, rows)])
 
-    for row in rows:
-        ws.append(list(row))
-
-    # Ancho de columna aproximado al contenido más largo.
-    for idx, header in enumerate(headers, start=1):
-        largo_max = len(str(header))
-        for row in rows:
-            valor = row[idx - 1] if idx - 1 < len(row) else ''
-            largo_max = max(largo_max, len(str(valor)))
-        ws.column_dimensions[ws.cell(row=1, column=idx).column_letter].width = min(largo_max + 2, 60)
 
+def build_xlsx_hojas(hojas):
+    """Como build_xlsx, con una hoja por cada (sheet_title, headers, rows)."""
     buf = io.BytesIO()
-    wb.save(buf)
+    escribir_xlsx(buf, hojas)
     return buf.getvalue()
 
 
+def _xlsx_streaming(hojas, filename):
+    """RespuestaStreaming que genera el .xlsx mientras se envía la respuesta.
+
+    openpyxl solo arma el zip al guardar: el archivo se escribe en un temporal
+    en disco y se envía por bloques, sin tenerlo completo en memoria.
+    """
+    def contenido():
+        with tempfile.TemporaryFile() as archivo:
+            escribir_xlsx(archivo, hojas)
+            archivo.seek(0)
+            while bloque := archivo.read(TAMANO_BLOQUE):
+                yield bloque
+
+    return RespuestaStreaming(
+        contenido(),
+        content_type=XLSX_CONTENT_TYPE,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
 def xlsx_response(headers, rows, filename, sheet_title='Reporte'):
-    """Atajo: construye el .xlsx y lo envuelve en una HttpResponse descargable."""
-    contenido = build_xlsx(headers, rows, sheet_title=sheet_title)
-    return HttpResponse(
-        contenido,
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    """Atajo: .xlsx descargable generado al vuelo; rows se consume al enviar la respuesta."""
+    return _xlsx_streaming([(sheet_title, headers, rows)], filename)
+
+
+def xlsx_hojas_response(hojas, filename):
+    """Como xlsx_response con varias hojas (ver escribir_xlsx)."""
+    return _xlsx_streaming(hojas, filename)
+
+
+class Hoja(NamedTuple):
+    """Una tabla exportable.
+
+    columnas: [(campo, encabezado)]; CSV y NDJSON usan el campo y XLSX el
+    encabezado. filas: queryset (.values_list(), se recorre con iterator()) o
+    iterable de tuplas con los valores crudos. formatear(fila) adapta cada fila
+    solo para XLSX (textos para personas).
+    """
+    titulo: str
+    columnas: list
+    filas: Iterable
+    formatear: Callable = None
+
+
+class Exportacion(NamedTuple):
+    """Hojas de un archivo exportado; CSV y NDJSON usan solo hojas[plana]."""
+    nombre: str
+    hojas: list
+    plana: int = 0
+
+
+def formato_de(params):
+    """Formato pedido con ?formato= (xlsx por defecto)."""
+    formato = (params.get('formato') or 'xlsx').lower()
+    if formato not in FORMATOS:
+        raise ValidationError({'formato': f'Formato no soportado. Opciones: {", ".join(FORMATOS)}.'})
+    return formato
+
+
+def total_filas(exportacion, formato):
+    """Filas que se van a escribir, si se pueden saber antes (None si no)."""
+    total = 0
+    for hoja in exportacion.hojas if formato == 'xlsx' else [exportacion.hojas[exportacion.plana]]:
+        if isinstance(hoja.filas, QuerySet):
+            total += hoja.filas.count()
+        elif isinstance(hoja.filas, Sized):
+            total += len(hoja.filas)
+        else:
+            return None
+    return total
+
+
+def _recorrer(filas, avance):
+    if isinstance(filas, QuerySet):
+        filas = filas.iterator(chunk_size=FILAS_POR_CONSULTA)
+    if avance is None:
+        yield from filas
+        return
+    n = 0
+    for n, fila in enumerate(filas, start=1):
+        yield fila
+        if n % FILAS_POR_CONSULTA == 0:
+            avance(FILAS_POR_CONSULTA)
+    avance(n % FILAS_POR_CONSULTA)
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en lugar de guardarla."""
+    def write(self, valor):
+        return valor
+
+
+def _csv(campos, filas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(campos).encode()
+    filas = iter(filas)
+    while bloque := list(islice(filas, FILAS_POR_BLOQUE)):
+        yield ''.join(
+            escritor.writerow([v.isoformat() if isinstance(v, date) else v for v in fila]) for fila in bloque
+        ).encode()
+
+
+def _ndjson(campos, filas):
+    filas = iter(filas)
+    while bloque := list(islice(filas, FILAS_POR_BLOQUE)):
+        yield ''.join(
+            json.dumps(dict(zip(campos, fila)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for fila in bloque
+        ).encode()
+
+
+def _texto(exportacion, formato, avance=None):
+    """Bloques de bytes de un CSV o NDJSON."""
+    hoja = exportacion.hojas[exportacion.plana]
+    generador = _csv if formato == 'csv' else _ndjson
+    return generador([c for c, _ in hoja.columnas], _recorrer(hoja.filas, avance))
+
+
+def _hojas_xlsx(exportacion, avance=None):
+    for hoja in exportacion.hojas:
+        filas = _recorrer(hoja.filas, avance)
+        if hoja.formatear is not None:
+            filas = map(hoja.formatear, filas)
+        yield hoja.titulo, [e for _, e in hoja.columnas], filas
+
+
+def escribir(destino, exportacion, formato, avance=None):
+    """Escribe la exportación en el archivo binario `destino`.
+
+    avance(n) se llama cada FILAS_POR_CONSULTA filas escritas (y al final con el resto).
+    """
+    if formato == 'xlsx':
+        escribir_xlsx(destino, _hojas_xlsx(exportacion, avance))
+        return
+    for bloque in _texto(exportacion, formato, avance):
+        destino.write(bloque)
+
+
+def nombre_archivo(exportacion, formato):
+    return f'{exportacion.nombre}.{formato}'
+
+
+def respuesta(exportacion, formato):
+    """RespuestaStreaming descargable; las filas se recorren al enviar la respuesta."""
+    filename = nombre_archivo(exportacion, formato)
+    if formato == 'xlsx':
+        return xlsx_hojas_response(_hojas_xlsx(exportacion), filename)
+    return RespuestaStreaming(
+        _texto(exportacion, formato),
+        content_type=FORMATOS[formato],
         headers={'Content-Disposition': f'attachment; filename="{filename}"'},
     )
+
+
+def exportar(request, exportacion):
+    """Respuesta de la exportación en el formato de ?formato= (xlsx, csv o ndjson)."""
+    return respuesta(exportacion, formato_de(request.query_params))
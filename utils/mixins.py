@@ -1,3 +1,11 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import serializers
+from rest_framework.response import Response
+
 from system.models import RegistroActividad
 
 
@@ -51,3 +59,112 @@ class ActivityLogMixin:
     def perform_destroy(self, instance):
         self.log(instance, 'delete')
         instance.delete()
+
+
+def _lista_param(valor):
+    return {c.strip() for c in valor.split(',') if c.strip()}
+
+
+class CamposDinamicosMixin:
+    """Soporta ?fields= y ?expand= al leer con un ModelSerializer.
+
+    ?fields=id,codigo_interno  -> solo esos campos en la respuesta.
+    ?expand=categoria          -> solo esas relaciones (de `campos_expandibles`)
+                                  se anidan; las demás se devuelven como id.
+    Sin parámetros la respuesta no cambia. Solo aplica en GET y en el
+    serializer raíz (los anidados no reciben el request al construirse).
+    """
+    campos_expandibles = ()
+
+    @staticmethod
+    def parametros_campos(request):
+        """(campos, expandir) pedidos por el cliente; None = sin restricción."""
+        if request is None or request.method != 'GET':
+            return None, None
+        params = request.query_params
+        campos = _lista_param(params['fields']) if 'fields' in params else None
+        expandir = _lista_param(params['expand']) if 'expand' in params else None
+        return campos, expandir
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        campos, expandir = self.parametros_campos(self.context.get('request'))
+
+        if expandir is not None:
+            for nombre in self.campos_expandibles:
+                if nombre in self.fields and nombre not in expandir:
+                    many = isinstance(self.fields[nombre], serializers.ListSerializer)
+                    self.fields[nombre] = serializers.PrimaryKeyRelatedField(read_only=True, many=many)
+
+        if campos is not None:
+            for nombre in set(self.fields) - campos:
+                self.fields.pop(nombre)
+
+
+class ListadoRapidoMixin:
+    """list() de solo lectura desde .values() con la clase `listado_rapido`.
+
+    `listado_rapido(context)` debe ofrecer valores(queryset) -> queryset de
+    dicts y construir(filas) -> lista con la misma forma que el serializer.
+    Con ?fields= / ?expand= se usa el serializer normal.
+    """
+    listado_rapido = None
+
+    def usar_listado_rapido(self, request):
+        if self.listado_rapido is None:
+            return False
+        parametros = getattr(self.get_serializer_class(), 'parametros_campos', None)
+        return parametros is None or parametros(request) == (None, None)
+
+    def list(self, request, *args, **kwargs):
+        if not self.usar_listado_rapido(request):
+            return super().list(request, *args, **kwargs)
+
+        listado = self.listado_rapido(self.get_serializer_context())
+        queryset = listado.valores(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(listado.construir(page))
+        return Response(listado.construir(queryset))
+
+
+def validador(queryset, campo='actualizado'):
+    """(última modificación, nº de filas) de un queryset, sin traer las filas."""
+    r = queryset.order_by().aggregate(ultima=Max(campo), total=Count('*'))
+    return r['ultima'], r['total']
+
+
+class GetCondicionalMixin:
+    """GET condicional (ETag / Last-Modified) en list() sin serializar.
+
+    get_validadores(queryset) devuelve un validador() por cada tabla que forma
+    la respuesta (el listado, sus relaciones anidadas, el stock...). Si el
+    cliente ya tiene esa versión (If-None-Match / If-Modified-Since) se
+    responde 304 sin armar el listado.
+    """
+
+    def get_validadores(self, queryset):
+        return [validador(queryset)]
+
+    def list(self, request, *args, **kwargs):
+        validadores = self.get_validadores(self.filter_queryset(self.get_queryset()))
+        fechas = [ultima for ultima, _total in validadores if ultima is not None]
+        last_modified = int(max(fechas).timestamp()) if fechas else None
+        firma = repr((request.branch_id, request.accepted_renderer.format, validadores))
+        etag = quote_etag(hashlib.md5(firma.encode(), usedforsecurity=False).hexdigest())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.listado_completo(request, *args, **kwargs)
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # La respuesta depende de la sucursal (header) y siempre debe revalidarse.
+        patch_vary_headers(response, ['X-Branch-Id'])
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def listado_completo(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
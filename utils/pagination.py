@@ -0,0 +1,164 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PaginacionKeyset(BasePagination):
+    """Paginación por llave (keyset) con ?limite=N&cursor=<token>.
+
+    La vista define `orden_paginacion`, una tupla de campos que termina en un
+    campo único (p. ej. ('-creado', '-id')). El cursor guarda los valores de la
+    última fila entregada y la página siguiente filtra "después de" esa fila,
+    así que cualquier página cuesta lo mismo que la primera. No se hace COUNT:
+    se pide una fila extra para saber si hay más (`hay_mas`).
+
+    Es opcional: sin `limite` ni `cursor` la vista responde la lista completa
+    como siempre, para no romper a los clientes actuales, pero solo hasta
+    `maximo_sin_paginar` filas; una lista más grande responde 400 y hay que
+    pedirla por páginas. Las vistas cuyas listas crecen sin límite usan
+    PaginacionKeysetObligatoria.
+    """
+    cursor_query_param = 'cursor'
+    limite_query_param = 'limite'
+    limite_default = 50
+    limite_maximo = 500
+    maximo_sin_paginar = 5000
+    obligatoria = False
+
+    def activa(self, request):
+        params = request.query_params
+        return self.obligatoria or self.cursor_query_param in params or self.limite_query_param in params
+
+    def verificar_sin_paginar(self, queryset):
+        """Rechaza la lista completa si pasa de maximo_sin_paginar filas (una fila de más, sin COUNT)."""
+        if queryset.values('pk')[self.maximo_sin_paginar:self.maximo_sin_paginar + 1]:
+            raise ValidationError({
+                self.limite_query_param: f'La lista tiene más de {self.maximo_sin_paginar} elementos; '
+                                         f'pídala por páginas con ?{self.limite_query_param}= y ?{self.cursor_query_param}=.',
+            })
+
+    def get_limite(self, request):
+        try:
+            limite = int(request.query_params.get(self.limite_query_param, self.limite_default))
+        except (TypeError, ValueError):
+            return self.limite_default
+        return max(1, min(limite, self.limite_maximo))
+
+    def get_orden(self, view):
+        return view.orden_paginacion
+
+    def iniciar(self, request):
+        self.request = request
+        self.limite = self.get_limite(request)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.activa(request):
+            self.verificar_sin_paginar(queryset)
+            return None
+
+        self.iniciar(request)
+        orden = self.get_orden(view)
+        posicion = self.decodificar_cursor(request, orden)
+
+        queryset = queryset.order_by(*orden)
+        inmediatos, diferir = queryset.query.deferred_loading
+        if not diferir:
+            # Con .only() (p. ej. ?fields=) se cargan también las columnas del cursor.
+            queryset = queryset.only(*inmediatos, *(campo.lstrip('-') for campo in orden))
+        if posicion is not None:
+            queryset = self.filtrar_posteriores(queryset, orden, posicion)
+
+        filas = list(queryset[:self.limite + 1])
+        return self.cortar_pagina(filas, lambda fila: self.valores_llave(fila, orden))
+
+    def cortar_pagina(self, filas, llave):
+        """Se queda con `limite` filas y prepara el cursor de la siguiente página."""
+        self.hay_mas = len(filas) > self.limite
+        filas = filas[:self.limite]
+        self.siguiente = llave(filas[-1]) if self.hay_mas else None
+        return filas
+
+    @staticmethod
+    def filtro_posterior(orden, posicion):
+        """Filas estrictamente posteriores a `posicion` en el orden dado.
+
+        (a, b) > (x, y)  <=>  a > x  OR  (a = x AND b > y), respetando '-' en cada campo.
+        """
+        filtro = Q()
+        iguales = {}
+        for campo, valor in zip(orden, posicion):
+            nombre = campo.lstrip('-')
+            lookup = 'lt' if campo.startswith('-') else 'gt'
+            filtro |= Q(**iguales, **{f'{nombre}__{lookup}': valor})
+            iguales[nombre] = valor
+        return filtro
+
+    def filtrar_posteriores(self, queryset, orden, posicion):
+        """queryset.filter(filtro_posterior(...)); un cursor con valores del tipo equivocado da 404."""
+        try:
+            return queryset.filter(self.filtro_posterior(orden, posicion))
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound('Cursor inválido.')
+
+    @staticmethod
+    def valores_llave(instancia, orden):
+        if isinstance(instancia, dict):  # filas de .values()
+            return [instancia[campo.lstrip('-')] for campo in orden]
+        meta = instancia._meta
+        return [getattr(instancia, meta.get_field(campo.lstrip('-')).attname) for campo in orden]
+
+    def decodificar_cursor(self, request, orden):
+        """Valores del cursor (una lista con un valor por campo de `orden`) o None sin cursor."""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            posicion = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound('Cursor inválido.')
+        if not isinstance(posicion, list) or len(posicion) != len(orden):
+            raise NotFound('Cursor inválido.')
+        return posicion
+
+    @staticmethod
+    def codificar_cursor(valores):
+        # isoformat conserva microsegundos; DjangoJSONEncoder los truncaría.
+        valores = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in valores]
+        return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+    def get_next_link(self):
+        if self.siguiente is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limite_query_param, self.limite)
+        return replace_query_param(url, self.cursor_query_param, self.codificar_cursor(self.siguiente))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'siguiente': self.get_next_link(),
+            'hay_mas': self.hay_mas,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['hay_mas', 'results'],
+            'properties': {
+                'siguiente': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'hay_mas': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+
+class PaginacionKeysetObligatoria(PaginacionKeyset):
+    """PaginacionKeyset que pagina siempre: sin ?limite= entrega limite_default filas."""
+    obligatoria = True
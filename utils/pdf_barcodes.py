@@ -1,5 +1,16 @@
+import atexit
+import hashlib
 import io
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import NamedTuple
 
+import pypdfium2
+from django.conf import settings
+from django.core.cache import cache
 from reportlab.graphics.barcode.code128 import Code128
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
@@ -17,39 +28,224 @@ PAGE_W, PAGE_H = letter
 LABEL_W = PAGE_W / COLS
 LABEL_H = PAGE_H / ROWS
 
+# Con más etiquetas que esto las páginas se dibujan en varios procesos
+# (~0.3 ms por etiqueta en serie) y los PDF parciales se unen al final.
+UMBRAL_PARALELO = 2000
+PAGINAS_POR_PARTE = 20
+# Por worker web: con varios workers de gunicorn el total es workers × PROCESOS.
+PROCESOS = min(os.cpu_count() or 1, settings.ETIQUETAS_PROCESOS)
+TIEMPO_CACHE = 60 * 60 * 24
+# Los PDF más grandes que esto no se guardan: con DatabaseCache cada uno sería
+# una fila (en base64) que se lee y se escribe entera.
+MAXIMO_CACHE = 2 * 1024 * 1024
 
-def generate_lot_labels_pdf(lots):
+_pool = None
+
+
+class Etiqueta(NamedTuple):
+    """Contenido de una etiqueta: solo texto, para poder enviarla a otro proceso."""
+    codigo: str  # código de barras y línea en Courier
+    texto: str  # producto
+    detalle: str  # línea inferior
+
+
+def etiquetas_de_lotes(lots):
+    """Una etiqueta por lote; los lotes deben traer su producto (select_related)."""
+    return [
+        Etiqueta(
+            lot.codigo_lote,
+            f'{lot.producto.codigo_interno} - {lot.producto.descripcion}',
+            f'Cant: {lot.cantidad_inicial}  |  {lot.fecha_entrada.strftime("%d/%m/%Y")}',
+        )
+        for lot in lots
+    ]
+
+
+def etiquetas_de_unidades(lots):
+    """Una etiqueta por unidad (individual o compacta), recorriendo cada lote sin cargarlo entero."""
+    for lot in lots:
+        texto = f'{lot.producto.codigo_interno} - {lot.producto.descripcion}'
+        detalle = f'Lote {lot.codigo_lote}'
+        for unidad in lot.iter_unidades():
+            yield Etiqueta(unidad.codigo_unidad, texto, detalle)
+
+
+def _dibujar(c, pos, etiqueta):
+    col = pos % COLS
+    row = pos // COLS
+    x0 = col * LABEL_W + MARGIN_LEFT
+    y0 = PAGE_H - (row + 1) * LABEL_H + MARGIN_TOP
+
+    c.rect(x0 - 0.05 * inch, y0 - 0.05 * inch,
+           LABEL_W - 0.2 * inch, LABEL_H - 0.25 * inch)
+
+    bc = Code128(value=etiqueta.codigo, barHeight=24, barWidth=0.6)
+    bc.drawOn(c, x0, y0 + 34)
+
+    c.setFont('Helvetica', 6)
+    prod_text = etiqueta.texto
+    max_chars = int((LABEL_W - 0.3 * inch) / 2.5)
+    if len(prod_text) > max_chars:
+        prod_text = prod_text[:max_chars - 3] + '...'
+    c.drawString(x0, y0 + 26, prod_text)
+
+    c.setFont('Courier', 8)
+    c.drawString(x0, y0 + 16, etiqueta.codigo)
+
+    c.setFont('Helvetica', 6.5)
+    c.drawString(x0, y0 + 6, etiqueta.detalle)
+
+
+def render_etiquetas(etiquetas):
+    """PDF con las etiquetas en hojas carta de COLS × ROWS, dibujado en este proceso."""
     buf = io.BytesIO()
     c = canvas.Canvas(buf, pagesize=letter)
 
-    for idx, lot in enumerate(lots):
+    for idx, etiqueta in enumerate(etiquetas):
         pos = idx % LABELS_PER_PAGE
         if pos == 0 and idx > 0:
             c.showPage()
+        _dibujar(c, pos, etiqueta)
 
-        col = pos % COLS
-        row = pos // COLS
-        x0 = col * LABEL_W + MARGIN_LEFT
-        y0 = PAGE_H - (row + 1) * LABEL_H + MARGIN_TOP
+    c.save()
+    return buf.getvalue()
 
-        c.rect(x0 - 0.05 * inch, y0 - 0.05 * inch,
-               LABEL_W - 0.2 * inch, LABEL_H - 0.25 * inch)
 
-        bc = Code128(value=lot.codigo_lote, barHeight=24, barWidth=0.6)
-        bc.drawOn(c, x0, y0 + 34)
+def _obtener_pool():
+    global _pool
+    if _pool is None:
+        # spawn: no se copian conexiones ni hilos del worker web.
+        _pool = ProcessPoolExecutor(max_workers=PROCESOS, mp_context=multiprocessing.get_context('spawn'))
+        # Sin esto los procesos hijos sobreviven al reinicio del worker web.
+        atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+    return _pool
 
-        c.setFont('Helvetica', 6)
-        prod_text = f'{lot.producto.codigo_interno} - {lot.producto.descripcion}'
-        max_chars = int((LABEL_W - 0.3 * inch) / 2.5)
-        if len(prod_text) > max_chars:
-            prod_text = prod_text[:max_chars - 3] + '...'
-        c.drawString(x0, y0 + 26, prod_text)
 
-        c.setFont('Courier', 8)
-        c.drawString(x0, y0 + 16, lot.codigo_lote)
+def unir_pdfs(partes):
+    documento = pypdfium2.PdfDocument.new()
+    for parte in partes:
+        documento.import_pages(pypdfium2.PdfDocument(parte))
+    buf = io.BytesIO()
+    documento.save(buf)
+    return buf.getvalue()
 
-        c.setFont('Helvetica', 6.5)
-        c.drawString(x0, y0 + 6, f'Cant: {lot.cantidad_inicial}  |  {lot.fecha_entrada.strftime("%d/%m/%Y")}')
 
-    c.save()
-    return buf.getvalue()
+def generar_pdf(etiquetas):
+    """Como render_etiquetas; los lotes grandes se reparten por páginas entre PROCESOS."""
+    etiquetas = list(etiquetas)
+    if len(etiquetas) <= UMBRAL_PARALELO or PROCESOS < 2:
+        return render_etiquetas(etiquetas)
+
+    tamano = PAGINAS_POR_PARTE * LABELS_PER_PAGE  # cada parte empieza en una hoja nueva
+    partes = [etiquetas[i:i + tamano] for i in range(0, len(etiquetas), tamano)]
+    return unir_pdfs(_obtener_pool().map(render_etiquetas, partes))
+
+
+def generar_pdf_cacheado(prefijo, etiquetas):
+    """generar_pdf guardado en la caché bajo `prefijo` y el contenido de las etiquetas.
+
+    Cambiar un lote o su producto cambia la llave: no hay que invalidar nada.
+    Los PDF de más de MAXIMO_CACHE bytes se generan cada vez.
+    """
+    etiquetas = list(etiquetas)
+    llave = f'{prefijo}:{hashlib.sha256(repr(etiquetas).encode()).hexdigest()}'
+    pdf = cache.get(llave)
+    if pdf is None:
+        pdf = generar_pdf(etiquetas)
+        if len(pdf) <= MAXIMO_CACHE:
+            cache.set(llave, pdf, TIEMPO_CACHE)
+    return pdf
+
+
+class _LienzoPagina:
+    """Lo que usan _dibujar y Code128 de un Canvas de reportlab, como operadores PDF de una hoja."""
+    FUENTES = {'Helvetica': 'F1', 'Courier': 'F2'}
+
+    def __init__(self):
+        self.operadores = []
+        self.fuente = ('F1', 10)
+
+    def saveState(self):
+        self.operadores.append('q')
+
+    def restoreState(self):
+        self.operadores.append('Q')
+
+    def translate(self, x, y):
+        self.operadores.append(f'1 0 0 1 {x:.2f} {y:.2f} cm')
+
+    def rect(self, x, y, width, height, stroke=1, fill=0):
+        pintar = ('B' if stroke else 'f') if fill else 'S'
+        self.operadores.append(f'{x:.2f} {y:.2f} {width:.2f} {height:.2f} re {pintar}')
+
+    def setFont(self, nombre, tamano):
+        self.fuente = (self.FUENTES[nombre], tamano)
+
+    def drawString(self, x, y, texto):
+        # WinAnsiEncoding: los bytes cp1252 se pasan tal cual como latin-1.
+        texto = texto.encode('cp1252', 'replace').decode('latin-1')
+        texto = texto.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        self.operadores.append(f'BT /{self.fuente[0]} {self.fuente[1]:g} Tf {x:.2f} {y:.2f} Td ({texto}) Tj ET')
+
+    def contenido(self):
+        return '\n'.join(self.operadores).encode('latin-1')
+
+
+def pdf_en_streaming(etiquetas):
+    """Genera el PDF de las etiquetas por bloques de bytes, una hoja a la vez.
+
+    reportlab guarda todas las hojas hasta save(); aquí cada hoja se escribe en
+    cuanto se llena, así que la memoria no depende del número de etiquetas
+    (solo se recuerdan las posiciones de los objetos para la tabla xref).
+    Mismo diseño que render_etiquetas: las pruebas comparan ambas salidas pixel
+    a pixel, porque _LienzoPagina depende de lo que Code128.drawOn llama en la
+    versión de reportlab fijada en requirements.txt.
+    """
+    posiciones = {}
+    escrito = 0
+
+    def objeto(numero, cuerpo):
+        nonlocal escrito
+        posiciones[numero] = escrito
+        datos = f'{numero} 0 obj\n'.encode() + cuerpo + b'\nendobj\n'
+        escrito += len(datos)
+        return datos
+
+    # 1: catálogo, 2: árbol de páginas, 3 y 4: fuentes; las hojas desde 5.
+    encabezado = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    escrito = len(encabezado)
+    yield encabezado
+
+    paginas = []
+    etiquetas = iter(etiquetas)
+    while hoja := list(islice(etiquetas, LABELS_PER_PAGE)):
+        lienzo = _LienzoPagina()
+        for pos, etiqueta in enumerate(hoja):
+            _dibujar(lienzo, pos, etiqueta)
+        contenido = zlib.compress(lienzo.contenido())
+        numero = 5 + 2 * len(paginas)
+        paginas.append(numero + 1)
+        yield objeto(
+            numero,
+            f'<< /Length {len(contenido)} /Filter /FlateDecode >>\nstream\n'.encode() + contenido + b'\nendstream',
+        ) + objeto(numero + 1, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_W:g} {PAGE_H:g}] '
+            f'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {numero} 0 R >>'
+        ).encode())
+
+    kids = ' '.join(f'{n} 0 R' for n in paginas)
+    final = b''.join([
+        objeto(1, b'<< /Type /Catalog /Pages 2 0 R >>'),
+        objeto(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(paginas)} >>'.encode()),
+        objeto(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'),
+        objeto(4, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>'),
+    ])
+    total = 5 + 2 * len(paginas)
+    xref = [f'xref\n0 {total}\n0000000000 65535 f \n']
+    xref += [f'{posiciones[n]:010d} 00000 n \n' for n in range(1, total)]
+    xref.append(f'trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{escrito}\n%%EOF\n')
+    yield final + ''.join(xref).encode()
+
+
+def generate_lot_labels_pdf(lots):
+    return generar_pdf(etiquetas_de_lotes(lots))
@@ -0,0 +1,34 @@
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, StreamingHttpResponse
+
+_FIN = object()
+
+
+class StreamingAsgiMixin:
+    """Envía un iterador síncrono bloque por bloque también bajo ASGI.
+
+    Con un iterador síncrono, StreamingHttpResponse.__aiter__ lo consume
+    completo (sync_to_async(list)) antes de enviar el primer byte, así que en
+    producción (uvicorn) la respuesta se arma entera en memoria. Aquí cada
+    bloque se pide con su propio sync_to_async, en el hilo del request
+    (thread_sensitive), donde viven la conexión y los cursores de la vista.
+    Bajo WSGI no cambia nada.
+    """
+
+    async def __aiter__(self):
+        if self.is_async:
+            async for parte in super().__aiter__():
+                yield parte
+            return
+        bloques = iter(self.streaming_content)
+        siguiente = sync_to_async(next, thread_sensitive=True)
+        while (parte := await siguiente(bloques, _FIN)) is not _FIN:
+            yield parte
+
+
+class RespuestaStreaming(StreamingAsgiMixin, StreamingHttpResponse):
+    pass
+
+
+class ArchivoStreaming(StreamingAsgiMixin, FileResponse):
+    pass
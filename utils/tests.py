@@ -1,8 +1,37 @@
+import asyncio
+import io
+import sys
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth.models import User, AnonymousUser
-from django.test import TestCase, RequestFactory
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.urls import path
+import pypdfium2
+from openpyxl import load_workbook
 
 from organizacion.models import PerfilUsuario, Sucursal
+from utils.exports import MUESTRA_ANCHOS, build_xlsx, xlsx_response
+from utils import exports, pdf_barcodes
 from utils.permissions import HasValidBranch
+from utils.streaming import ArchivoStreaming, RespuestaStreaming
+
+
+# StreamingAsgiTest usa este módulo como ROOT_URLCONF; cada prueba cambia _respuesta_asgi.
+def _respuesta_asgi():
+    raise NotImplementedError
+
+
+def _vista_asgi(request):
+    return _respuesta_asgi()
+
+
+urlpatterns = [path('streaming/', _vista_asgi)]
 
 
 class HasValidBranchTest(TestCase):
@@ -57,3 +86,205 @@ class HasValidBranchTest(TestCase):
         request = self._make_request(branch_id=sucursal_inactiva.id)
         result = self.permission.has_permission(request, self.view)
         self.assertFalse(result)
+
+
+class ExportacionXlsxTest(SimpleTestCase):
+    def test_respuesta_en_streaming_desde_un_generador(self):
+        consumidas = []
+
+        def filas():
+            for i in range(5000):
+                consumidas.append(i)
+                yield [i, f'fila {i}']
+
+        response = xlsx_response(['N', 'Texto'], filas(), 'prueba.xlsx', sheet_title='Prueba')
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(consumidas, [])  # nada se genera hasta enviar la respuesta
+
+        ws = load_workbook(io.BytesIO(response.getvalue()), read_only=True)['Prueba']
+        filas_leidas = list(ws.values)
+        self.assertEqual(filas_leidas[0], ('N', 'Texto'))
+        self.assertEqual(len(filas_leidas), 5001)
+        self.assertEqual(filas_leidas[-1], (4999, 'fila 4999'))
+
+    def test_anchos_desde_la_muestra(self):
+        filas = [['x' * 10]] * MUESTRA_ANCHOS + [['x' * 100]]
+        ws = load_workbook(io.BytesIO(build_xlsx(['Col'], iter(filas)))).active
+        self.assertEqual(ws.column_dimensions['A'].width, 12)
+        self.assertEqual(ws['A1'].font.b, True)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class StreamingAsgiTest(SimpleTestCase):
+    def _por_asgi(self, crear_respuesta):
+        """Pasa un GET por ASGIHandler como lo haría uvicorn.
+
+        Devuelve el cuerpo y, por cada mensaje enviado, cuántos bloques había
+        producido la respuesta hasta ese momento.
+        """
+        producidos = []
+
+        def respuesta():
+            response = crear_respuesta()
+
+            def contar(bloques):
+                for bloque in bloques:
+                    producidos.append(bloque)
+                    yield bloque
+
+            response.streaming_content = contar(response.streaming_content)
+            return response
+
+        enviados = []
+        peticion = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if peticion:
+                return peticion.pop()
+            await asyncio.Event().wait()  # el cliente nunca se desconecta
+
+        async def send(mensaje):
+            if mensaje['type'] == 'http.response.start':
+                self.assertEqual(mensaje['status'], 200)
+            elif mensaje.get('body'):
+                enviados.append((mensaje['body'], len(producidos)))
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': '/streaming/', 'raw_path': b'/streaming/', 'root_path': '',
+            'query_string': b'', 'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        with patch.object(sys.modules[__name__], '_respuesta_asgi', respuesta), \
+                warnings.catch_warnings(record=True) as avisos:
+            warnings.simplefilter('always')
+            async_to_sync(ASGIHandler())(scope, receive, send)
+
+        self.assertFalse([a for a in avisos if 'synchronous iterators' in str(a.message)])
+        return b''.join(cuerpo for cuerpo, _ in enviados), [n for _, n in enviados]
+
+    def assertEnviadoPorBloques(self, marcas):
+        # Cada bloque sale antes de pedir el siguiente; con sync_to_async(list)
+        # todos los mensajes verían ya el total producido.
+        self.assertGreater(len(marcas), 1)
+        self.assertEqual(marcas, list(range(1, len(marcas) + 1)))
+
+    def test_xlsx(self):
+        filas = ([i, f'fila {i}'] for i in range(5000))
+        with patch.object(exports, 'TAMANO_BLOQUE', 4096):
+            cuerpo, marcas = self._por_asgi(
+                lambda: xlsx_response(['N', 'Texto'], filas, 'prueba.xlsx', sheet_title='Prueba')
+            )
+
+        self.assertEnviadoPorBloques(marcas)
+        ws = load_workbook(io.BytesIO(cuerpo), read_only=True)['Prueba']
+        self.assertEqual(list(ws.values)[-1], (4999, 'fila 4999'))
+
+    def test_csv_y_ndjson(self):
+        for formato in ('csv', 'ndjson'):
+            with self.subTest(formato=formato):
+                filas = ((i, f'fila {i}') for i in range(2500))
+                exportacion = exports.Exportacion('prueba', [exports.Hoja('Prueba', [('n', 'N'), ('texto', 'Texto')], filas)])
+                cuerpo, marcas = self._por_asgi(lambda: exports.respuesta(exportacion, formato))
+
+                self.assertEnviadoPorBloques(marcas)
+                ultima = cuerpo.decode().splitlines()[-1]
+                self.assertEqual(ultima, '2499,fila 2499' if formato == 'csv' else '{"n": 2499, "texto": "fila 2499"}')
+
+    def test_pdf_de_etiquetas(self):
+        etiquetas = (pdf_barcodes.Etiqueta(f'U-{i:06d}', 'P-1 - Producto', 'Lote L-1') for i in range(100))
+        cuerpo, marcas = self._por_asgi(
+            lambda: RespuestaStreaming(pdf_barcodes.pdf_en_streaming(etiquetas), content_type='application/pdf')
+        )
+
+        self.assertEnviadoPorBloques(marcas)
+        pdf = pypdfium2.PdfDocument(cuerpo)
+        self.assertEqual(len(pdf), 5)
+        self.assertIn('U-000099', pdf[4].get_textpage().get_text_range())
+
+    def test_archivo(self):
+        contenido = bytes(range(256)) * 1000  # ASGIHandler sube block_size a 64 KB
+        cuerpo, marcas = self._por_asgi(lambda: ArchivoStreaming(io.BytesIO(contenido), filename='prueba.bin'))
+
+        self.assertEnviadoPorBloques(marcas)
+        self.assertEqual(cuerpo, contenido)
+
+
+class EtiquetasPdfTest(SimpleTestCase):
+    def test_partes_en_paralelo_dan_las_mismas_paginas(self):
+        etiquetas = [pdf_barcodes.Etiqueta(f'L-{i:05d}', 'P-1 - Producto', 'Cant: 1') for i in range(130)]
+        serie = pypdfium2.PdfDocument(pdf_barcodes.render_etiquetas(etiquetas))
+
+        with ThreadPoolExecutor(2) as pool, \
+                patch.multiple(pdf_barcodes, UMBRAL_PARALELO=50, PAGINAS_POR_PARTE=2, PROCESOS=2), \
+                patch.object(pdf_barcodes, '_obtener_pool', return_value=pool), \
+                patch.object(pdf_barcodes, 'render_etiquetas', wraps=pdf_barcodes.render_etiquetas) as render:
+            paralelo = pypdfium2.PdfDocument(pdf_barcodes.generar_pdf(etiquetas))
+
+        self.assertEqual(render.call_count, 3)  # 48 + 48 + 34 etiquetas
+        self.assertEqual(len(paralelo), len(serie))
+        self.assertEqual(len(paralelo), 6)
+        self.assertIn('L-00129', paralelo[5].get_textpage().get_text_range())
+
+    def test_pool_acotado_y_cerrado_al_salir(self):
+        with patch.object(pdf_barcodes, '_pool', None), \
+                patch.object(pdf_barcodes, 'ProcessPoolExecutor') as ejecutor, \
+                patch.object(pdf_barcodes.atexit, 'register') as registrar:
+            pool = pdf_barcodes._obtener_pool()
+            self.assertIs(pdf_barcodes._obtener_pool(), pool)
+
+        ejecutor.assert_called_once()
+        self.assertEqual(ejecutor.call_args.kwargs['max_workers'], pdf_barcodes.PROCESOS)
+        self.assertLessEqual(pdf_barcodes.PROCESOS, settings.ETIQUETAS_PROCESOS)
+        registrar.assert_called_once_with(pool.shutdown, wait=False, cancel_futures=True)
+
+    def test_pdf_grande_no_se_guarda_en_cache(self):
+        etiquetas = [pdf_barcodes.Etiqueta(f'L-{i:05d}', 'P-1 - Producto', 'Cant: 1') for i in range(30)]
+        with patch.object(pdf_barcodes, 'cache') as cache:
+            cache.get.return_value = None
+            pdf = pdf_barcodes.generar_pdf_cacheado('prueba', etiquetas)
+            cache.set.assert_called_once()
+
+            cache.set.reset_mock()
+            with patch.object(pdf_barcodes, 'MAXIMO_CACHE', len(pdf) - 1):
+                self.assertTrue(pdf_barcodes.generar_pdf_cacheado('prueba', etiquetas).startswith(b'%PDF'))
+            cache.set.assert_not_called()
+
+    def test_streaming_igual_a_reportlab(self):
+        # pdf_en_streaming pasa su propio lienzo a Code128.drawOn: si reportlab
+        # cambia lo que dibuja (está fijado en requirements.txt), esto lo detecta.
+        etiquetas = [
+            pdf_barcodes.Etiqueta(f'U-{i:06d}', 'P-1 - Año (caja) \\ 10% ' + 'x' * 60, 'Lote L-1')
+            for i in range(pdf_barcodes.LABELS_PER_PAGE + 5)
+        ]
+        referencia = pypdfium2.PdfDocument(pdf_barcodes.render_etiquetas(etiquetas))
+        streaming = pypdfium2.PdfDocument(b''.join(pdf_barcodes.pdf_en_streaming(etiquetas)))
+
+        self.assertEqual(len(streaming), len(referencia))
+        for n in range(len(referencia)):
+            with self.subTest(pagina=n):
+                self.assertEqual(
+                    streaming[n].get_textpage().get_text_range(), referencia[n].get_textpage().get_text_range(),
+                )
+                # Mismos pixeles: barras del código, recuadros y textos.
+                self.assertEqual(
+                    bytes(streaming[n].render(scale=2).buffer), bytes(referencia[n].render(scale=2).buffer),
+                )
+        self.assertIn('U-000028', streaming[1].get_textpage().get_text_range())
+
+    def test_streaming_consume_una_hoja_a_la_vez(self):
+        consumidas = []
+
+        def etiquetas():
+            for i in range(1000):
+                consumidas.append(i)
+                yield pdf_barcodes.Etiqueta(f'U-{i:06d}', 'P-1 - Producto', 'Lote L-1')
+
+        bloques = pdf_barcodes.pdf_en_streaming(etiquetas())
+        partes = [next(bloques), next(bloques)]  # encabezado y primera hoja
+        self.assertLessEqual(len(consumidas), pdf_barcodes.LABELS_PER_PAGE + 1)
+        partes.extend(bloques)
+
+        pdf = pypdfium2.PdfDocument(b''.join(partes))
+        self.assertEqual(len(pdf), 42)
+        self.assertIn('U-000999', pdf[41].get_textpage().get_text_range())
@@ -0,0 +1,41 @@
+"""Versiones en la caché compartida para invalidar datos derivados.
+
+Una versión es (fecha, token aleatorio). Los datos se guardan junto a la
+versión con la que se calcularon; cambiar la versión basta para que nadie los
+vuelva a usar, sin borrar llaves. La fecha dice desde cuándo son viejos.
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+def nueva():
+    return (timezone.now(), uuid.uuid4().hex)
+
+
+def leer(*llaves):
+    """{llave: versión} en una sola lectura de la caché."""
+    resultado = cache.get_many(llaves)
+    for llave in llaves:
+        if llave not in resultado:
+            # Primera vez o llave desalojada: si otro worker se adelantó, gana la suya.
+            version = nueva()
+            cache.add(llave, version, None)
+            resultado[llave] = cache.get(llave) or version
+    return resultado
+
+
+def cambiar(*llaves):
+    cache.set_many({llave: nueva() for llave in llaves}, None)
+
+
+def cambiar_al_confirmar(*llaves):
+    """Cambia ya y otra vez al confirmar la transacción.
+
+    La segunda versión evita que otro worker guarde bajo la primera lo que
+    leyó antes del COMMIT.
+    """
+    cambiar(*llaves)
+    transaction.on_commit(lambda: cambiar(*llaves))